@@ -1,37 +1,124 @@
 from PIL import Image as PilImage
-from transformers import CLIPProcessor, CLIPModel
 import torch
+import threading
+import time
 import os
 
-# 自动检测设备。由于我的缓存不够，求助显存。
-# 优先使用 CUDA (NVIDIA)，其次使用 MPS (Mac M1/M2/M3)，最后兜底 CPU
-device = "cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu")
-print(f"正在使用计算设备: {device}")
-
-model_id = "openai/clip-vit-base-patch32"
-
-offline_path = "/app/offline_model"
-local_path = "../local_clip_model"
-print(f"{local_path}")
-
-if os.path.exists(os.path.join(offline_path, "config.json")):
-    print(f"使用本地离线模型: {offline_path}")
-    model_id = offline_path
-elif os.path.exists(os.path.join(local_path, "config.json")):
-    print(f"使用本地离线模型: {local_path}")
-    model_id = local_path
-else:
-    print("未找到离线模型，尝试在线下载...")
-    model_id = "openai/clip-vit-base-patch32"
-
-# 加载模型并立即移动到指定设备 (降低系统内存占用)
-try:
-    model = CLIPModel.from_pretrained(model_id, use_safetensors=True).to(device)
+# 本模块只在真正需要推理时才被导入 (views / processing 等都是在函数内导入)，
+# 模型权重则进一步推迟到第一次调用 get_clip() 时加载
+
+def _resolve_model_id():
+    offline_path = "/app/offline_model"
+    local_path = "../local_clip_model"
+
+    if os.path.exists(os.path.join(offline_path, "config.json")):
+        print(f"使用本地离线模型: {offline_path}")
+        return offline_path
+    elif os.path.exists(os.path.join(local_path, "config.json")):
+        print(f"使用本地离线模型: {local_path}")
+        return local_path
+    else:
+        print("未找到离线模型，尝试在线下载...")
+        return "openai/clip-vit-base-patch32"
+
+BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+
+def load_clip(backend='torch', device=None):
+    """
+    按推理后端构建 CLIP，返回 (model, processor, device)；不做缓存，进程内请使用 get_clip()
+    各后端都由同一个离线模型目录构建，输出向量维度一致:
+      torch       fp32，优先 CUDA / MPS
+      torch-int8  Linear 层动态量化为 int8 (仅 CPU)
+      onnx        onnxruntime 运行导出的 ONNX 图 (仅 CPU)
+      onnx-int8   ONNX 图的 int8 动态量化版本
+    onnx 后端缺少 onnxruntime 时退回 torch
+    :param device: 指定 torch 后端的设备 (如 'cpu')，为空时自动选择
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的 CLIP 后端: {backend} (可选: {', '.join(BACKENDS)})")
+
+    from transformers import CLIPProcessor, CLIPModel
+
+    if backend.startswith('onnx'):
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            print("未安装 onnxruntime，CLIP 后端退回 torch")
+            backend = 'torch'
+
+    if backend == 'torch':
+        # 自动检测设备。由于我的缓存不够，求助显存。
+        # 优先使用 CUDA (NVIDIA)，其次使用 MPS (Mac M1/M2/M3)，最后兜底 CPU
+        device = device or ("cuda" if torch.cuda.is_available() else ("mps" if torch.backends.mps.is_available() else "cpu"))
+    else:
+        # 量化算子和 onnxruntime 的默认执行器都只在 CPU 上
+        device = "cpu"
+    print(f"正在使用计算设备: {device} (后端 {backend})")
+    model_id = _resolve_model_id()
+
+    model = CLIPModel.from_pretrained(model_id, use_safetensors=True).eval()
     processor = CLIPProcessor.from_pretrained(model_id, use_safetensors=True)
-    print(f"CLIP 模型加载完成 (运行于 {device})")
-except Exception as e:
-    print(f"模型加载失败: {e}")
-    # 可以在这里做一些错误处理，比如回退到 CPU
+
+    if backend == 'torch':
+        # 加载模型并立即移动到指定设备 (降低系统内存占用)
+        model = model.to(device)
+    elif backend == 'torch-int8':
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        from .onnx_backend import OnnxClip
+        model = OnnxClip.build(model, processor, model_id, quantize=backend == 'onnx-int8')
+    return model, processor, device
+
+_clip = None
+_clip_error = None
+# 加载失败后，在这个时间点 (monotonic) 之前不再重试；每次失败等待时间翻倍
+_clip_retry_at = 0.0
+_clip_failures = 0
+_clip_lock = threading.Lock()
+
+def _retry_delay(failures):
+    from django.conf import settings
+    base = getattr(settings, 'CLIP_LOAD_RETRY_SECONDS', 30)
+    return min(base * 2 ** (failures - 1), getattr(settings, 'CLIP_LOAD_RETRY_MAX_SECONDS', 600))
+
+def get_clip():
+    """
+    懒加载 CLIP (后端由 CLIP_BACKEND 决定，默认 fp32 torch)，返回 (model, processor, device)，各线程共用同一份
+    首次调用耗时数秒、占用数百 MB；加载失败 (如首次下载超时) 后的一段时间内直接抛出，
+    之后再次尝试加载，等待时间从 CLIP_LOAD_RETRY_SECONDS 起每次翻倍，最长 CLIP_LOAD_RETRY_MAX_SECONDS
+    """
+    global _clip, _clip_error, _clip_retry_at, _clip_failures
+    if _clip is None:
+        with _clip_lock:
+            if _clip is None:
+                if _clip_error is not None and time.monotonic() < _clip_retry_at:
+                    raise RuntimeError(f"CLIP 模型不可用: {_clip_error}")
+
+                from django.conf import settings
+                try:
+                    _clip = load_clip(getattr(settings, 'CLIP_BACKEND', 'torch'))
+                except Exception as e:
+                    _clip_error = e
+                    _clip_failures += 1
+                    delay = _retry_delay(_clip_failures)
+                    _clip_retry_at = time.monotonic() + delay
+                    print(f"模型加载失败: {e} ({delay:.0f} 秒后重试)")
+                    raise
+                _clip_error = None
+                _clip_failures = 0
+                print(f"CLIP 模型加载完成 (运行于 {_clip[2]})")
+    return _clip
+
+def warmup():
+    """
+    显式预热：加载模型并编码候选标签，让第一个请求不必等待
+    由 gunicorn.conf.py (post_worker_init) 和 process_images 在 CLIP_PRELOAD=True 时于后台线程调用
+    """
+    try:
+        get_clip()
+        get_label_features()
+    except Exception as e:
+        print(f"CLIP 预热失败: {e}")
 
 CANDIDATE_LABELS = {
     "landscape": "风景",
@@ -54,48 +141,78 @@ CANDIDATE_LABELS = {
 }
 english_labels = list(CANDIDATE_LABELS.keys())
 
+def _as_features(output):
+    # transformers 5.x 的 get_*_features 返回 ModelOutput，4.x 直接返回 Tensor
+    return output if isinstance(output, torch.Tensor) else output.pooler_output
+
+_label_features = None
+_label_lock = threading.Lock()
+
+def get_label_features():
+    """
+    候选标签的文本向量 (L2 归一化, [标签数, 维度])
+    标签是常量，每个进程只需要编码一次，之后每次分类只跑视觉部分
+    """
+    global _label_features
+    if _label_features is None:
+        with _label_lock:
+            if _label_features is None:
+                model, processor, device = get_clip()
+                inputs = processor(text=english_labels, return_tensors="pt", padding=True)
+                inputs = {k: v.to(device) for k, v in inputs.items()}
+                with torch.no_grad():
+                    features = _as_features(model.get_text_features(**inputs))
+                _label_features = features / features.norm(dim=-1, keepdim=True)
+    return _label_features
+
+def _tags_from_probs(probs):
+    """probs: [标签数] 的概率分布，取 Top-3 且概率 > 0.1 的中文标签"""
+    values, indices = torch.topk(probs, 3)
+
+    suggested_tags = []
+    for score, idx in zip(values.tolist(), indices.tolist()): # .tolist() 一次性从 GPU 取回
+        if score > 0.1: 
+            en_tag = english_labels[idx]
+            cn_tag = CANDIDATE_LABELS[en_tag]
+            suggested_tags.append(cn_tag)
+    return suggested_tags
+
+def preprocess_image(image):
+    """
+    解码 + CLIP 预处理，返回 [1, 3, H, W] 的 pixel_values (CPU 上)
+    :param image: 文件对象，或已解码的 PIL Image (如 UploadImage.working_image())
+    """
+    _, processor, _ = get_clip()
+    img = image if isinstance(image, PilImage.Image) else PilImage.open(image)
+    return processor(images=img, return_tensors="pt")['pixel_values']
+
+def classify_pixels(pixel_values):
+    """
+    批量分类：pixel_values 为 [N, 3, H, W]，返回 N 个标签列表
+    文本侧使用缓存的标签向量，只需 get_image_features + 一次矩阵乘法
+    """
+    model, _, device = get_clip()
+    with torch.no_grad():
+        image_features = _as_features(model.get_image_features(pixel_values=pixel_values.to(device)))
+        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+
+        # 与 CLIPModel.forward 中 logits_per_image 的计算方式一致
+        logits_per_image = model.logit_scale.exp() * image_features @ get_label_features().t()
+    
+    # 计算相似度
+    probs = logits_per_image.softmax(dim=1)
+
+    return [_tags_from_probs(row) or ["其他"] for row in probs]
+
 def classify_image(image_file):
     """
     使用 CLIP 进行匹配
     """
     try:
-        img = PilImage.open(image_file)
+        suggested_tags = classify_pixels(preprocess_image(image_file))[0]
         
-        # 处理输入：生成 Tensor
-        inputs = processor(
-            text=english_labels, 
-            images=img, 
-            return_tensors="pt", 
-            padding=True
-        )
-
-        # inputs 是一个字典，包含 pixel_values 等，需要逐个移动
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-        
-        # 计算相似度
-        logits_per_image = outputs.logits_per_image
-        probs = logits_per_image.softmax(dim=1)
-
-        # 获取结果 (结果还在显卡上，转回 CPU 取值)
-        values, indices = torch.topk(probs, 3)
-        
-        suggested_tags = []
-        for i in range(3):
-            idx = indices[0][i].item() # .item() 会自动从 GPU 取回数值到 CPU
-            score = values[0][i].item()
-            
-            if score > 0.1: 
-                en_tag = english_labels[idx]
-                cn_tag = CANDIDATE_LABELS[en_tag]
-                suggested_tags.append(cn_tag)
-
-        if not suggested_tags:
-            return ["其他"]
-        
-        image_file.seek(0)
+        if hasattr(image_file, 'seek'):
+            image_file.seek(0)
 
         return suggested_tags
 
@@ -104,4 +221,47 @@ def classify_image(image_file):
         # 如果显存爆了 (CUDA Out of memory)，可以在这里尝试清空缓存
         if "CUDA out of memory" in str(e):
             torch.cuda.empty_cache()
-        return []
\ No newline at end of file
+        return []
+
+def encode_pixels(pixel_values):
+    """
+    批量图像向量：pixel_values 为 [N, 3, H, W]
+    :return: numpy float32 [N, 维度]，已 L2 归一化
+    """
+    model, _, device = get_clip()
+    with torch.no_grad():
+        features = _as_features(model.get_image_features(pixel_values=pixel_values.to(device)))
+    features = features / features.norm(dim=-1, keepdim=True)
+    return features.float().cpu().numpy()
+
+def encode_image(image):
+    """
+    计算图片的 CLIP 向量 (L2 归一化)，用于语义检索
+    :param image: PIL Image 或文件对象
+    :return: numpy float32 一维数组，失败返回 None
+    """
+    try:
+        img = image if isinstance(image, PilImage.Image) else PilImage.open(image)
+        return encode_pixels(preprocess_image(img.convert('RGB')))[0]
+    except Exception as e:
+        print(f"CLIP 图像编码出错: {e}")
+        return None
+
+def encode_text(text):
+    """
+    计算检索文本的 CLIP 向量 (L2 归一化)
+    :return: numpy float32 一维数组，失败返回 None
+    """
+    try:
+        model, processor, device = get_clip()
+        inputs = processor(text=[text], return_tensors="pt", padding=True, truncation=True)
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+
+        with torch.no_grad():
+            features = _as_features(model.get_text_features(**inputs))
+        features = features / features.norm(dim=-1, keepdim=True)
+
+        return features[0].float().cpu().numpy()
+    except Exception as e:
+        print(f"CLIP 文本编码出错: {e}")
+        return None
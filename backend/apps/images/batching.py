@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from django.conf import settings
+
+
+class InferenceBatcher:
+    """
+    动态批处理调度器
+    多个请求线程提交单条输入，后台线程最多等待 max_wait_ms 或凑满 max_batch_size 条后，
+    调用一次 process_batch(items) 批量推理，再把结果分发回各自的 Future。
+    """
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait_ms=10, name='inference-batcher'):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # 统计数据
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._batch_sizes = Counter()
+        self._wait_ms_total = 0.0
+        self._infer_ms_total = 0.0
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, item):
+        """提交一条输入，返回 concurrent.futures.Future"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        """阻塞等待第一条，然后在截止时间内尽量凑满一批"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _, _ in batch]
+            started = time.perf_counter()
+
+            try:
+                results = self.process_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"批处理结果数量不匹配: {len(results)} != {len(items)}")
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self._stats_lock:
+                    self._errors += 1
+                continue
+
+            finished = time.perf_counter()
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._wait_ms_total += sum(started - enqueued for _, _, enqueued in batch) * 1000
+                self._infer_ms_total += (finished - started) * 1000
+
+    def stats(self):
+        with self._stats_lock:
+            batches = self._batches
+            items = self._items
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'batches': batches,
+                'items': items,
+                'errors': self._errors,
+                'avg_batch_size': round(items / batches, 2) if batches else 0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'avg_queue_wait_ms': round(self._wait_ms_total / items, 3) if items else 0,
+                'avg_batch_infer_ms': round(self._infer_ms_total / batches, 3) if batches else 0,
+            }
+
+
+_classify_batcher = None
+_classify_lock = threading.Lock()
+
+
+def _classify_batch(pixel_values_list):
+    import torch
+    from .ai_utils import classify_pixels
+
+    return classify_pixels(torch.cat(pixel_values_list))
+
+
+def get_classify_batcher():
+    """/analyze/ 使用的 CLIP 分类批处理器 (进程内单例)"""
+    global _classify_batcher
+    if _classify_batcher is None:
+        with _classify_lock:
+            if _classify_batcher is None:
+                _classify_batcher = InferenceBatcher(
+                    _classify_batch,
+                    max_batch_size=getattr(settings, 'CLIP_BATCH_MAX_SIZE', 16),
+                    max_wait_ms=getattr(settings, 'CLIP_BATCH_MAX_WAIT_MS', 10),
+                    name='clip-classify-batcher',
+                )
+    return _classify_batcher
+
+
+def classify_image_batched(image_file, timeout=30):
+    """
+    与 ai_utils.classify_image 返回格式相同，但推理经由批处理器合并执行
+    解码和预处理在调用线程完成，只有模型前向进入队列
+    """
+    from .ai_utils import preprocess_image
+
+    try:
+        pixel_values = preprocess_image(image_file)
+        tags = get_classify_batcher().submit(pixel_values).result(timeout=timeout)
+    except Exception as e:
+        print(f"CLIP 分析出错: {e}")
+        return []
+    finally:
+        if hasattr(image_file, 'seek'):
+            image_file.seek(0)
+    return tags
@@ -0,0 +1,104 @@
+"""
+内容寻址的原图存储
+原图按 SHA-256 保存为 originals/ab/cd/<sha256>.<扩展名>，两级目录各 256 个分片，单个目录不会堆积过多文件；
+内容完全相同的上传共用一个文件，Blob.ref_count 记录引用它的图片数，release() 减到 0 时删除文件。
+上传的文件在接收时已由 uploadhandlers.py 算好 SHA-256，保存时不必再读一遍
+"""
+import hashlib
+import os
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import metrics
+from .models import Blob, Image
+
+PREFIX = 'originals/'
+
+
+def storage():
+    return Image._meta.get_field('img_url').storage
+
+
+def blob_name(digest, ext=''):
+    return f"{PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}"
+
+
+def digest_of(name):
+    """存储路径 -> SHA-256；不是内容寻址的路径 (如旧版的 uploads/%Y/%m/) 返回 None"""
+    if not name or not name.startswith(PREFIX):
+        return None
+    digest = os.path.splitext(os.path.basename(name))[0]
+    return digest if len(digest) == 64 else None
+
+
+def content_hash(file):
+    """文件内容的 SHA-256；上传处理器已经算过时直接使用"""
+    digest = getattr(file, 'sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def store(file, name=None):
+    """
+    把一个原图文件保存到内容寻址存储，返回存储路径 (赋给 Image.img_url)
+    相同内容已存在时只增加引用计数，不再写入
+    :param name: 用于取扩展名的文件名，默认为 file.name
+    """
+    with metrics.stage('store'):
+        digest = content_hash(file)
+        ext = os.path.splitext(name or file.name or '')[1]
+        try:
+            return _store(file, digest, ext)
+        except IntegrityError:
+            # 并发上传同一内容，对方先插入了记录，改为增加引用计数
+            return _store(file, digest, ext)
+
+
+def _store(file, digest, ext):
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(sha256=digest).first()
+        if blob is not None:
+            Blob.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1)
+            return blob.name
+
+        target = blob_name(digest, ext)
+        # 临时文件保存时会被移走，先取大小
+        size = file.size
+        # 没有记录却已有文件 (如迁移中断) 时，内容必然相同，直接复用
+        if not storage().exists(target):
+            saved = storage().save(target, file)
+            if saved != target:
+                # 并发写入同一路径时存储会另起文件名，保留先写入的一份
+                storage().delete(saved)
+        Blob.objects.create(sha256=digest, name=target, size=size, ref_count=1)
+        return target
+
+
+def release(name):
+    """
+    图片不再引用 name (删除图片、替换原图) 时调用；引用计数减到 0 时删除文件
+    不是内容寻址的旧路径只属于一张图片，直接删除
+    """
+    if not name:
+        return
+    digest = digest_of(name)
+    if digest is None:
+        storage().delete(name)
+        return
+
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(sha256=digest).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            Blob.objects.filter(sha256=digest).update(ref_count=F('ref_count') - 1)
+            return
+        blob.delete()
+        # 持有行锁时删除文件：并发的 store() 在锁释放后发现记录不存在，会重新写入
+        storage().delete(blob.name)
@@ -0,0 +1,166 @@
+import io
+import math
+import threading
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from PIL import Image as PilImage
+
+from .models import Derivative, Image
+from .utils import UploadImage
+
+# Pillow 中的格式名称与默认编码质量
+FORMATS = {
+    'webp': ('WEBP', 80),
+    'avif': ('AVIF', 60),
+}
+
+_signer = signing.Signer(salt='apps.images.derivatives')
+
+# 同一张图片的派生图在进程内串行生成，避免并发请求重复解码 (按图片 id 分段加锁)
+_locks = [threading.Lock() for _ in range(64)]
+
+
+def ladder_widths():
+    return sorted(set(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', [300, 800, 1600, 2560])))
+
+
+def ladder_formats():
+    """配置的格式中，当前 Pillow 能够编码的部分"""
+    PilImage.init()
+    formats = getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', ['webp'])
+    return [f for f in formats if f in FORMATS and FORMATS[f][0] in PilImage.SAVE]
+
+
+def widths_for(image):
+    """
+    该图片适用的阶梯宽度：不超过原图宽度的档位；原图比最小档还小时只保留最小档 (生成时不放大)
+    """
+    widths = ladder_widths()
+    if not image.width:
+        return widths[:1]
+    return [w for w in widths if w <= image.width] or widths[:1]
+
+
+def sign(image_id, width, fmt):
+    return _signer.signature(f"{image_id}:{width}:{fmt}")
+
+
+def check_signature(image_id, width, fmt, signature):
+    return signing.constant_time_compare(sign(image_id, width, fmt), signature or '')
+
+
+def _encode(img, fmt):
+    pil_format, default_quality = FORMATS[fmt]
+    quality = getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', {}).get(fmt, default_quality)
+    output = io.BytesIO()
+    img.save(output, pil_format, quality=quality)
+    return output.getvalue()
+
+
+def generate(image, widths, formats):
+    """
+    为一张图片生成指定的派生图 (已存在的跳过)，原图只解码一次
+    :return: {(width, format): Derivative}
+    """
+    existing = {(d.width, d.format): d for d in image.derivatives.all()}
+    missing = [(w, f) for w in widths for f in formats if (w, f) not in existing]
+    if not missing:
+        return existing
+
+    with image.img_url.open('rb') as fp:
+        ctx = UploadImage(fp)
+        # working_size 是正方形边界，竖图需要按长宽比放大，保证宽度够最大档使用
+        if ctx.width and ctx.height:
+            ratio = max(ctx.width, ctx.height) / min(ctx.width, ctx.height)
+        else:
+            ratio = 1
+        ctx.working_size = math.ceil(max(w for w, _ in missing) * ratio)
+        working = ctx.working_image()
+
+    # 从大到小生成
+    for width, fmt in sorted(missing, reverse=True):
+        if width < working.width:
+            height = max(1, round(working.height * width / working.width))
+            img = working.resize((width, height), PilImage.Resampling.LANCZOS, reducing_gap=UploadImage.REDUCING_GAP)
+        else:
+            img = working
+        data = _encode(img, fmt)
+
+        derivative = Derivative(
+            image=image, width=width, format=fmt,
+            actual_width=img.width, actual_height=img.height, file_size=len(data),
+        )
+        derivative.file.save(f"{width}w.{fmt}", ContentFile(data), save=False)
+        try:
+            with transaction.atomic():
+                derivative.save()
+        except IntegrityError:
+            # 其他进程刚刚生成了同一张，丢弃自己的文件
+            derivative.file.delete(save=False)
+            derivative = Derivative.objects.get(image=image, width=width, format=fmt)
+        existing[(width, fmt)] = derivative
+
+    return existing
+
+
+def get_derivative(image, width, fmt):
+    """返回派生图，不存在时当场生成"""
+    derivative = Derivative.objects.filter(image=image, width=width, format=fmt).first()
+    if derivative is not None:
+        return derivative
+
+    with _locks[image.id % len(_locks)]:
+        return generate(image, [width], [fmt])[(width, fmt)]
+
+
+def evict(image, widths=None, formats=None):
+    """删除派生图文件及索引；原图变化 (裁剪、HEIC 转换) 后需要调用"""
+    queryset = image.derivatives.all() if isinstance(image, Image) else Derivative.objects.filter(image_id=image)
+    if widths:
+        queryset = queryset.filter(width__in=widths)
+    if formats:
+        queryset = queryset.filter(format__in=formats)
+
+    count = 0
+    for derivative in queryset:
+        derivative.file.delete(save=False)
+        derivative.delete()
+        count += 1
+    return count
+
+
+def lazy_url(image_id, width, fmt):
+    """按需生成接口地址 (见 ImageViewSet.derivative)"""
+    url = reverse('image-derivative', kwargs={'pk': image_id, 'width': width, 'fmt': fmt})
+    return f"{url}?sig={sign(image_id, width, fmt)}"
+
+
+def srcset(image, request=None):
+    """
+    序列化器使用的 srcset 数据：{格式: "url 300w, url 800w, ..."}
+    已生成的档位直接给出 media 地址，未生成的给出带签名的按需生成地址
+    (<img srcset> 请求不会携带 JWT，签名代替权限校验)
+    """
+    if image.processing_status != Image.STATUS_DONE:
+        return {}
+
+    generated = {(d.width, d.format): d for d in image.derivatives.all()}
+    widths = widths_for(image)
+    result = {}
+    for fmt in ladder_formats():
+        entries = []
+        for width in widths:
+            derivative = generated.get((width, fmt))
+            if derivative is not None:
+                url, descriptor = derivative.file.url, derivative.actual_width
+            else:
+                url, descriptor = lazy_url(image.id, width, fmt), min(width, image.width or width)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            entries.append(f"{url} {descriptor}w")
+        result[fmt] = ", ".join(entries)
+    return result
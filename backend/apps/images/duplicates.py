@@ -0,0 +1,290 @@
+"""
+近似重复图片检测
+每张图片在后处理时由缩略图计算 64 位 dHash (Image.phash)；同一张照片的 HEIC 与导出的 JPEG、
+缩放后的副本、重新压缩的版本，哈希的汉明距离通常只有 0~4。
+各进程在内存中按用户维护多索引哈希表，"汉明距离 <= k" 的查询只核对一小部分候选，不必与全部图片比较；
+索引首次使用时从数据库载入，之后按主键增量同步 (见 DuplicateIndex.sync)。
+"""
+import functools
+import itertools
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from PIL import Image as PilImage
+
+HASH_BITS = 64
+
+
+def dhash(img, size=8):
+    """
+    差值哈希：缩小为 (size+1) x size 的灰度图，比较每行相邻像素的明暗，得到 size*size 位整数
+    只取决于图像的大致明暗结构，与尺寸、格式、压缩质量无关
+    """
+    gray = img.convert('L').resize((size + 1, size), PilImage.Resampling.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def to_db(value):
+    """无符号 64 位 -> BigIntegerField (有符号)"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def from_db(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class MultiIndex:
+    """
+    多索引哈希 (multi-index hashing)
+    把 64 位哈希切成 4 段 16 位，每段各建一张 {段值: {哈希: [图片 id]}} 的表。
+    两个哈希距离 <= k 时，由抽屉原理至少有一段的距离 <= k // 4，
+    所以只需在每张表中枚举与查询段相差不超过 k // 4 位的段值，再逐个核对候选的完整距离。
+    k = 8 时每段只查 137 个桶，均匀分布的哈希中候选约占 1%。
+    """
+    BLOCKS = 4
+    BLOCK_BITS = HASH_BITS // BLOCKS
+    BLOCK_MASK = (1 << BLOCK_BITS) - 1
+
+    def __init__(self):
+        self.tables = [{} for _ in range(self.BLOCKS)]
+        self.size = 0
+
+    def _blocks(self, value):
+        return [(value >> (i * self.BLOCK_BITS)) & self.BLOCK_MASK for i in range(self.BLOCKS)]
+
+    def add(self, value, item):
+        self.size += 1
+        for table, block in zip(self.tables, self._blocks(value)):
+            table.setdefault(block, {}).setdefault(value, []).append(item)
+
+    def remove(self, value, item):
+        found = False
+        for table, block in zip(self.tables, self._blocks(value)):
+            bucket = table.get(block)
+            items = bucket.get(value) if bucket else None
+            if not items or item not in items:
+                continue
+            found = True
+            items.remove(item)
+            if not items:
+                del bucket[value]
+                if not bucket:
+                    del table[block]
+        if found:
+            self.size -= 1
+
+    def search(self, value, k):
+        """返回 [(item, 距离)]，按距离升序"""
+        radius = min(k // self.BLOCKS, self.BLOCK_BITS)
+        masks = _flip_masks(self.BLOCK_BITS, radius)
+        candidates = set()
+        for table, block in zip(self.tables, self._blocks(value)):
+            if not table:
+                continue
+            for mask in masks:
+                bucket = table.get(block ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+
+        found = []
+        for candidate in candidates:
+            d = hamming(value, candidate)
+            if d <= k:
+                found.extend((item, d) for item in self.tables[0][candidate & self.BLOCK_MASK][candidate])
+        found.sort(key=lambda x: x[1])
+        return found
+
+
+@functools.lru_cache(maxsize=None)
+def _flip_masks(bits, radius):
+    """bits 位内至多翻转 radius 位的全部掩码 (含 0)"""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for positions in itertools.combinations(range(bits), r):
+            masks.append(sum(1 << p for p in positions))
+    return tuple(masks)
+
+
+class DuplicateIndex:
+    """
+    按用户划分的多索引哈希表 (线程安全)
+    sync() 增量同步：只查询主键大于上次最大值的图片，以及上次仍在后处理中的图片，
+    其他进程 (process_images) 写入的哈希也能在下一次查询前被看到；
+    每隔 rebuild_interval 秒完整重建一次，补上补算的哈希 (manage.py phash) 并清除其他进程删除的图片。
+    两次重建之间，已删除的图片可能残留在索引中，查询结果由调用方再按数据库过滤。
+    """
+
+    def __init__(self, sync_interval=1.0, rebuild_interval=600):
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._reset()
+        self._rebuilt_at = time.monotonic()
+
+    def _reset(self):
+        self._indexes = {}
+        self._hashes = {}       # user_id -> {image_id: hash}
+        self._owner = {}        # image_id -> user_id
+        self._pending = set()   # 已见过、后处理尚未完成的图片
+        self._max_id = 0
+        self._synced_at = 0
+
+    def _add(self, image_id, user_id, value):
+        old_user = self._owner.get(image_id)
+        if old_user is not None:
+            old = self._hashes[old_user].pop(image_id)
+            self._indexes[old_user].remove(old, image_id)
+        self._owner[image_id] = user_id
+        self._hashes.setdefault(user_id, {})[image_id] = value
+        self._indexes.setdefault(user_id, MultiIndex()).add(value, image_id)
+
+    def _remove(self, image_id):
+        self._pending.discard(image_id)
+        user_id = self._owner.pop(image_id, None)
+        if user_id is not None:
+            value = self._hashes[user_id].pop(image_id)
+            self._indexes[user_id].remove(value, image_id)
+
+    def sync(self, force=False):
+        from .models import Image
+
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._synced_at < self.sync_interval:
+                return
+            if now - self._rebuilt_at > self.rebuild_interval:
+                self._reset()
+                self._rebuilt_at = now
+
+            in_progress = (Image.STATUS_PENDING, Image.STATUS_PROCESSING)
+            fields = ('id', 'user_id', 'phash', 'processing_status')
+            rows = list(Image.objects.filter(id__gt=self._max_id).values_list(*fields))
+            if self._pending:
+                pending = list(self._pending)
+                self._pending.clear()
+                rows += Image.objects.filter(id__in=pending).values_list(*fields)
+
+            for image_id, user_id, phash, status in rows:
+                self._max_id = max(self._max_id, image_id)
+                if phash is not None:
+                    self._add(image_id, user_id, from_db(phash))
+                elif status in in_progress:
+                    self._pending.add(image_id)
+            self._synced_at = time.monotonic()
+
+    def add(self, image):
+        """本进程刚算出哈希的图片立即加入索引"""
+        if image.phash is None:
+            return
+        with self._lock:
+            self._pending.discard(image.id)
+            self._add(image.id, image.user_id, from_db(image.phash))
+
+    def remove(self, image_id):
+        with self._lock:
+            self._remove(image_id)
+
+    def find(self, user_id, value, k, exclude=None):
+        """该用户距离 <= k 的图片 [(image_id, 距离)]"""
+        self.sync()
+        with self._lock:
+            index = self._indexes.get(user_id)
+            found = index.search(value, k) if index else []
+        return [(image_id, d) for image_id, d in found if image_id != exclude]
+
+    def user_hashes(self, user_id):
+        """{image_id: 哈希}"""
+        self.sync()
+        with self._lock:
+            return dict(self._hashes.get(user_id, {}))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'images': len(self._owner),
+                'users': len(self._indexes),
+                'pending': len(self._pending),
+                'max_id': self._max_id,
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DuplicateIndex()
+    return _index
+
+
+def default_distance():
+    return getattr(settings, 'IMAGE_DUPLICATE_DISTANCE', 8)
+
+
+def find_duplicates(image, k=None):
+    """
+    与 image 属于同一用户、哈希距离 <= k 的其他图片
+    :return: [(Image, 距离)]，按距离升序；image 还没有哈希时返回空列表
+    """
+    from .models import Image
+
+    if image.phash is None:
+        return []
+    k = default_distance() if k is None else k
+    found = get_index().find(image.user_id, from_db(image.phash), k, exclude=image.id)
+    if not found:
+        return []
+    # 其他进程删除的图片可能仍在本进程的索引中，以数据库为准
+    images = Image.objects.in_bulk([image_id for image_id, _ in found])
+    return [(images[image_id], d) for image_id, d in found if image_id in images]
+
+
+def duplicate_groups(user_id, k=None):
+    """
+    把该用户的图片按 "距离 <= k" 连成组 (并查集)，返回只含 2 张及以上图片的组 [[image_id, ...], ...]
+    每张图片做一次索引查询
+    """
+    k = default_distance() if k is None else k
+    index = get_index()
+    hashes = index.user_hashes(user_id)
+
+    parent = {image_id: image_id for image_id in hashes}
+
+    def root(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for image_id, value in hashes.items():
+        for other, _ in index.find(user_id, value, k, exclude=image_id):
+            if other in parent:
+                parent[root(other)] = root(image_id)
+
+    groups = {}
+    for image_id in hashes:
+        groups.setdefault(root(image_id), []).append(image_id)
+    return sorted((sorted(g) for g in groups.values() if len(g) > 1), key=lambda g: -len(g))
+
+
+def describe(image, request=None, k=None):
+    """find_duplicates 的 API 表示 [{'id', 'distance', 'thumb_url'}]"""
+    result = []
+    for dup, d in find_duplicates(image, k):
+        thumb = dup.thumb_url.url if dup.thumb_url else None
+        if thumb and request is not None:
+            thumb = request.build_absolute_uri(thumb)
+        result.append({'id': dup.id, 'distance': d, 'thumb_url': thumb})
+    return result
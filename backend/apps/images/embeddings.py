@@ -0,0 +1,268 @@
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+# 每次参与矩阵乘法的行数：float16 -> float32 的临时副本控制在 ~16MB 以内
+CHUNK_ROWS = 8192
+
+# 已删除图片在 ids 文件中的占位值 (图片 id 从 1 开始)
+TOMBSTONE = 0
+
+
+class EmbeddingStore:
+    """
+    CLIP 图像向量库
+    vectors.f16 : N x dim 的 float16 矩阵 (已 L2 归一化)，按行追加
+    ids.i64     : 与矩阵逐行对应的图片 id，删除时原地改写为 TOMBSTONE
+    两个文件均以只读方式 mmap，多个 gunicorn worker 共享同一份页缓存；
+    写入持有排他文件锁，读取方重新映射时持共享锁，不会映射到写了一半 (如 compact 只替换了一个文件) 的状态；
+    其他进程在下次查询时根据文件大小发现新行。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, 'vectors.f16')
+        self.ids_path = os.path.join(directory, 'ids.i64')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.lock_path = os.path.join(directory, '.lock')
+
+        self._mutex = threading.Lock()
+        self._dim = None
+        self._ids = None
+        self._vectors = None
+        self._mapped_key = None
+
+    # ---------- 读取 ----------
+
+    def _read_dim(self):
+        if self._dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self._dim = json.load(f)['dim']
+        return self._dim
+
+    def _file_key(self):
+        # compact() 会替换文件，inode 变化时同样需要重新映射
+        stat = os.stat(self.ids_path)
+        return stat.st_ino, stat.st_size // 8
+
+    def _snapshot(self, locked=False):
+        """
+        返回当前 (ids, vectors) 的 mmap 视图，文件增长或被替换后重新映射
+        :param locked: 调用方已持有写锁 (compact)
+        """
+        with self._mutex:
+            dim = self._read_dim()
+            if dim is None or not os.path.exists(self.ids_path):
+                return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float16)
+
+            if self._ids is None or self._mapped_key != self._file_key():
+                if locked:
+                    self._map(dim)
+                else:
+                    # 写入方持有排他锁期间等待，两个文件总是成对映射
+                    with self._file_lock(fcntl.LOCK_SH):
+                        self._map(dim)
+            return self._ids, self._vectors
+
+    def _map(self, dim):
+        # 行数以 ids 文件为准：写入时先写向量再写 id，读到的每个 id 都有完整向量
+        self._mapped_key = key = self._file_key()
+        count = key[1]
+        if count == 0:
+            self._ids = np.empty(0, dtype=np.int64)
+            self._vectors = np.empty((0, dim), dtype=np.float16)
+        else:
+            self._ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(count,))
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(count, dim))
+
+    def image_ids(self):
+        ids, _ = self._snapshot()
+        return set(int(i) for i in ids[ids != TOMBSTONE])
+
+    def __len__(self):
+        ids, _ = self._snapshot()
+        return int(np.count_nonzero(ids != TOMBSTONE))
+
+    def _scores(self, query, vectors):
+        # 分块转换为 float32 再做矩阵乘法 (numpy 的 float16 乘法没有 BLAS 加速)，复用同一块缓冲区
+        scores = np.empty(len(vectors), dtype=np.float32)
+        buffer = np.empty((min(CHUNK_ROWS, len(vectors)), vectors.shape[1]), dtype=np.float32)
+        for start in range(0, len(vectors), CHUNK_ROWS):
+            end = min(start + CHUNK_ROWS, len(vectors))
+            chunk = buffer[:end - start]
+            np.copyto(chunk, vectors[start:end])
+            scores[start:end] = chunk @ query
+        return scores
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def search(self, query, k=10, filter_ids=None):
+        """
+        余弦相似度 Top-K
+        :param query: 查询向量
+        :param filter_ids: 可选，接收候选 id 列表，返回其中允许出现的 id 集合 (用于可见性过滤)
+        :return: [(image_id, score), ...]，按分数降序
+        """
+        ids, vectors = self._snapshot()
+        if len(ids) == 0 or k <= 0:
+            return []
+
+        query = self._normalize(query)
+        if vectors.shape[1] != len(query):
+            return []
+
+        scores = self._scores(query, vectors)
+        scores[ids == TOMBSTONE] = -np.inf
+
+        # 先取 4k 个候选做可见性过滤，不够再扩大窗口，避免对全部 id 查库
+        window = min(len(ids), k * 4)
+        while True:
+            top = np.argpartition(-scores, window - 1)[:window]
+            top = top[np.argsort(-scores[top])]
+            top = top[np.isfinite(scores[top])]
+
+            candidates = [int(i) for i in ids[top]]
+            allowed = set(candidates) if filter_ids is None else filter_ids(candidates)
+            results = [
+                (int(ids[i]), float(scores[i]))
+                for i in top if int(ids[i]) in allowed
+            ][:k]
+
+            if len(results) >= k or window >= len(ids):
+                return results
+            window = min(len(ids), window * 4)
+
+    def scores_for(self, query, image_ids):
+        """计算指定图片与查询向量的相似度，返回 {image_id: score}"""
+        ids, vectors = self._snapshot()
+        if len(ids) == 0 or not image_ids:
+            return {}
+
+        query = self._normalize(query)
+        if vectors.shape[1] != len(query):
+            return {}
+
+        rows = np.flatnonzero(np.isin(ids, list(image_ids)))
+        scores = vectors[rows].astype(np.float32) @ query
+        return {int(ids[r]): float(s) for r, s in zip(rows, scores)}
+
+    # ---------- 写入 ----------
+
+    @contextmanager
+    def _file_lock(self, operation):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_lock(self):
+        return self._file_lock(fcntl.LOCK_EX)
+
+    def _tombstone(self, image_id):
+        if not os.path.exists(self.ids_path) or os.path.getsize(self.ids_path) == 0:
+            return
+        ids = np.memmap(self.ids_path, dtype=np.int64, mode='r+')
+        rows = np.flatnonzero(ids == image_id)
+        if len(rows):
+            ids[rows] = TOMBSTONE
+            ids.flush()
+        del ids
+
+    def add(self, image_id, vector):
+        """追加 (或替换) 一张图片的向量"""
+        vector = self._normalize(vector).astype(np.float16)
+
+        with self._write_lock():
+            dim = self._read_dim()
+            if dim is None:
+                dim = len(vector)
+                with open(self.meta_path, 'w') as f:
+                    json.dump({'dim': dim}, f)
+                self._dim = dim
+            if len(vector) != dim:
+                raise ValueError(f"向量维度不匹配: {len(vector)} != {dim}")
+
+            self._tombstone(image_id)
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vector.tobytes())
+            with open(self.ids_path, 'ab') as f:
+                f.write(np.int64(image_id).tobytes())
+
+    def remove(self, image_id):
+        with self._write_lock():
+            self._tombstone(image_id)
+
+    def compact(self):
+        """重写文件，去掉已删除的行，返回回收的行数"""
+        with self._write_lock():
+            ids, vectors = self._snapshot(locked=True)
+            keep = ids != TOMBSTONE
+            removed = int(len(ids) - np.count_nonzero(keep))
+            if removed == 0:
+                return 0
+
+            kept_ids = np.array(ids[keep], dtype=np.int64)
+            kept_vectors = np.array(vectors[keep], dtype=np.float16)
+
+            # 两个文件都写完后再依次原子替换；替换期间持有写锁，读取方要等两个都替换完才重新映射，
+            # 其他进程持有的旧映射仍然有效
+            replacements = []
+            for path, data in ((self.vectors_path, kept_vectors), (self.ids_path, kept_ids)):
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(data.tobytes())
+                replacements.append((tmp_path, path))
+            for tmp_path, path in replacements:
+                os.replace(tmp_path, path)
+
+            with self._mutex:
+                self._ids = None
+                self._vectors = None
+                self._mapped_key = None
+            return removed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """进程内共享的向量库实例"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = EmbeddingStore(settings.CLIP_EMBEDDING_DIR)
+    return _store
+
+
+def embed_image(image_id, image_file):
+    """编码图片并写入向量库；模型不可用时静默跳过，不影响上传"""
+    from .inference import encode_image
+
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    vector = encode_image(image_file)
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+
+    if vector is None:
+        return False
+    get_store().add(image_id, vector)
+    return True
+
+
+def remove_image(image_id):
+    get_store().remove(image_id)
@@ -0,0 +1,185 @@
+"""
+分面计数：总数、各相册 / 标签 / 相机型号 / 拍摄年份的图片数 (GET /api/images/facets/)，
+以及按年 / 月 / 日的拍摄时间线 (GET /api/images/timeline/)
+计数保存在 tb_facet_count (FacetCount) 中，图片增删改时按差值增量更新，读取时不必对 tb_image 做 GROUP BY。
+写入方在修改前后各取一次 snapshot()，再调用 apply((修改前, 修改后))；
+没有经过这些路径的修改 (如删除用户时级联删除图片、在管理后台编辑) 会产生偏差，
+由 `python manage.py reconcile_facets` 从头重算并修正
+"""
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Category, FacetCount, Tag
+
+TOTAL = 'total'
+CATEGORY = 'category'
+TAG = 'tag'
+CAMERA = 'camera'
+YEAR = 'year'
+MONTH = 'month'
+DAY = 'day'
+
+# 时间线粒度 -> 分面；键为 ISO 格式的前缀 (2024 / 2024-05 / 2024-05-01)，按字符串比较即按时间先后
+TIMELINE = {'year': YEAR, 'month': MONTH, 'day': DAY}
+
+# user_id=0 的行：全部公开图片的合计
+PUBLIC = 0
+
+
+def _local(value):
+    # 与前端显示的拍摄时间一致，按 TIME_ZONE 划分年月日
+    return timezone.localtime(value) if timezone.is_aware(value) else value
+
+
+def signature(category_id, tag_ids, camera_model, shoot_time):
+    """一张图片计入的 {(分面, 键)}"""
+    pairs = {(TOTAL, '')}
+    if category_id:
+        pairs.add((CATEGORY, str(category_id)))
+    pairs.update((TAG, str(tag_id)) for tag_id in tag_ids)
+    if camera_model:
+        pairs.add((CAMERA, camera_model[:100]))
+    if shoot_time:
+        day = _local(shoot_time).date().isoformat()
+        pairs.update(((YEAR, day[:4]), (MONTH, day[:7]), (DAY, day)))
+    return frozenset(pairs)
+
+
+def snapshot(image, tag_ids=None):
+    """
+    图片当前计入的计数：(user_id, is_public, {(分面, 键)})
+    :param tag_ids: 调用方已知的标签 id，为空时查询数据库
+    """
+    if tag_ids is None:
+        tag_ids = image.tags.values_list('id', flat=True)
+    return image.user_id, image.is_public, signature(image.category_id, tag_ids, image.camera_model, image.shoot_time)
+
+
+def deltas(changes):
+    """[(修改前, 修改后)] -> {(分面, 键, user_id, is_public): 差值}；新建时修改前为 None，删除时修改后为 None"""
+    result = Counter()
+    for before, after in changes:
+        for snap, sign in ((before, -1), (after, 1)):
+            if snap is None:
+                continue
+            user_id, is_public, pairs = snap
+            for facet, key in pairs:
+                result[(facet, key, user_id, is_public)] += sign
+                if is_public:
+                    result[(facet, key, PUBLIC, True)] += sign
+    return {row: d for row, d in result.items() if d}
+
+
+def write(changes):
+    """
+    把差值写入计数表：先 INSERT IGNORE 补齐缺失的行，再按 (差值, 用户, 是否公开) 分组各一条 UPDATE count = count + 差值，
+    并发写入同一行时不会丢失计数
+    """
+    if not changes:
+        return
+    groups = defaultdict(list)
+    for (facet, key, user_id, is_public), d in changes.items():
+        groups[(d, user_id, is_public)].append(Q(facet=facet, key=key))
+
+    with transaction.atomic():
+        FacetCount.objects.bulk_create(
+            [FacetCount(facet=facet, key=key, user_id=user_id, is_public=is_public) for facet, key, user_id, is_public in changes],
+            ignore_conflicts=True,
+            batch_size=1000,
+        )
+        # 固定的更新顺序，减少并发事务互相等锁时的死锁
+        for (d, user_id, is_public), conditions in sorted(groups.items(), key=lambda x: (x[0][1], x[0][2], x[0][0])):
+            # 重算全部计数 (reconcile_facets) 时一组可能有上万行，分批更新
+            for i in range(0, len(conditions), 500):
+                FacetCount.objects.filter(
+                    reduce(or_, conditions[i:i + 500]), user_id=user_id, is_public=is_public
+                ).update(count=F('count') + d)
+
+
+def apply(*changes):
+    """apply((修改前, 修改后), ...)：一次写入多张图片的变化"""
+    write(deltas(changes))
+
+
+def forget(facet, key):
+    """相册 / 标签被删除时删除对应的计数行 (图片的相册被置空、标签关联被删除)"""
+    FacetCount.objects.filter(facet=facet, key=str(key)).delete()
+
+
+def _scope(user, only_my):
+    """可见范围与 ImageViewSet.get_queryset 一致 (公开 OR 自己的，only_my 时只看自己的)"""
+    if user is not None and user.is_authenticated:
+        return Q(user_id=user.id) if only_my else Q(user_id=PUBLIC) | Q(user_id=user.id, is_public=False)
+    return Q(user_id=PUBLIC)
+
+
+def facet_counts(user=None, only_my=False):
+    """
+    当前用户可见图片的分面计数
+    查询 3 次：计数表 + 相册名 + 标签名
+    """
+    counts = Counter()
+    rows = FacetCount.objects.filter(_scope(user, only_my), facet__in=(TOTAL, CATEGORY, TAG, CAMERA, YEAR), count__gt=0)
+    for facet, key, count in rows.values_list('facet', 'key', 'count'):
+        counts[(facet, key)] += count
+
+    by_facet = defaultdict(dict)
+    for (facet, key), count in counts.items():
+        by_facet[facet][key] = count
+
+    categories = Category.objects.in_bulk([int(k) for k in by_facet[CATEGORY]])
+    tags = Tag.objects.in_bulk([int(k) for k in by_facet[TAG]])
+
+    def ranked(items):
+        return sorted(items, key=lambda x: (-x['count'], str(x.get('name', ''))))
+
+    return {
+        'total': by_facet[TOTAL].get('', 0),
+        'categories': ranked(
+            {'id': c.id, 'name': c.name, 'count': by_facet[CATEGORY][str(c.id)]} for c in categories.values()
+        ),
+        'tags': ranked(
+            {'id': t.id, 'name': t.name, 'count': by_facet[TAG][str(t.id)]} for t in tags.values()
+        ),
+        'cameras': ranked({'name': name, 'count': count} for name, count in by_facet[CAMERA].items()),
+        'years': sorted(({'year': int(year), 'count': count} for year, count in by_facet[YEAR].items()),
+                        key=lambda x: -x['year']),
+    }
+
+
+def timeline(user=None, granularity='month', only_my=False, start=None, end=None):
+    """
+    当前用户可见图片按拍摄时间的分桶计数，新的在前；一次查询计数表
+    :param start / end: 只返回该日期范围 (date，含两端) 内的桶
+    :return: {'granularity', 'total', 'undated' (没有拍摄时间的图片数), 'buckets': [{'period': '2024-05', 'count': 12}, ...]}
+    """
+    facet = TIMELINE[granularity]
+    width = {YEAR: 4, MONTH: 7, DAY: 10}[facet]
+
+    rows = FacetCount.objects.filter(_scope(user, only_my), Q(facet=facet) | Q(facet=TOTAL), count__gt=0)
+    if start:
+        rows = rows.filter(Q(facet=TOTAL) | Q(key__gte=start.isoformat()[:width]))
+    if end:
+        rows = rows.filter(Q(facet=TOTAL) | Q(key__lte=end.isoformat()[:width]))
+
+    total = 0
+    buckets = Counter()
+    for row_facet, key, count in rows.values_list('facet', 'key', 'count'):
+        if row_facet == TOTAL:
+            total += count
+        else:
+            buckets[key] += count
+
+    result = {
+        'granularity': granularity,
+        'total': total,
+        'buckets': [{'period': key, 'count': buckets[key]} for key in sorted(buckets, reverse=True)],
+    }
+    if not start and not end:
+        result['undated'] = total - sum(buckets.values())
+    return result
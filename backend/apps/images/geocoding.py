@@ -0,0 +1,208 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.module_loading import import_string
+
+from . import metrics
+
+_geolocator = None
+_geolocator_lock = threading.Lock()
+
+
+def _get_geolocator():
+    # 复用同一个 Nominatim 客户端，而不是每次调用都重新创建
+    global _geolocator
+    if _geolocator is None:
+        with _geolocator_lock:
+            if _geolocator is None:
+                from geopy.geocoders import Nominatim
+                _geolocator = Nominatim(user_agent="image_manager_app", timeout=5)
+    return _geolocator
+
+
+def nominatim_reverse(lat, lon):
+    """
+    调用 Nominatim 逆地理编码
+    :return: 格式化后的地址；该坐标没有地址时返回空字符串；网络错误直接抛出 (不写入缓存)
+    """
+    location = _get_geolocator().reverse(f"{lat}, {lon}", language='zh-cn')
+
+    if not location:
+        return ""
+
+    addr = location.raw['address']
+
+    # 1. 提取省份/直辖市
+    state = addr.get('state') or ''
+
+    # 2. 提取城市 (地级单位)
+    # 优先找 state_district，找不到找 city
+    city = addr.get('state_district') or addr.get('city') or ''
+
+    # 3. 提取区县 (县级单位)
+    # 增加 suburb (社区/郊区) 和 city_district (城市区)
+    district = (
+        addr.get('county') or
+        addr.get('district') or
+        addr.get('city_district') or
+        addr.get('suburb') or
+        ''
+    )
+
+    # 4. 提取具体兴趣点 (POI)
+    poi = (
+        addr.get('building') or
+        addr.get('amenity') or
+        addr.get('tourism') or
+        addr.get('leisure') or
+        addr.get('historic') or
+        addr.get('shop') or
+        addr.get('office') or
+        addr.get('road') or
+        addr.get('village') or
+        ''
+    )
+
+    # 如果是直辖市 (state 和 city 相同)，去掉 state 避免重复 (如: 北京市北京市)
+    if state and city and (state in city or city in state):
+        state = ""
+
+    # 如果 district 和 city 相同，去掉 district
+    if district and city and (district in city):
+        district = ""
+
+    # 过滤掉空字符串，用 "·" 或 " " 连接更符合地图展示习惯
+    parts = [p for p in [state, city, district, poi] if p]
+    full_addr = "-".join(parts)
+
+    return full_addr if full_addr.strip() else location.address
+
+
+class GeocodeCache:
+    """
+    两级逆地理编码缓存
+    1. 进程内 LRU
+    2. 数据库表 tb_geocode_cache (多进程共享，重启不丢失)
+    坐标按 GEOCODE_CACHE_PRECISION 位小数量化为网格，同一网格内的照片共用一次查询；
+    同一网格的并发查询只会真正请求一次，其余线程等待同一个结果。
+    """
+
+    def __init__(self, geocoder=None, precision=3, lru_size=1024, timeout=10):
+        self._geocoder = geocoder
+        self.precision = precision
+        self.lru_size = lru_size
+        self.timeout = timeout
+
+        self._lru = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+
+    @property
+    def geocoder(self):
+        if self._geocoder is None:
+            self._geocoder = import_string(getattr(settings, 'GEOCODER', 'apps.images.geocoding.nominatim_reverse'))
+        return self._geocoder
+
+    def cell(self, lat, lon):
+        p = self.precision
+        return f"{round(lat, p):.{p}f},{round(lon, p):.{p}f}"
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _remember(self, cell, address):
+        with self._lock:
+            self._lru[cell] = address
+            self._lru.move_to_end(cell)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def lookup(self, lat, lon):
+        """
+        :return: 地址字符串 (无地址时为空字符串)；查询失败时抛出异常
+        """
+        from .models import GeocodeEntry
+
+        cell = self.cell(lat, lon)
+
+        with self._lock:
+            if cell in self._lru:
+                self._lru.move_to_end(cell)
+                self._stats['memory_hits'] += 1
+                return self._lru[cell]
+
+            future = self._inflight.get(cell)
+            owner = future is None
+            if owner:
+                future = self._inflight[cell] = Future()
+            else:
+                self._stats['coalesced'] += 1
+
+        if not owner:
+            return future.result(timeout=self.timeout)
+
+        try:
+            entry = GeocodeEntry.objects.filter(cell=cell).only('address').first()
+            if entry is not None:
+                address = entry.address
+                self._count('db_hits')
+            else:
+                self._count('misses')
+                # 网络请求 (Nominatim 等)，缓存命中时不计
+                with metrics.stage('geocoder'):
+                    address = self.geocoder(lat, lon)
+                try:
+                    with transaction.atomic():
+                        GeocodeEntry.objects.create(cell=cell, address=address[:255])
+                except IntegrityError:
+                    # 其他进程刚刚写入了同一个网格
+                    pass
+            self._remember(cell, address)
+            future.set_result(address)
+            return address
+        except Exception as e:
+            self._count('errors')
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(cell, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['lru_size'] = len(self._lru)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_geocode_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GeocodeCache(
+                    precision=getattr(settings, 'GEOCODE_CACHE_PRECISION', 3),
+                    lru_size=getattr(settings, 'GEOCODE_LRU_SIZE', 1024),
+                )
+    return _cache
+
+
+def reverse_geocode(lat, lon):
+    """带缓存的逆地理编码，失败或没有地址时返回坐标字符串"""
+    try:
+        address = get_geocode_cache().lookup(lat, lon)
+    except Exception as e:
+        print(f"地理位置解析失败: {e}")
+        address = ""
+    return address or f"{lat:.4f}, {lon:.4f}"
@@ -0,0 +1,227 @@
+"""
+CLIP 推理入口
+配置了 CLIP_INFERENCE_SOCKET 时，请求经 Unix socket 发给本机的推理守护进程
+(`python manage.py clip_server`，全机只加载一份模型)，图片像素通过共享内存传递；
+未配置时在当前进程内推理 (ai_utils + batching)，与之前的行为一致。
+本模块不导入 torch。
+"""
+import json
+import socket
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from django.conf import settings
+from PIL import Image as PilImage
+
+from . import metrics
+
+# 发给守护进程的图片尺寸上限：CLIP 预处理会把短边缩放到 224，再大没有意义
+CLIENT_IMAGE_SIZE = 448
+
+_HEADER = struct.Struct('>I')
+
+
+class InferenceUnavailable(Exception):
+    """守护进程不可用 (未启动、超时、返回错误)"""
+
+
+def send_message(sock, obj):
+    data = json.dumps(obj).encode()
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+def attach_shared_memory(name):
+    """
+    打开客户端创建的共享内存块。客户端负责 unlink，
+    这里不能让本进程的 resource_tracker 接管，否则守护进程退出时会误删或报泄漏
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 没有 track 参数
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _to_rgb(image):
+    """文件对象或 PIL Image -> 不超过 CLIENT_IMAGE_SIZE 的 RGB 图片 (不修改传入的图片)"""
+    if isinstance(image, PilImage.Image):
+        img = image.copy()
+        img.thumbnail((CLIENT_IMAGE_SIZE, CLIENT_IMAGE_SIZE))
+        return img if img.mode == 'RGB' else img.convert('RGB')
+
+    from .utils import UploadImage
+
+    # JPEG 按 DCT 缩放解码，不展开原尺寸像素
+    try:
+        return UploadImage(image, working_size=CLIENT_IMAGE_SIZE).working_image()
+    finally:
+        if hasattr(image, 'seek'):
+            image.seek(0)
+
+
+class InferenceClient:
+    """
+    推理守护进程客户端 (线程安全，每次调用一个短连接)
+    连接失败后 backoff 秒内直接视为不可用，避免每个请求都等待超时
+    """
+
+    def __init__(self, socket_path, timeout=10, backoff=5):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.backoff = backoff
+        self._down_until = 0
+
+    def call(self, message, image=None):
+        if time.monotonic() < self._down_until:
+            raise InferenceUnavailable("推理服务暂不可用")
+
+        shm = None
+        try:
+            if image is not None:
+                pixels = np.asarray(_to_rgb(image), dtype=np.uint8)
+                shm = shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+                np.ndarray(pixels.shape, dtype=np.uint8, buffer=shm.buf)[:] = pixels
+                message = dict(message, shm=shm.name, shape=list(pixels.shape))
+
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                send_message(sock, message)
+                response = recv_message(sock)
+        except (OSError, ValueError) as e:
+            # socket.timeout / ConnectionError 都是 OSError
+            self._down_until = time.monotonic() + self.backoff
+            raise InferenceUnavailable(f"{type(e).__name__}: {e}") from e
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+        if not response.get('ok'):
+            raise InferenceUnavailable(response.get('error', '推理服务返回错误'))
+        self._down_until = 0
+        return response.get('result')
+
+    def classify(self, image):
+        return self.call({'op': 'classify'}, image)
+
+    def encode_image(self, image):
+        return np.asarray(self.call({'op': 'encode_image'}, image), dtype=np.float32)
+
+    def encode_text(self, text):
+        return np.asarray(self.call({'op': 'encode_text', 'text': text}), dtype=np.float32)
+
+    def stats(self):
+        return self.call({'op': 'stats'})
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """配置了 CLIP_INFERENCE_SOCKET 时返回客户端单例，否则返回 None (进程内推理)"""
+    global _client
+    socket_path = getattr(settings, 'CLIP_INFERENCE_SOCKET', '')
+    if not socket_path:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InferenceClient(socket_path, timeout=getattr(settings, 'CLIP_INFERENCE_TIMEOUT', 10))
+    return _client
+
+
+def _remote(method, *args):
+    """
+    调用守护进程；失败时 CLIP_INFERENCE_FALLBACK=True 则返回 None 交给调用方在本进程推理，
+    否则抛出 InferenceUnavailable
+    """
+    try:
+        return getattr(get_client(), method)(*args)
+    except InferenceUnavailable as e:
+        print(f"CLIP 推理服务不可用: {e}")
+        if getattr(settings, 'CLIP_INFERENCE_FALLBACK', False):
+            return None
+        raise
+
+
+def classify_image(image):
+    """返回中文标签列表，失败返回空列表 (与 ai_utils.classify_image 相同)"""
+    with metrics.stage('classify'):
+        return _classify_image(image)
+
+
+def _classify_image(image):
+    if get_client() is not None:
+        try:
+            tags = _remote('classify', image)
+        except InferenceUnavailable:
+            return []
+        if tags is not None:
+            return tags
+
+    from .batching import classify_image_batched
+    return classify_image_batched(image)
+
+
+def encode_image(image):
+    """图片 CLIP 向量 (L2 归一化)，失败返回 None"""
+    if get_client() is not None:
+        try:
+            vector = _remote('encode_image', image)
+        except InferenceUnavailable:
+            return None
+        if vector is not None:
+            return vector
+
+    from .ai_utils import encode_image as local_encode_image
+    return local_encode_image(image)
+
+
+def encode_text(text):
+    """文本 CLIP 向量 (L2 归一化)，失败返回 None"""
+    if get_client() is not None:
+        try:
+            vector = _remote('encode_text', text)
+        except InferenceUnavailable:
+            return None
+        if vector is not None:
+            return vector
+
+    from .ai_utils import encode_text as local_encode_text
+    return local_encode_text(text)
+
+
+def stats():
+    """/analyze/stats/ 使用：守护进程或本进程批处理器的统计"""
+    client = get_client()
+    if client is not None:
+        try:
+            return dict(client.stats(), mode='server')
+        except InferenceUnavailable as e:
+            return {'mode': 'server', 'error': str(e)}
+
+    from .batching import get_classify_batcher
+    return dict(get_classify_batcher().stats(), mode='local')
@@ -0,0 +1,164 @@
+"""
+CLIP 推理守护进程 (由 `python manage.py clip_server` 启动)
+整机只持有一份模型，各 gunicorn 工作进程 / process_images 通过 inference.InferenceClient 访问，
+来自不同进程的请求经 InferenceBatcher 合并成批次推理。
+"""
+import hashlib
+import os
+import socketserver
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from PIL import Image as PilImage
+
+from .batching import InferenceBatcher
+from .inference import attach_shared_memory, recv_message, send_message
+
+
+class ClipEngine:
+    """实际的 CLIP 模型 (ai_utils)，有 GPU 时自动使用"""
+
+    def warmup(self):
+        from . import ai_utils
+        ai_utils.get_clip()
+        ai_utils.get_label_features()
+
+    def classify(self, images):
+        from . import ai_utils
+        _, processor, _ = ai_utils.get_clip()
+        return ai_utils.classify_pixels(processor(images=images, return_tensors="pt")['pixel_values'])
+
+    def encode_images(self, images):
+        from . import ai_utils
+        _, processor, _ = ai_utils.get_clip()
+        return list(ai_utils.encode_pixels(processor(images=images, return_tensors="pt")['pixel_values']))
+
+    def encode_text(self, text):
+        from . import ai_utils
+        vector = ai_utils.encode_text(text)
+        if vector is None:
+            raise RuntimeError("文本编码失败")
+        return vector
+
+
+class DummyEngine:
+    """
+    不依赖 torch 的替身，结果由输入内容决定 (相同输入得到相同输出)
+    用于在没有 GPU / 模型的环境中测试协议、共享内存、超时和并发
+    """
+    LABELS = ["风景", "海边", "猫", "狗", "建筑"]
+
+    def __init__(self, dim=512, delay_ms=0):
+        self.dim = dim
+        self.delay = delay_ms / 1000
+
+    def warmup(self):
+        pass
+
+    def _vector(self, data):
+        seed = int.from_bytes(hashlib.sha1(data).digest()[:4], 'big')
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def classify(self, images):
+        time.sleep(self.delay)
+        return [[self.LABELS[int(np.asarray(img).mean()) % len(self.LABELS)]] for img in images]
+
+    def encode_images(self, images):
+        time.sleep(self.delay)
+        return [self._vector(img.tobytes()) for img in images]
+
+    def encode_text(self, text):
+        return self._vector(text.encode())
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server
+        # 一个连接上可以连续发送多条请求，直到客户端关闭
+        while True:
+            try:
+                message = recv_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+
+            op = message.get('op')
+            server.count(op)
+            try:
+                result = server.dispatch(op, message)
+                response = {'ok': True, 'result': result}
+            except Exception as e:
+                server.count('errors')
+                response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+            try:
+                send_message(self.request, response)
+            except OSError:
+                return
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, engine, max_batch_size=16, max_wait_ms=10, timeout=30):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _Handler)
+        # 同一台机器上的其他用户 / 容器进程也需要连接
+        os.chmod(socket_path, 0o666)
+
+        self.socket_path = socket_path
+        self.engine = engine
+        self.timeout = timeout
+        self.started = time.time()
+        self._counts = Counter()
+        self._counts_lock = threading.Lock()
+        self.classify_batcher = InferenceBatcher(engine.classify, max_batch_size, max_wait_ms, name='clip-server-classify')
+        self.encode_batcher = InferenceBatcher(engine.encode_images, max_batch_size, max_wait_ms, name='clip-server-encode')
+
+    def count(self, key):
+        with self._counts_lock:
+            self._counts[key] += 1
+
+    def _read_image(self, message):
+        """从客户端的共享内存块复制出图片，随即关闭，客户端收到响应后 unlink"""
+        shm = attach_shared_memory(message['shm'])
+        try:
+            pixels = np.ndarray(tuple(message['shape']), dtype=np.uint8, buffer=shm.buf)
+            img = PilImage.fromarray(pixels.copy(), 'RGB')
+            del pixels
+        finally:
+            shm.close()
+        return img
+
+    def dispatch(self, op, message):
+        if op == 'classify':
+            return self.classify_batcher.submit(self._read_image(message)).result(timeout=self.timeout)
+        if op == 'encode_image':
+            vector = self.encode_batcher.submit(self._read_image(message)).result(timeout=self.timeout)
+            return [float(x) for x in vector]
+        if op == 'encode_text':
+            return [float(x) for x in self.engine.encode_text(message['text'])]
+        if op in ('stats', 'ping'):
+            return self.stats()
+        raise ValueError(f"未知操作: {op}")
+
+    def stats(self):
+        with self._counts_lock:
+            counts = dict(self._counts)
+        return {
+            'pid': os.getpid(),
+            'engine': type(self.engine).__name__,
+            'uptime_s': round(time.time() - self.started, 1),
+            'requests': counts,
+            'classify': self.classify_batcher.stats(),
+            'encode_image': self.encode_batcher.stats(),
+        }
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
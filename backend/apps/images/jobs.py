@@ -0,0 +1,186 @@
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Image, ProcessingJob
+from .parallel import prepared_result, submit_prepare
+from .processing import ImageDeleted, process_image
+from .responsecache import bump
+from . import metrics
+
+
+def enqueue(image, auto_tag=False):
+    """为图片创建一条后处理任务，并把图片标记为 pending"""
+    if image.processing_status != Image.STATUS_PENDING:
+        Image.objects.filter(pk=image.pk).update(processing_status=Image.STATUS_PENDING)
+        image.processing_status = Image.STATUS_PENDING
+    return ProcessingJob.objects.create(image=image, auto_tag=auto_tag)
+
+
+def enqueue_many(images, auto_tag=False):
+    """批量上传使用：一次插入多条任务 (图片需已是 pending 状态)"""
+    return ProcessingJob.objects.bulk_create([
+        ProcessingJob(image=image, auto_tag=auto_tag) for image in images
+    ])
+
+
+def requeue_stale(timeout_seconds=None):
+    """
+    工作进程崩溃后，running 状态的任务会一直挂起；超时的任务重新放回队列
+    :return: 重新入队的数量
+    """
+    if timeout_seconds is None:
+        timeout_seconds = getattr(settings, 'IMAGE_JOB_TIMEOUT', 600)
+    deadline = timezone.now() - timedelta(seconds=timeout_seconds)
+    return ProcessingJob.objects.filter(
+        status=ProcessingJob.STATUS_RUNNING, start_time__lt=deadline
+    ).update(status=ProcessingJob.STATUS_PENDING)
+
+
+def claim_job():
+    """
+    领取一条 pending 任务。
+    用带状态条件的 UPDATE 抢占 (乐观锁)，多进程 / 多线程同时领取也不会重复执行，
+    且不依赖 SELECT ... FOR UPDATE SKIP LOCKED，SQLite 下同样可用
+    """
+    candidates = ProcessingJob.objects.filter(
+        status=ProcessingJob.STATUS_PENDING
+    ).order_by('id').values_list('id', flat=True)[:10]
+
+    for job_id in candidates:
+        claimed = ProcessingJob.objects.filter(id=job_id, status=ProcessingJob.STATUS_PENDING).update(
+            status=ProcessingJob.STATUS_RUNNING,
+            start_time=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return ProcessingJob.objects.select_related('image').get(id=job_id)
+    return None
+
+
+def run_job(job, future=None):
+    """
+    执行一条已领取的任务，失败时按 IMAGE_JOB_MAX_ATTEMPTS 重试
+    :param future: 已提交到进程池的 prepare (parallel.submit_prepare)，子进程中的异常同样按失败处理
+    """
+    image = job.image
+    # 批量领取时任务可能在本批中等待了很久：开始执行时重新记录 start_time，超时从真正开始执行算起；
+    # 等待期间已超时被 requeue_stale 放回队列 (可能已被其他线程重新领取) 的任务不再执行，避免重复处理
+    started = timezone.now()
+    if not ProcessingJob.objects.filter(
+        pk=job.pk, status=ProcessingJob.STATUS_RUNNING, start_time=job.start_time
+    ).update(start_time=started):
+        print(f"任务 {job.id} 等待期间已超时重新入队，跳过")
+        return False
+    job.start_time = started
+
+    if not Image.objects.filter(pk=image.pk).update(processing_status=Image.STATUS_PROCESSING):
+        print(f"图片 {image.pk} 已删除，放弃任务 {job.id}")
+        return False
+
+    try:
+        process_image(image, auto_tag=job.auto_tag, prepared=prepared_result(future))
+    except ImageDeleted:
+        # 任务随图片一起被级联删除，无需更新
+        print(f"图片 {image.pk} 在处理过程中被删除，放弃任务 {job.id}")
+        return False
+    except Exception as e:
+        traceback.print_exc()
+        max_attempts = getattr(settings, 'IMAGE_JOB_MAX_ATTEMPTS', 3)
+        give_up = job.attempts >= max_attempts
+
+        # 图片 (及任务) 可能已在处理过程中被删除，按条件更新，0 行时什么也不做
+        ProcessingJob.objects.filter(pk=job.pk).update(
+            status=ProcessingJob.STATUS_FAILED if give_up else ProcessingJob.STATUS_PENDING,
+            error=f"{type(e).__name__}: {e}",
+            finish_time=timezone.now(),
+        )
+
+        Image.objects.filter(pk=image.pk).update(
+            processing_status=Image.STATUS_FAILED if give_up else Image.STATUS_PENDING
+        )
+        if give_up:
+            bump()
+            metrics.incr('image_failed')
+        else:
+            metrics.incr('job_retried')
+        return False
+
+    ProcessingJob.objects.filter(pk=job.pk).update(
+        status=ProcessingJob.STATUS_DONE, error='', finish_time=timezone.now(),
+    )
+    return True
+
+
+def _run_safely(job, future=None):
+    """run_job 之外的异常 (如数据库连接中断) 只影响这一条任务，不结束工作线程；任务超时后由 requeue_stale 重新入队"""
+    try:
+        return run_job(job, future)
+    except Exception:
+        traceback.print_exc()
+        return False
+
+
+def claim_jobs(count):
+    """领取最多 count 条任务"""
+    jobs = []
+    while len(jobs) < count:
+        job = claim_job()
+        if job is None:
+            break
+        jobs.append(job)
+    return jobs
+
+
+def work(stop_event=None, poll_interval=1.0, once=False, batch_size=1):
+    """
+    工作线程主循环：领取 -> 执行，队列为空时休眠 poll_interval 秒
+    :param once: 为 True 时队列清空即返回 (用于测试和一次性补处理)
+    :param batch_size: 大于 1 时一次领取多条任务，CPU 密集部分同时提交到进程池 (见 parallel.py)，
+                       其余步骤在本线程按顺序完成；各任务的 start_time 在开始执行时更新 (见 run_job)
+    """
+    while stop_event is None or not stop_event.is_set():
+        close_old_connections()
+        jobs = claim_jobs(batch_size)
+        if not jobs:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        if len(jobs) == 1:
+            _run_safely(jobs[0])
+            continue
+
+        futures = []
+        for job in jobs:
+            try:
+                futures.append(submit_prepare(job.image))
+            except Exception:
+                # 进程池不可用时退回本进程处理
+                traceback.print_exc()
+                futures.append(None)
+        for job, future in zip(jobs, futures):
+            _run_safely(job, future)
+
+
+def start_workers(count, poll_interval=1.0, once=False, batch_size=1):
+    """启动 count 个工作线程，返回 (线程列表, 停止事件)"""
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(
+            target=work, name=f'image-worker-{i}',
+            kwargs={'stop_event': stop_event, 'poll_interval': poll_interval, 'once': once, 'batch_size': batch_size},
+            daemon=True,
+        )
+        for i in range(count)
+    ]
+    for t in threads:
+        t.start()
+    return threads, stop_event
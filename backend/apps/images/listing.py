@@ -0,0 +1,112 @@
+"""
+瀑布流列表的精简表示 (GET /api/images/)
+列表卡片只用到地址、尺寸、相册、标签、上传者等少数字段，
+不再为每行实例化模型并逐字段走 ImageSerializer：
+  values(queryset)        只取 FIELDS 中的列 (.values()，上传者 / 相册名随主查询 JOIN 取出)
+  represent(rows, request) 一次查询取出本页全部标签，拼成与 ImageSerializer 同名同格式的字典
+EXIF 明细、srcset、文件大小等只在详情接口 (ImageSerializer) 返回。
+时间字段保留 datetime，由 renderers.FastJSONRenderer 编码 (格式与 DRF 相同)
+"""
+from collections import defaultdict
+
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+
+from .models import Image
+
+# (输出字段, .values() 查询字段)
+FIELDS = (
+    ('id', 'id'),
+    ('user', 'user_id'),
+    ('uploader_name', 'user__username'),
+    ('category', 'category_id'),
+    ('category_name', 'category__name'),
+    ('img_url', 'img_url'),
+    ('thumb_url', 'thumb_url'),
+    ('width', 'width'),
+    ('height', 'height'),
+    ('camera_model', 'camera_model'),
+    ('location', 'location'),
+    ('shoot_time', 'shoot_time'),
+    ('upload_time', 'upload_time'),
+    ('is_public', 'is_public'),
+    ('processing_status', 'processing_status'),
+)
+
+
+def values(queryset):
+    """列表查询改为 .values()；检索的相关度等注解一并取出，供游标分页使用"""
+    lookups = [lookup for _, lookup in FIELDS]
+    return queryset.prefetch_related(None).values(*lookups, *queryset.query.annotations)
+
+
+def _tags(image_ids):
+    """{图片 id: [{id, name, source}]}，一次查询 (关联表 JOIN 标签表)"""
+    result = defaultdict(list)
+    if not image_ids:
+        return result
+    rows = (
+        Image.tags.through.objects.filter(image_id__in=image_ids)
+        # 按 (image, tag) 唯一索引的顺序读取，不需要排序
+        .order_by('image_id', 'tag_id')
+        .values_list('image_id', 'tag_id', 'tag__name', 'tag__source')
+    )
+    for image_id, tag_id, name, source in rows:
+        result[image_id].append({'id': tag_id, 'name': name, 'source': source})
+    return result
+
+
+def _url_builder(request):
+    """与 DRF ImageField 相同：storage.url() 再补全为绝对地址，空值为 None"""
+    storage = Image._meta.get_field('img_url').storage
+    # 站内路径只拼一次协议和域名，不逐行调用 build_absolute_uri
+    origin = request.build_absolute_uri('/')[:-1] if request is not None else ''
+
+    if isinstance(storage, FileSystemStorage) and storage.base_url.startswith('/'):
+        # 本地存储的 url() 即 MEDIA_URL + 转义后的文件名，省去逐行 urljoin
+        prefix = origin + storage.base_url
+
+        def url(name):
+            return prefix + filepath_to_uri(name).lstrip('/') if name else None
+        return url
+
+    def url(name):
+        if not name:
+            return None
+        value = storage.url(name)
+        return origin + value if value.startswith('/') else value
+    return url
+
+
+def represent(rows, request=None):
+    """把 values() 的行转换为列表接口的输出"""
+    tags = _tags([row['id'] for row in rows])
+    url = _url_builder(request)
+    # 与 DRF DateTimeField 相同，转为当前时区
+    tz = timezone.get_current_timezone()
+
+    def local(value):
+        return value.astimezone(tz) if value is not None and value.tzinfo is not None else value
+
+    return [
+        {
+            'id': row['id'],
+            'user': row['user_id'],
+            'uploader_name': row['user__username'],
+            'category': row['category_id'],
+            'category_name': row['category__name'],
+            'img_url': url(row['img_url']),
+            'thumb_url': url(row['thumb_url']),
+            'width': row['width'],
+            'height': row['height'],
+            'camera_model': row['camera_model'],
+            'location': row['location'],
+            'shoot_time': local(row['shoot_time']),
+            'upload_time': local(row['upload_time']),
+            'is_public': row['is_public'],
+            'processing_status': row['processing_status'],
+            'tags': tags.get(row['id'], []),
+        }
+        for row in rows
+    ]
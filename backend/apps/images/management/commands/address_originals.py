@@ -0,0 +1,169 @@
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F
+
+from apps.images.blobs import PREFIX, blob_name, storage
+from apps.images.models import Blob, Image
+from apps.images.responsecache import bump
+
+
+def _hash(name):
+    """(路径, SHA-256, 字节数)；文件丢失时 SHA-256 为 None"""
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with storage().open(name, 'rb') as f:
+            for chunk in f.chunks():
+                sha256.update(chunk)
+                size += len(chunk)
+    except OSError:
+        return name, None, 0
+    return name, sha256.hexdigest(), size
+
+
+def _link(old, new):
+    """把旧文件放到新路径，旧文件保留到数据库更新之后再删除；本地存储用硬链接，不复制数据"""
+    try:
+        src, dst = storage().path(old), storage().path(new)
+    except NotImplementedError:
+        with storage().open(old, 'rb') as f:
+            storage().save(new, f)
+        return
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # 跨文件系统等不支持硬链接的情况
+        shutil.copyfile(src, dst)
+
+
+class Command(BaseCommand):
+    help = "把旧路径 (uploads/%Y/%m/) 下的原图迁移到内容寻址存储，内容相同的文件合并为一份，并报告回收的空间"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="并发数 (计算哈希、迁移文件)")
+        parser.add_argument('--dry-run', action='store_true', help="只计算哈希，报告可回收的空间")
+        parser.add_argument('--recount', action='store_true',
+                            help="按图片表重新计算引用计数，删除不再被引用的文件 (如删除用户时级联删除了图片)")
+
+    def handle(self, *args, **options):
+        threads = max(1, options['threads'])
+        if options['recount']:
+            self.recount(options['dry_run'])
+            return
+
+        ids_by_name = {}
+        for image_id, name in Image.objects.exclude(img_url__startswith=PREFIX).exclude(img_url='').values_list('id', 'img_url'):
+            ids_by_name.setdefault(name, []).append(image_id)
+        self.stdout.write(f"待迁移 {len(ids_by_name)} 个文件...")
+
+        # 1. 并行计算哈希 (hashlib 处理大块数据时释放 GIL)
+        groups = {}
+        sizes = {}
+        missing = 0
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for name, digest, size in pool.map(_hash, ids_by_name):
+                if digest is None:
+                    missing += 1
+                    self.stderr.write(f"文件不存在，跳过: {name}")
+                    continue
+                groups.setdefault(digest, []).append(name)
+                sizes[name] = size
+
+        total = sum(sizes.values())
+        unique = sum(sizes[names[0]] for names in groups.values())
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"共 {len(sizes)} 个文件 {_mb(total)}，去重后 {len(groups)} 个 {_mb(unique)}，"
+                f"可回收约 {_mb(total - unique)} (另有与已迁移文件相同的内容在迁移时合并)"
+            ))
+            return
+
+        # 2. 并行迁移，每个哈希一组，各组互不影响
+        def move(item):
+            digest, names = item
+            try:
+                return self.move_group(digest, names, ids_by_name, sizes), None
+            except (OSError, ValueError) as e:
+                return 0, f"{digest} 迁移失败: {e}"
+            finally:
+                close_old_connections()
+
+        reclaimed = failed = done = 0
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for freed, error in pool.map(move, groups.items()):
+                done += 1
+                reclaimed += freed
+                if error:
+                    failed += 1
+                    self.stderr.write(error)
+                if done % 500 == 0:
+                    self.stdout.write(f"已迁移 {done} 组...")
+        # 响应中的原图地址已变化
+        bump()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"完成：{len(sizes)} 个文件合并为 {len(groups) - failed} 个，失败 {failed} 组，缺失 {missing} 个，"
+            f"回收 {_mb(reclaimed)}"
+        ))
+
+    def move_group(self, digest, names, ids_by_name, sizes):
+        """迁移内容相同的一组文件，返回回收的字节数"""
+        image_ids = [image_id for name in names for image_id in ids_by_name[name]]
+        written = 0
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(sha256=digest).first()
+            if blob is None:
+                target = blob_name(digest, os.path.splitext(names[0])[1])
+                if not storage().exists(target):
+                    _link(names[0], target)
+                    written = sizes[names[0]]
+                blob = Blob.objects.create(sha256=digest, name=target, size=sizes[names[0]], ref_count=len(image_ids))
+            else:
+                Blob.objects.filter(sha256=digest).update(ref_count=F('ref_count') + len(image_ids))
+            Image.objects.filter(id__in=image_ids).update(img_url=blob.name)
+
+        # 数据库已指向新路径后再删除旧文件
+        for name in names:
+            storage().delete(name)
+        return sum(sizes[name] for name in names) - written
+
+    def recount(self, dry_run):
+        counts = dict(
+            Image.objects.filter(img_url__startswith=PREFIX)
+            .values('img_url').annotate(n=Count('id')).values_list('img_url', 'n')
+        )
+        fixed = 0
+        reclaimed = 0
+        for blob in Blob.objects.order_by('sha256').iterator(chunk_size=1000):
+            count = counts.get(blob.name, 0)
+            if count == blob.ref_count:
+                continue
+            fixed += 1
+            if dry_run:
+                reclaimed += blob.size if count == 0 else 0
+                continue
+            with transaction.atomic():
+                # 加锁后重新计数，避免与同时进行的上传冲突
+                locked = Blob.objects.select_for_update().filter(sha256=blob.sha256).first()
+                if locked is None:
+                    continue
+                count = Image.objects.filter(img_url=locked.name).count()
+                if count:
+                    Blob.objects.filter(sha256=locked.sha256).update(ref_count=count)
+                else:
+                    locked.delete()
+                    storage().delete(locked.name)
+                    reclaimed += locked.size
+
+        verb = "需修正" if dry_run else "修正"
+        self.stdout.write(self.style.SUCCESS(f"完成：{verb} {fixed} 个文件的引用计数，回收 {_mb(reclaimed)}"))
+
+
+def _mb(size):
+    return f"{size / 1024 / 1024:.2f} MB"
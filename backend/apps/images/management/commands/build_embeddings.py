@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from apps.images.embeddings import embed_image, get_store
+from apps.images.models import Image
+
+
+class Command(BaseCommand):
+    help = "为尚未编码的图片计算 CLIP 向量，并压缩向量库中已删除的行"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="重新计算全部图片的向量")
+
+    def handle(self, *args, **options):
+        store = get_store()
+        existing = set() if options['rebuild'] else store.image_ids()
+
+        queryset = Image.objects.only('id', 'img_url', 'thumb_url').order_by('id')
+
+        done = failed = 0
+        for image in queryset.iterator(chunk_size=200):
+            if image.id in existing:
+                continue
+            # 优先使用缩略图，解码更快
+            field = image.thumb_url if image.thumb_url else image.img_url
+            try:
+                with field.open('rb') as f:
+                    ok = embed_image(image.id, f)
+            except (OSError, ValueError) as e:
+                self.stderr.write(f"图片 {image.id} 读取失败: {e}")
+                ok = False
+
+            if ok:
+                done += 1
+            else:
+                failed += 1
+            if (done + failed) % 100 == 0:
+                self.stdout.write(f"已处理 {done + failed} 张图片...")
+
+        removed = store.compact()
+        self.stdout.write(self.style.SUCCESS(
+            f"完成：新增 {done} 张，失败 {failed} 张，压缩掉 {removed} 行已删除数据，当前共 {len(store)} 张"
+        ))
@@ -0,0 +1,41 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.images.inference_server import ClipEngine, DummyEngine, InferenceServer
+
+
+class Command(BaseCommand):
+    help = "启动 CLIP 推理守护进程 (Unix socket)，供本机的 Web / 后处理进程共用一份模型"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.CLIP_INFERENCE_SOCKET or '/tmp/clip.sock', help="监听的 Unix socket 路径")
+        parser.add_argument('--dummy', action='store_true', help="使用不依赖 torch 的替身模型 (测试用)")
+        parser.add_argument('--dummy-delay-ms', type=float, default=0, help="替身模型每批的模拟耗时")
+
+    def handle(self, *args, **options):
+        engine = DummyEngine(delay_ms=options['dummy_delay_ms']) if options['dummy'] else ClipEngine()
+        # 先加载模型再开始监听，客户端连上时就能立即推理
+        engine.warmup()
+
+        server = InferenceServer(
+            options['socket'], engine,
+            max_batch_size=settings.CLIP_BATCH_MAX_SIZE,
+            max_wait_ms=settings.CLIP_BATCH_MAX_WAIT_MS,
+        )
+
+        def shutdown(signum, frame):
+            # shutdown() 会等待 serve_forever 退出，不能在同一线程中调用
+            threading.Thread(target=server.shutdown).start()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        self.stdout.write(self.style.SUCCESS(f"CLIP 推理服务已启动: {options['socket']} ({type(engine).__name__})"))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.stdout.write("CLIP 推理服务已停止")
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from apps.images.derivatives import evict, generate, ladder_formats, widths_for
+from apps.images.models import Derivative, Image
+
+
+class Command(BaseCommand):
+    help = "预先生成 (warm) 或清理 (evict) 全部图片的多尺寸派生图"
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['warm', 'evict'])
+        parser.add_argument('--ids', type=int, nargs='+', help="只处理这些图片")
+        parser.add_argument('--widths', type=int, nargs='+', help="只处理这些阶梯宽度 (默认全部)")
+        parser.add_argument('--formats', nargs='+', help="只处理这些格式 (默认全部)")
+        parser.add_argument('--threads', type=int, default=2, help="warm 时的并发数")
+
+    def handle(self, *args, **options):
+        if options['action'] == 'warm':
+            self.warm(options)
+        else:
+            self.evict(options)
+
+    def warm(self, options):
+        formats = ladder_formats()
+        if options['formats']:
+            formats = [f for f in formats if f in options['formats']]
+        if not formats:
+            raise CommandError("没有可用的派生图格式，检查 IMAGE_DERIVATIVE_FORMATS")
+
+        queryset = Image.objects.filter(processing_status=Image.STATUS_DONE).prefetch_related('derivatives').order_by('id')
+        if options['ids']:
+            queryset = queryset.filter(id__in=options['ids'])
+
+        def warm_one(image):
+            widths = widths_for(image)
+            if options['widths']:
+                widths = [w for w in widths if w in options['widths']]
+            try:
+                before = len(image.derivatives.all())
+                return len(generate(image, widths, formats)) - before, None
+            except (OSError, ValueError) as e:
+                return 0, f"图片 {image.id} 生成失败: {e}"
+            finally:
+                close_old_connections()
+
+        created = failed = processed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['threads'])) as pool:
+            for count, error in pool.map(warm_one, queryset.iterator(chunk_size=200)):
+                processed += 1
+                created += count
+                if error:
+                    failed += 1
+                    self.stderr.write(error)
+                if processed % 100 == 0:
+                    self.stdout.write(f"已处理 {processed} 张图片...")
+
+        self.stdout.write(self.style.SUCCESS(f"完成：处理 {processed} 张图片，新生成 {created} 个派生图，失败 {failed} 张"))
+
+    def evict(self, options):
+        image_ids = Derivative.objects.values_list('image_id', flat=True).distinct()
+        if options['ids']:
+            image_ids = image_ids.filter(image_id__in=options['ids'])
+
+        removed = 0
+        for image_id in list(image_ids):
+            removed += evict(image_id, widths=options['widths'], formats=options['formats'])
+
+        self.stdout.write(self.style.SUCCESS(f"完成：删除 {removed} 个派生图"))
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from PIL import Image as PilImage
+
+from apps.images.duplicates import dhash, to_db
+from apps.images.models import Image
+from apps.images.responsecache import bump
+
+
+class Command(BaseCommand):
+    help = "为还没有感知哈希的已处理图片补算 phash (由缩略图计算，与上传时一致)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="重新计算全部图片 (默认只处理 phash 为空的)")
+        parser.add_argument('--threads', type=int, default=4)
+
+    def handle(self, *args, **options):
+        queryset = Image.objects.filter(processing_status=Image.STATUS_DONE).only('id', 'user_id', 'thumb_url', 'img_url', 'phash').order_by('id')
+        if not options['all']:
+            queryset = queryset.filter(phash__isnull=True)
+
+        def hash_one(image):
+            # 没有缩略图的旧数据退回原图
+            source = image.thumb_url or image.img_url
+            try:
+                with source.open('rb') as f, PilImage.open(f) as img:
+                    image.phash = to_db(dhash(img))
+                return image, None
+            except (OSError, ValueError) as e:
+                return image, f"图片 {image.id} 计算失败: {e}"
+            finally:
+                close_old_connections()
+
+        batch = []
+        updated = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['threads'])) as pool:
+            for image, error in pool.map(hash_one, queryset.iterator(chunk_size=500)):
+                if error:
+                    failed += 1
+                    self.stderr.write(error)
+                    continue
+                batch.append(image)
+                if len(batch) >= 500:
+                    updated += Image.objects.bulk_update(batch, ['phash'])
+                    batch = []
+                    self.stdout.write(f"已更新 {updated} 张图片...")
+        if batch:
+            updated += Image.objects.bulk_update(batch, ['phash'])
+
+        # 运行中的服务进程在下一次完整重建索引时 (DuplicateIndex.rebuild_interval) 载入补算的哈希
+        bump()
+        self.stdout.write(self.style.SUCCESS(f"完成：更新 {updated} 张图片，失败 {failed} 张"))
@@ -0,0 +1,66 @@
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.images import metrics
+from apps.images.jobs import requeue_stale, start_workers
+
+
+class Command(BaseCommand):
+    help = "启动上传后处理工作进程 (从 tb_processing_job 领取任务)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.IMAGE_WORKER_THREADS, help="工作线程数")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="队列为空时的轮询间隔 (秒)")
+        parser.add_argument('--once', action='store_true', help="处理完当前队列后退出")
+        parser.add_argument(
+            '--processes', type=int, default=settings.IMAGE_PROCESS_POOL_SIZE,
+            help="HEIC 转换、缩略图等 CPU 密集步骤的进程数 (0 表示在工作线程内处理)",
+        )
+        parser.add_argument(
+            '--metrics-port', type=int, default=settings.METRICS_WORKER_PORT,
+            help="在该端口 (127.0.0.1) 提供 Prometheus 的 /metrics，0 表示不提供",
+        )
+
+    def handle(self, *args, **options):
+        if settings.CLIP_PRELOAD and not settings.CLIP_INFERENCE_SOCKET:
+            # 后台加载模型，不阻塞 HEIC 转换、缩略图等不依赖模型的任务
+            from apps.images.ai_utils import warmup
+            threading.Thread(target=warmup, name='clip-warmup', daemon=True).start()
+
+        if options['metrics_port']:
+            metrics.serve(options['metrics_port'])
+            self.stdout.write(f"Prometheus 采集地址: http://127.0.0.1:{options['metrics_port']}/metrics")
+
+        requeued = requeue_stale()
+        if requeued:
+            self.stdout.write(f"重新入队 {requeued} 个超时任务")
+
+        # 进程池大小以命令行参数为准；每个工作线程一次领取 processes 条任务，保证进程池不空闲
+        settings.IMAGE_PROCESS_POOL_SIZE = options['processes']
+        threads, stop_event = start_workers(
+            options['threads'], poll_interval=options['poll_interval'], once=options['once'],
+            batch_size=max(1, options['processes']),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"已启动 {len(threads)} 个工作线程" + (f"，{options['processes']} 个处理进程" if options['processes'] > 0 else "")
+        ))
+
+        def shutdown(signum, frame):
+            self.stdout.write("正在停止，等待当前任务完成...")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        # 主线程等待工作线程结束，并每分钟回收一次超时任务
+        last_requeue = time.monotonic()
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(timeout=1)
+            if not stop_event.is_set() and time.monotonic() - last_requeue > 60:
+                requeue_stale()
+                last_requeue = time.monotonic()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.images.models import Image
+from apps.images.search import index_image
+
+
+class Command(BaseCommand):
+    help = "重建全部图片的倒排检索索引 (首次部署或索引数据异常时使用)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Image.objects.select_related('category').prefetch_related('tags').order_by('id')
+
+        count = 0
+        for image in queryset.iterator(chunk_size=batch_size):
+            index_image(image)
+            count += 1
+            if count % batch_size == 0:
+                self.stdout.write(f"已索引 {count} 张图片...")
+
+        self.stdout.write(self.style.SUCCESS(f"索引重建完成，共 {count} 张图片"))
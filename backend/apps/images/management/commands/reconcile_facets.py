@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from apps.images import facets
+from apps.images.models import FacetCount, Image
+from apps.images.responsecache import bump
+
+
+class Command(BaseCommand):
+    help = "从图片表重新计算分面计数 (相册 / 标签 / 相机 / 拍摄年月日)，报告并修正与计数表的偏差；升级后首次运行时建立计数"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="只报告偏差，不修改")
+
+    def handle(self, *args, **options):
+        tag_ids = {}
+        for image_id, tag_id in Image.tags.through.objects.values_list('image_id', 'tag_id').iterator(chunk_size=5000):
+            tag_ids.setdefault(image_id, []).append(tag_id)
+
+        fields = ('id', 'user_id', 'is_public', 'category_id', 'camera_model', 'shoot_time')
+        rows = Image.objects.values_list(*fields).iterator(chunk_size=2000)
+        expected = facets.deltas(
+            (None, (user_id, is_public, facets.signature(category_id, tag_ids.get(image_id, ()), camera_model, shoot_time)))
+            for image_id, user_id, is_public, category_id, camera_model, shoot_time in rows
+        )
+
+        actual = {
+            (facet, key, user_id, is_public): count
+            for facet, key, user_id, is_public, count
+            in FacetCount.objects.values_list('facet', 'key', 'user_id', 'is_public', 'count').iterator(chunk_size=5000)
+        }
+
+        # 与现有计数的差值，按增量写入，运行期间的并发上传不受影响
+        drift = {}
+        for row in expected.keys() | actual.keys():
+            d = expected.get(row, 0) - actual.get(row, 0)
+            if d:
+                drift[row] = d
+
+        for (facet, key, user_id, is_public), d in sorted(drift.items())[:20]:
+            self.stdout.write(f"  {facet}:{key} user={user_id} public={is_public}  {actual.get((facet, key, user_id, is_public), 0)} -> {expected.get((facet, key, user_id, is_public), 0)}")
+        if len(drift) > 20:
+            self.stdout.write(f"  ... 共 {len(drift)} 行")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"完成：{len(actual)} 行计数中 {len(drift)} 行有偏差 (未修改)"))
+            return
+
+        facets.write(drift)
+        removed, _ = FacetCount.objects.filter(count=0).delete()
+        if drift:
+            bump()
+        self.stdout.write(self.style.SUCCESS(f"完成：修正 {len(drift)} 行计数，清理 {removed} 个空行"))
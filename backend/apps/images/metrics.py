@@ -0,0 +1,265 @@
+"""
+轻量的耗时 / 计数统计，用于排查慢请求并由 Prometheus 采集:
+  stage(name)     with 块计时，计入直方图 imgmanager_stage_duration_seconds{stage=name}
+  record(timings) 把已有的 {步骤: 毫秒} (如 UploadImage.timings) 一次计入
+  incr(name)      计数器 imgmanager_events_total{event=name}
+  ServerTimingMiddleware  每个请求的耗时、SQL 条数与 SQL 耗时 (按 URL 名称分组)；
+                  请求中执行的步骤同时写入该请求的 Server-Timing 响应头 (默认只对管理员)，浏览器开发者工具中可以直接看到
+  render()        Prometheus 文本格式 (GET /api/metrics/；process_images --metrics-port)
+
+统计保存在各进程的内存中，每个进程的数据带 pid 标签，汇总时在 PromQL 中 sum without (pid)。
+开销：每次计时两次 perf_counter 加一次加锁的计数更新，每条 SQL 一次 perf_counter，可以在生产环境常开
+"""
+import hmac
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 耗时直方图的桶 (秒)：从 1ms 的 SQL 到几十秒的 HEIC 全景图转换
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_lock = threading.Lock()
+# 当前请求的 {步骤: 毫秒}，不在请求中时为 None
+_request_timings = ContextVar('request_timings', default=None)
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = _labels(labels)
+        # le 为闭区间：value 等于边界时计入该桶
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, extra):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with _lock:
+            snapshot = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_format_labels(key, extra + (("le", _number(bound)),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key, extra)} {_number(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key, extra)} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._series = {}
+
+    def inc(self, value=1, **labels):
+        key = _labels(labels)
+        with _lock:
+            self._series[key] = self._series.get(key, 0) + value
+
+    def render(self, extra):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with _lock:
+            snapshot = sorted(self._series.items())
+        lines.extend(f'{self.name}{_format_labels(key, extra)} {_number(value)}' for key, value in snapshot)
+        return lines
+
+
+STAGES = Histogram('imgmanager_stage_duration_seconds', "上传处理各步骤的耗时", DURATION_BUCKETS)
+REQUESTS = Histogram('imgmanager_request_duration_seconds', "请求耗时", DURATION_BUCKETS)
+DB_QUERIES = Histogram('imgmanager_request_db_queries', "每个请求的 SQL 条数", COUNT_BUCKETS)
+DB_TIME = Histogram('imgmanager_request_db_duration_seconds', "每个请求的 SQL 总耗时", DURATION_BUCKETS)
+EVENTS = Counter('imgmanager_events_total', "事件计数 (处理完成 / 失败等)")
+
+REGISTRY = (STAGES, REQUESTS, DB_QUERIES, DB_TIME, EVENTS)
+
+
+def _add(name, ms):
+    STAGES.observe(ms / 1000, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + ms
+
+
+@contextmanager
+def stage(name):
+    """with metrics.stage('thumbnail'): ... 计时一个步骤"""
+    if not enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add(name, (time.perf_counter() - start) * 1000)
+
+
+def record(timings):
+    """计入已经测好的 {步骤: 毫秒}"""
+    if enabled():
+        for name, ms in timings.items():
+            _add(name, ms)
+
+
+def incr(name, value=1):
+    if enabled():
+        EVENTS.inc(value, event=name)
+
+
+def render():
+    """全部统计的 Prometheus 文本格式"""
+    extra = (('pid', os.getpid()),)
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(extra))
+    return '\n'.join(lines) + '\n'
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    # 路由名称 (如 image-list)，没有名称时用路由模板，都不含具体 id，标签数量有限
+    return match.url_name or match.route or 'unmatched'
+
+
+class ServerTimingMiddleware:
+    """
+    统计每个请求的耗时与 SQL；对管理员 (或 METRICS_SERVER_TIMING=True 时对所有请求) 写 Server-Timing 响应头，如:
+        Server-Timing: tags;dur=3.1, db;desc="12 queries";dur=8.4, total;dur=25.0
+    放在 MIDDLEWARE 最前面，total 包含其余中间件的耗时
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not enabled():
+            return self.get_response(request)
+
+        timings = {}
+        db = [0, 0.0]
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(lambda *args: self._time_query(db, *args)):
+                response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        total = (time.perf_counter() - start) * 1000
+
+        view = _view_name(request)
+        REQUESTS.observe(total / 1000, view=view, method=request.method, status=f'{response.status_code // 100}xx')
+        DB_QUERIES.observe(db[0], view=view)
+        DB_TIME.observe(db[1] / 1000, view=view)
+
+        if self._show_timing(request):
+            parts = [f'{name};dur={ms:.1f}' for name, ms in timings.items()]
+            parts.append(f'db;desc="{db[0]} queries";dur={db[1]:.1f}')
+            parts.append(f'total;dur={total:.1f}')
+            response['Server-Timing'] = ', '.join(parts)
+        return response
+
+    @staticmethod
+    def _show_timing(request):
+        """Server-Timing 会暴露 SQL 条数和各步骤耗时：默认只对管理员 (is_staff) 返回，
+        不看 DEBUG：settings 中 DEBUG 写死为 True，按 DEBUG 放行等于对所有人返回"""
+        if getattr(settings, 'METRICS_SERVER_TIMING', False):
+            return True
+        # JWT 在视图中认证，DRF 会把认证后的用户写回 request.user
+        user = getattr(request, 'user', None)
+        return bool(user is not None and user.is_staff)
+
+    @staticmethod
+    def _time_query(db, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            db[0] += 1
+            db[1] += (time.perf_counter() - start) * 1000
+
+
+def _authorized(authorization, remote_addr):
+    """配置了 METRICS_TOKEN 时要求 Authorization: Bearer <token>，否则只允许本机访问"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        return hmac.compare_digest(authorization or '', f'Bearer {token}')
+    return remote_addr in ('127.0.0.1', '::1')
+
+
+def metrics_view(request):
+    """
+    Prometheus 采集接口 (本进程的统计)
+    URL: GET /api/metrics/
+    """
+    if not _authorized(request.META.get('HTTP_AUTHORIZATION'), request.META.get('REMOTE_ADDR')):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        if not _authorized(self.headers.get('Authorization'), self.client_address[0]):
+            self.send_error(403)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """在后台线程中提供 /metrics (没有 HTTP 接口的进程使用，如 process_images)"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
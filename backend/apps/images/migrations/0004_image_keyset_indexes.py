@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0003_alter_image_options_image_exposure_time_image_f_stop_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['-upload_time', '-id'], name='idx_image_upload_time_id'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['-shoot_time', '-id'], name='idx_image_shoot_time_id'),
+        ),
+    ]
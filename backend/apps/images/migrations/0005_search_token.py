@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0004_image_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('weight', models.SmallIntegerField(default=1)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='images.image')),
+            ],
+            options={
+                'db_table': 'tb_search_token',
+                'constraints': [models.UniqueConstraint(fields=('token', 'image'), name='uniq_search_token_image')],
+            },
+        ),
+    ]
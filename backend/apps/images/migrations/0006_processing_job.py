@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0005_search_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', '等待处理'), ('processing', '处理中'), ('done', '已完成'), ('failed', '处理失败')], default='done', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='ProcessingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', '等待中'), ('running', '执行中'), ('done', '已完成'), ('failed', '失败')], default='pending', max_length=10)),
+                ('auto_tag', models.BooleanField(default=False, help_text='是否追加 AI 标签')),
+                ('attempts', models.SmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('start_time', models.DateTimeField(blank=True, null=True)),
+                ('finish_time', models.DateTimeField(blank=True, null=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='images.image')),
+            ],
+            options={
+                'db_table': 'tb_processing_job',
+                'indexes': [models.Index(fields=['status', 'id'], name='idx_job_status_id')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:01
+
+import apps.images.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0007_geocode_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Derivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.IntegerField(help_text='阶梯宽度')),
+                ('format', models.CharField(help_text='webp / avif', max_length=8)),
+                ('file', models.FileField(max_length=200, upload_to=apps.images.models.derivative_upload_to)),
+                ('actual_width', models.IntegerField()),
+                ('actual_height', models.IntegerField()),
+                ('file_size', models.IntegerField(help_text='Unit: bytes')),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='images.image')),
+            ],
+            options={
+                'db_table': 'tb_image_derivative',
+                'constraints': [models.UniqueConstraint(fields=('image', 'width', 'format'), name='uniq_derivative_image_width_format')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0010_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(help_text='total / category / tag / camera / year', max_length=10)),
+                ('key', models.CharField(help_text='相册 / 标签 id、相机型号、年份', max_length=100)),
+                ('user_id', models.IntegerField(help_text='0 表示全部公开图片')),
+                ('is_public', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'tb_facet_count',
+                'indexes': [models.Index(fields=['user_id', 'is_public'], name='idx_facet_count_user')],
+                'constraints': [models.UniqueConstraint(fields=('facet', 'key', 'user_id', 'is_public'), name='uniq_facet_count')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+TAG_IMAGE_INDEX = 'idx_image_tag_tag_image'
+
+
+def _tag_image_index(apps):
+    through = apps.get_model('images', 'Image')._meta.get_field('tags').remote_field.through
+    return through, models.Index(fields=['tag', 'image'], name=TAG_IMAGE_INDEX)
+
+
+def add_tag_image_index(apps, schema_editor):
+    # 按标签查图片 (tag.image_set) 只读索引即可得到 image_id，不必回表
+    through, index = _tag_image_index(apps)
+    schema_editor.add_index(through, index)
+
+
+def remove_tag_image_index(apps, schema_editor):
+    through, index = _tag_image_index(apps)
+    schema_editor.remove_index(through, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0011_facet_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['is_public', '-upload_time', '-id'], name='idx_image_public_upload'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', '-upload_time', '-id'], name='idx_image_user_upload'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['category', '-upload_time', '-id'], name='idx_image_category_upload'),
+        ),
+        migrations.RunPython(add_tag_image_index, remove_tag_image_index),
+    ]
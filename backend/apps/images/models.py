@@ -19,10 +19,23 @@ class Tag(models.Model):
         return self.name
 
 class Image(models.Model):
+    # 上传后的后台处理状态 (HEIC 转换、EXIF、地理编码、缩略图等)
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    PROCESSING_STATUS_CHOICES = (
+        (STATUS_PENDING, '等待处理'),
+        (STATUS_PROCESSING, '处理中'),
+        (STATUS_DONE, '已完成'),
+        (STATUS_FAILED, '处理失败'),
+    )
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     tags = models.ManyToManyField(Tag, db_table='tb_image_tag', blank=True)
     
+    # 上传的原图保存在内容寻址存储中 (originals/ab/cd/<sha256>.<ext>，见 blobs.py)，upload_to 只用于其他途径写入的文件
     img_url = models.ImageField(upload_to='uploads/%Y/%m/')
     thumb_url = models.ImageField(upload_to='thumbs/%Y/%m/', null=True, blank=True)
     
@@ -38,10 +51,145 @@ class Image(models.Model):
     iso = models.IntegerField(null=True, blank=True)  # 新增
     f_stop = models.FloatField(null=True, blank=True) # 新增
     exposure_time = models.CharField(max_length=20, null=True, blank=True) # 新增
+
+    # 近似重复检测：由缩略图计算的 64 位 dHash，按有符号整数存储 (见 duplicates.py)
+    phash = models.BigIntegerField(null=True, blank=True)
     
     is_public = models.BooleanField(default=True)
     upload_time = models.DateTimeField(auto_now_add=True)
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_STATUS_CHOICES, default=STATUS_DONE)
 
     class Meta:
         db_table = 'tb_image'
         ordering = ['-upload_time']
+        indexes = [
+            # 游标分页使用 (排序字段, id) 作为键
+            models.Index(fields=['-upload_time', '-id'], name='idx_image_upload_time_id'),
+            models.Index(fields=['-shoot_time', '-id'], name='idx_image_shoot_time_id'),
+            # 列表的可见范围 / 筛选条件 + 按上传时间排序：未登录 (公开)、只看自己的、按相册，
+            # 范围扫描后直接按索引顺序取一页，不需要 filesort；公开 OR 自己的按 idx_image_upload_time_id 顺序扫描
+            models.Index(fields=['is_public', '-upload_time', '-id'], name='idx_image_public_upload'),
+            models.Index(fields=['user', '-upload_time', '-id'], name='idx_image_user_upload'),
+            models.Index(fields=['category', '-upload_time', '-id'], name='idx_image_category_upload'),
+            # 标签 -> 图片 (tb_image_tag 上的 tag_id, image_id) 由迁移 0012 创建，自动生成的关联表不能在这里声明索引
+        ]
+
+class Blob(models.Model):
+    """
+    内容寻址的原图文件，按 SHA-256 存放，内容相同的上传共用一个文件
+    ref_count 为 img_url 指向该文件的图片数，降为 0 时删除文件 (见 blobs.py)
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=100, help_text="存储中的路径")
+    size = models.BigIntegerField(help_text="Unit: bytes")
+    ref_count = models.IntegerField(default=0)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'tb_blob'
+
+class FacetCount(models.Model):
+    """
+    分面计数 (总数、各相册 / 标签 / 相机型号 / 拍摄年份的图片数)，由 facets.py 在图片增删改时增量维护
+    每个用户按 (是否公开) 分两行计数，user_id=0 的行是全部公开图片的合计；
+    "公开 OR 自己的" 可见范围 = user_id=0 的行 + 自己的非公开行
+    """
+    facet = models.CharField(max_length=10, help_text="total / category / tag / camera / year")
+    key = models.CharField(max_length=100, help_text="相册 / 标签 id、相机型号、年份")
+    user_id = models.IntegerField(help_text="0 表示全部公开图片")
+    is_public = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'tb_facet_count'
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'key', 'user_id', 'is_public'], name='uniq_facet_count'),
+        ]
+        indexes = [
+            models.Index(fields=['user_id', 'is_public'], name='idx_facet_count_user'),
+        ]
+
+def derivative_upload_to(instance, filename):
+    # 按图片分目录，便于整体清理
+    return f"derivatives/{instance.image_id}/{filename}"
+
+class Derivative(models.Model):
+    """
+    派生图索引：原图按宽度阶梯 (IMAGE_DERIVATIVE_WIDTHS) 缩放后的 WebP / AVIF
+    首次请求时由 derivatives.get_derivative 生成，文件保存在 media/derivatives/ 下
+    """
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='derivatives')
+    width = models.IntegerField(help_text="阶梯宽度")
+    format = models.CharField(max_length=8, help_text="webp / avif")
+    file = models.FileField(upload_to=derivative_upload_to, max_length=200)
+    # 实际尺寸 (原图比阶梯宽度小时不放大)
+    actual_width = models.IntegerField()
+    actual_height = models.IntegerField()
+    file_size = models.IntegerField(help_text="Unit: bytes")
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'tb_image_derivative'
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'width', 'format'], name='uniq_derivative_image_width_format'),
+        ]
+
+class ProcessingJob(models.Model):
+    """
+    上传后处理任务队列 (基于数据库，无需额外的消息中间件)
+    由 process_images 管理命令中的工作线程领取并执行
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, '等待中'),
+        (STATUS_RUNNING, '执行中'),
+        (STATUS_DONE, '已完成'),
+        (STATUS_FAILED, '失败'),
+    )
+
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    auto_tag = models.BooleanField(default=False, help_text="是否追加 AI 标签")
+    attempts = models.SmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    create_time = models.DateTimeField(auto_now_add=True)
+    start_time = models.DateTimeField(null=True, blank=True)
+    finish_time = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'tb_processing_job'
+        indexes = [
+            # 工作线程按 id 顺序领取 pending 任务
+            models.Index(fields=['status', 'id'], name='idx_job_status_id'),
+        ]
+
+class GeocodeEntry(models.Model):
+    """
+    逆地理编码缓存：量化后的坐标网格 -> 地址
+    由 geocoding.GeocodeCache 读写，空地址表示该网格查询过但没有结果
+    """
+    cell = models.CharField(max_length=32, unique=True, help_text="量化后的 'lat,lon'")
+    address = models.CharField(max_length=255, blank=True, default='')
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'tb_geocode_cache'
+
+class SearchToken(models.Model):
+    """
+    倒排索引：分词后的 token -> 图片
+    由 search.index_image 在图片创建 / 更新时维护
+    """
+    token = models.CharField(max_length=64)
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='search_tokens')
+    weight = models.SmallIntegerField(default=1)
+
+    class Meta:
+        db_table = 'tb_search_token'
+        constraints = [
+            # token 在前，前缀查询可以直接走这个联合索引
+            models.UniqueConstraint(fields=['token', 'image'], name='uniq_search_token_image'),
+        ]
@@ -0,0 +1,149 @@
+"""
+CLIP 的 ONNX 后端 (CLIP_BACKEND=onnx / onnx-int8)
+首次使用时把离线模型的视觉、文本两部分各导出为一个 ONNX 图，缓存在 CLIP_ONNX_DIR；
+之后由 onnxruntime 运行，对外提供与 CLIPModel 相同的 get_image_features / get_text_features / logit_scale，
+ai_utils 中的推理代码无需区分后端。
+"""
+import hashlib
+import json
+import os
+import threading
+
+import torch
+
+from .ai_utils import _as_features
+
+# 导出用的 opset；onnxruntime 1.16+ 均支持
+OPSET = 17
+
+_export_lock = threading.Lock()
+
+
+class _VisionTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return _as_features(self.model.get_image_features(pixel_values=pixel_values))
+
+
+class _TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return _as_features(self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask))
+
+
+def export_dir(model_id):
+    """按模型路径 + config.json 修改时间区分缓存，换了模型会重新导出"""
+    config = os.path.join(model_id, 'config.json')
+    stamp = str(os.path.getmtime(config)) if os.path.exists(config) else ''
+    key = hashlib.sha1(f"{os.path.abspath(model_id)}:{stamp}".encode()).hexdigest()[:12]
+    from django.conf import settings
+    return os.path.join(settings.CLIP_ONNX_DIR, key)
+
+
+def _export(module, args, path, input_names, dynamic_axes):
+    # 先写临时文件再改名，多个进程同时首次启动时不会读到写了一半的文件
+    tmp = f"{path}.{os.getpid()}.tmp"
+    torch.onnx.export(
+        module, args, tmp,
+        input_names=input_names, output_names=['features'],
+        dynamic_axes=dict(dynamic_axes, features={0: 'batch'}),
+        opset_version=OPSET, dynamo=False,
+    )
+    os.replace(tmp, path)
+
+
+def export(model, processor, directory, quantize=False):
+    """
+    导出 vision.onnx / text.onnx (以及量化版本 *.int8.onnx)，已存在则跳过
+    :return: (视觉模型路径, 文本模型路径)
+    """
+    suffix = '.int8.onnx' if quantize else '.onnx'
+    vision_path = os.path.join(directory, 'vision' + suffix)
+    text_path = os.path.join(directory, 'text' + suffix)
+
+    with _export_lock:
+        if os.path.exists(vision_path) and os.path.exists(text_path):
+            return vision_path, text_path
+
+        os.makedirs(directory, exist_ok=True)
+        fp32_vision = os.path.join(directory, 'vision.onnx')
+        fp32_text = os.path.join(directory, 'text.onnx')
+
+        if not (os.path.exists(fp32_vision) and os.path.exists(fp32_text)):
+            print(f"正在导出 CLIP ONNX 模型到 {directory} ...")
+            model = model.to('cpu').eval()
+            size = processor.image_processor.crop_size
+            pixels = torch.zeros(1, 3, size['height'], size['width'])
+            text = processor(text=["a photo", "a photo of a cat"], return_tensors="pt", padding=True)
+
+            with torch.no_grad():
+                _export(_VisionTower(model), (pixels,), fp32_vision, ['pixel_values'],
+                        {'pixel_values': {0: 'batch'}})
+                _export(_TextTower(model), (text['input_ids'], text['attention_mask']), fp32_text,
+                        ['input_ids', 'attention_mask'],
+                        {'input_ids': {0: 'batch', 1: 'sequence'}, 'attention_mask': {0: 'batch', 1: 'sequence'}})
+
+            # logit_scale 是单个标量参数，不必放进图里
+            with open(os.path.join(directory, 'meta.json'), 'w') as f:
+                json.dump({'logit_scale': float(model.logit_scale.item()), 'opset': OPSET}, f)
+
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            print("正在对 ONNX 模型做 int8 动态量化 ...")
+            for src, dst in ((fp32_vision, vision_path), (fp32_text, text_path)):
+                tmp = f"{dst}.{os.getpid()}.tmp"
+                quantize_dynamic(src, tmp, weight_type=QuantType.QInt8)
+                os.replace(tmp, dst)
+
+    return vision_path, text_path
+
+
+class OnnxClip:
+    """onnxruntime 会话的包装，接口与 ai_utils 用到的 CLIPModel 方法一致 (输入输出仍是 torch 张量)"""
+
+    def __init__(self, vision_path, text_path, logit_scale, threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 0 表示由 onnxruntime 按物理核数决定
+        options.intra_op_num_threads = threads
+        providers = ['CPUExecutionProvider']
+
+        self.vision = ort.InferenceSession(vision_path, options, providers=providers)
+        self.text = ort.InferenceSession(text_path, options, providers=providers)
+        self.logit_scale = torch.tensor(logit_scale)
+
+    @classmethod
+    def build(cls, model, processor, model_id, quantize=False):
+        directory = export_dir(model_id)
+        vision_path, text_path = export(model, processor, directory, quantize=quantize)
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        return cls(vision_path, text_path, meta['logit_scale'], threads=torch.get_num_threads())
+
+    def get_image_features(self, pixel_values):
+        (features,) = self.vision.run(None, {'pixel_values': pixel_values.cpu().numpy()})
+        return torch.from_numpy(features)
+
+    def get_text_features(self, input_ids, attention_mask=None, **kwargs):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        (features,) = self.text.run(None, {
+            'input_ids': input_ids.cpu().numpy().astype('int64'),
+            'attention_mask': attention_mask.cpu().numpy().astype('int64'),
+        })
+        return torch.from_numpy(features)
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
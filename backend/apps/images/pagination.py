@@ -0,0 +1,155 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    键集 (游标) 分页
+    按 (排序字段, id) 定位下一页，不使用 OFFSET，翻到第 N 页与第 1 页代价相同。
+    支持参数: ?cursor=... & page_size=... & ordering=-upload_time|upload_time|-shoot_time|shoot_time|relevance
+    """
+    page_size = 30
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+
+    # 允许的排序方式 -> (字段名, 是否降序)，都需要有 (字段, id) 的联合索引
+    ordering_fields = {
+        '-upload_time': ('upload_time', True),
+        'upload_time': ('upload_time', False),
+        '-shoot_time': ('shoot_time', True),
+        'shoot_time': ('shoot_time', False),
+        # 关键词检索时按相关度排序，依赖 search.search_images 注解的 search_score
+        'relevance': ('search_score', True),
+    }
+    default_ordering = '-upload_time'
+    search_ordering = 'relevance'
+
+    invalid_cursor_message = '无效的分页游标'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        ordering = self.get_ordering(request, queryset)
+        self.ordering = ordering
+        field, desc = self.ordering_fields[ordering]
+
+        queryset = queryset.order_by(f'-{field}' if desc else field, '-id' if desc else 'id')
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(self._after(field, desc, *cursor))
+
+        # 多取一条，用来判断是否还有下一页
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.has_next:
+            last = results[-1]
+            # 列表接口传入的是 .values() 的字典行 (见 listing.py)
+            if isinstance(last, dict):
+                self.next_position = (last[field], last['id'])
+            else:
+                self.next_position = (getattr(last, field), last.pk)
+        return results
+
+    def get_ordering(self, request, queryset):
+        is_search = 'search_score' in queryset.query.annotations
+        default = self.search_ordering if is_search else self.default_ordering
+
+        ordering = request.query_params.get(self.ordering_query_param, default)
+        if ordering not in self.ordering_fields:
+            return default
+        if ordering == self.search_ordering and not is_search:
+            return self.default_ordering
+        return ordering
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(*self.next_position))
+
+    def get_previous_link(self):
+        return None
+
+    def encode_cursor(self, value, pk):
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        payload = json.dumps({'v': value, 'id': pk}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            pk = int(payload['id'])
+            value = payload['v']
+            # 时间字段以 ISO 字符串保存，相关度分数直接保存数值
+            if isinstance(value, str):
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError(encoded)
+            elif value is not None and not isinstance(value, (int, float)):
+                raise ValueError(encoded)
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    @staticmethod
+    def _after(field, desc, value, pk):
+        """
+        构造 "排在 (value, pk) 之后" 的条件。
+        MySQL / SQLite 中 NULL 视为最小值：降序时排在最后，升序时排在最前，
+        shoot_time 为空的图片依靠这一点参与分页。
+        """
+        if desc:
+            if value is None:
+                return Q(**{f'{field}__isnull': True, 'id__lt': pk})
+            return (
+                Q(**{f'{field}__lt': value}) |
+                Q(**{field: value, 'id__lt': pk}) |
+                Q(**{f'{field}__isnull': True})
+            )
+
+        if value is None:
+            return Q(**{f'{field}__isnull': True, 'id__gt': pk}) | Q(**{f'{field}__isnull': False})
+        return Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk})
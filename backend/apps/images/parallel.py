@@ -0,0 +1,94 @@
+"""
+上传后处理的进程池 (IMAGE_PROCESS_POOL_SIZE 个子进程)
+HEIC 转换、EXIF 解析、缩略图等 CPU 密集步骤 (processing.prepare) 在子进程中并行执行，不受 GIL 限制；
+保存文件、写数据库、逆地理编码、AI 标签、索引仍由调用方进程完成 (processing.process_image)。
+
+子进程以 spawn 方式启动：gunicorn / process_images 进程中有批处理、预热等线程，fork 不安全。
+本模块导入时不导入模型，spawn 出的子进程先由 _init_worker 完成 django.setup()。
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _prepare_path(path):
+    """子进程入口：按路径打开原图，返回 processing.prepare() 的结果"""
+    from .processing import prepare
+
+    with open(path, 'rb') as f:
+        return prepare(f)
+
+
+def pool_size():
+    from django.conf import settings
+    return getattr(settings, 'IMAGE_PROCESS_POOL_SIZE', 0)
+
+
+def get_pool():
+    """进程池单例，第一次提交任务时才启动子进程"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=pool_size(),
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                )
+    return _pool
+
+
+def _discard_pool(pool):
+    """子进程异常退出 (如解码超大图片时被 OOM 杀掉) 后整个进程池不可再用，丢弃后下次提交时重建"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def submit_prepare(image):
+    """
+    把一张已保存图片的 prepare 提交到进程池，返回 Future
+    未启用进程池 (IMAGE_PROCESS_POOL_SIZE=0) 或原图不在本地磁盘上时返回 None，由调用方在当前进程内处理
+    """
+    if pool_size() <= 0:
+        return None
+    try:
+        path = image.img_url.path
+    except NotImplementedError:
+        return None
+    if not os.path.exists(path):
+        return None
+
+    pool = get_pool()
+    try:
+        return pool.submit(_prepare_path, path)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        return get_pool().submit(_prepare_path, path)
+
+
+def prepared_result(future):
+    """
+    取出 submit_prepare 的结果；future 为 None 或进程池已损坏时返回 None (调用方改在当前进程内处理)，
+    prepare 本身抛出的异常 (如图片损坏) 原样抛出
+    """
+    if future is None:
+        return None
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        # 进程池在下一次 submit_prepare 时重建
+        print("图片处理进程异常退出，改为在当前进程内处理")
+        return None
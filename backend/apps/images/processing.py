@@ -0,0 +1,236 @@
+import io
+import os
+import tempfile
+import traceback
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image as PilImage
+
+from .models import Image
+from .utils import UploadImage, geocode_exif, timed
+from .search import index_image
+from .embeddings import embed_image
+from .derivatives import evict
+from .inference import CLIENT_IMAGE_SIZE
+from .tagging import resolve_tags
+from .duplicates import dhash, get_index, to_db
+from .blobs import release, store
+from .responsecache import bump
+from . import facets, metrics
+
+
+# 后处理写入的列；其余列 (公开状态、相册等) 用户在处理期间可能修改，保存时不覆盖
+PROCESSED_FIELDS = (
+    'img_url', 'thumb_url', 'width', 'height', 'file_size', 'camera_model', 'shoot_time', 'location',
+    'iso', 'f_stop', 'exposure_time', 'phash', 'processing_status',
+)
+
+
+class ImageDeleted(Exception):
+    """图片在后处理过程中被删除"""
+
+
+class _TemporaryFile(File):
+    """prepare 写出的临时文件；FileSystemStorage 保存时直接移动 (与 TemporaryUploadedFile 相同)"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def prepare(image_file):
+    """
+    后处理中 CPU 密集、不访问数据库的部分：HEIC 转 JPEG -> EXIF 解析 -> 缩略图 -> 工作图
+    既在当前进程中调用，也由 parallel.py 在进程池中调用，因此返回值只包含可 pickle 的数据:
+    HEIC 转换结果写入磁盘临时文件 (jpeg_path，由 process_image 移入存储)，
+    工作图缩小到 CLIENT_IMAGE_SIZE (AI 标签和 CLIP 向量只需要这么大)
+    """
+    ctx = UploadImage(image_file)
+    result = {'jpeg_path': None, 'jpeg_name': None, 'width': ctx.width, 'height': ctx.height}
+
+    try:
+        if ctx.is_heic:
+            base_name = os.path.splitext(os.path.basename(ctx.name))[0]
+            fd, path = tempfile.mkstemp(suffix='.jpg', dir=settings.FILE_UPLOAD_TEMP_DIR)
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    ctx.save_jpeg(out)
+            except BaseException:
+                os.remove(path)
+                raise
+            result.update(jpeg_path=path, jpeg_name=base_name + '.jpg')
+
+        # 逆地理编码需要访问数据库缓存和网络，留给 process_image
+        result['exif'] = ctx.exif_data(geocode=False)
+
+        thumb_file = ctx.thumbnail()
+        thumb_bytes = thumb_file.read()
+        working = ctx.working_image().copy()
+        working.thumbnail((CLIENT_IMAGE_SIZE, CLIENT_IMAGE_SIZE))
+        with ctx.stage('phash'):
+            # 与 `manage.py phash` 补算时一样由缩略图计算，两者结果一致
+            phash = dhash(PilImage.open(io.BytesIO(thumb_bytes)))
+        result.update(thumb_name=thumb_file.name, thumb_bytes=thumb_bytes, working=working, phash=phash)
+    except BaseException:
+        if result['jpeg_path']:
+            os.remove(result['jpeg_path'])
+        raise
+    finally:
+        ctx.close()
+
+    result['timings'] = ctx.timings
+    return result
+
+
+def _auto_tag(image, working_image):
+    """追加 AI 识别的标签 (source=1)，直接使用已解码的工作图"""
+    from .inference import classify_image
+
+    names = [n for n in classify_image(working_image) if n != "其他"]
+    tags = resolve_tags(names, source=1) if names else []
+    if tags:
+        image.tags.add(*tags)
+    return tags
+
+
+def _save_processed(image):
+    """
+    只写入后处理的列 (PROCESSED_FIELDS)，用户在处理期间对公开状态、相册、标签的修改不会被覆盖；
+    分面计数按加锁重新读取的当前行计算 (相机型号、拍摄年份会改变计数)
+    :return: (标签 id 列表, 保存后的分面快照)
+    :raise ImageDeleted: 图片已被删除
+    """
+    with transaction.atomic():
+        current = Image.objects.select_for_update().filter(pk=image.pk).first()
+        if current is None:
+            raise ImageDeleted(image.pk)
+        tag_ids = list(current.tags.values_list('id', flat=True))
+        before = facets.snapshot(current, tag_ids)
+        for field in Image._meta.concrete_fields:
+            if field.name not in PROCESSED_FIELDS:
+                setattr(image, field.attname, getattr(current, field.attname))
+        image.save(update_fields=PROCESSED_FIELDS)
+        after = facets.snapshot(image, tag_ids)
+        facets.apply((before, after))
+    return tag_ids, after
+
+
+def process_image(image, auto_tag=False, prepared=None):
+    """
+    上传后处理流水线：HEIC 转换 -> EXIF / 地理编码 -> 缩略图 -> (AI 标签) -> 检索索引 / CLIP 向量
+    原图只打开一次、像素只解码一次 (见 utils.UploadImage)
+    由后台工作线程调用，也可在同步模式下直接调用；图片在处理期间被删除时抛出 ImageDeleted
+    :param prepared: 已在进程池中完成的 prepare() 结果，为空时在当前进程内计算
+    """
+    field = image.img_url
+    if prepared is None:
+        with field.open('rb') as f:
+            prepared = prepare(f)
+
+    timings = dict(prepared['timings'])
+    jpeg_path = prepared['jpeg_path']
+    old_name = None
+    new_name = None
+    old_thumb = image.thumb_url.name or None
+    new_thumb = None
+    try:
+        try:
+            if jpeg_path:
+                # HEIC/HEIF 原图转换为 JPEG，替换 img_url，原文件在保存后释放
+                old_name = field.name
+                with timed(timings, 'save'), _TemporaryFile(open(jpeg_path, 'rb'), name=prepared['jpeg_name']) as jpeg_file:
+                    # 临时文件直接移动到内容寻址存储
+                    image.img_url = store(jpeg_file)
+                    field = image.img_url
+                    new_name = field.name
+                    # 重新处理时 (如重试)，按旧文件生成的派生图作废
+                    evict(image)
+        finally:
+            if jpeg_path and os.path.exists(jpeg_path):
+                os.remove(jpeg_path)
+
+        with timed(timings, 'geocode'):
+            exif_info = geocode_exif(prepared['exif'])
+
+        with timed(timings, 'save'):
+            image.thumb_url.save(prepared['thumb_name'], ContentFile(prepared['thumb_bytes']), save=False)
+            new_thumb = image.thumb_url.name
+
+            # 即使 EXIF 为空字典，get() 也会处理，不会报错
+            image.width = prepared['width']
+            image.height = prepared['height']
+            image.file_size = int(field.size / 1024)
+            image.camera_model = exif_info.get('camera_model')
+            image.shoot_time = exif_info.get('shoot_time')
+            image.location = exif_info.get('location')
+            image.iso = exif_info.get('iso')
+            image.f_stop = exif_info.get('f_stop')
+            image.exposure_time = exif_info.get('exposure_time')
+            image.phash = to_db(prepared['phash'])
+            image.processing_status = Image.STATUS_DONE
+            tag_ids, after = _save_processed(image)
+    except BaseException:
+        # 行没有保存 (失败或图片已删除)：本次写入的 JPEG 已在 store() 中增加引用计数、缩略图也没有行引用，
+        # 在这里释放，重试时重新生成；删除图片时原图已由删除接口释放
+        if new_name:
+            release(new_name)
+        if new_thumb:
+            image.thumb_url.storage.delete(new_thumb)
+        raise
+
+    # 行已指向新文件，旧的缩略图 / 原图不再使用
+    if old_thumb and old_thumb != new_thumb:
+        image.thumb_url.storage.delete(old_thumb)
+    get_index().add(image)
+    if old_name:
+        release(old_name)
+    working = prepared['working']
+
+    try:
+        if auto_tag:
+            with timed(timings, 'ai_tag'):
+                added = _auto_tag(image, working)
+                facets.apply((after, facets.snapshot(image, tag_ids + [tag.id for tag in added])))
+
+        with timed(timings, 'index'):
+            # EXIF (地点、相机) 与标签可能变化，重建倒排索引
+            index_image(image)
+    finally:
+        # 缩略图、EXIF、AI 标签都写入之后才使缓存的列表 / 详情响应失效，
+        # 否则在此之前到达的请求会把不含 AI 标签的响应缓存到新的代号下；中途失败时行已更新，同样需要失效
+        bump()
+
+    with timed(timings, 'embedding'):
+        # 计算 CLIP 向量，与缩略图共用同一张工作图
+        embed_image(image.id, working)
+
+    # 进程池子进程中测得的步骤 (open / exif / thumbnail 等) 也在这里统一计入
+    metrics.record(timings)
+    metrics.incr('image_processed')
+    return image
+
+
+def process_batch(images, auto_tag=False):
+    """
+    批量后处理 (同步模式下的批量上传)：所有图片的 prepare 先提交到进程池并行执行，
+    其余步骤在本进程中按顺序完成；单张失败不影响其他图片，失败的图片标记为 failed
+    :return: {image.id: 异常，成功为 None}
+    """
+    from .parallel import prepared_result, submit_prepare
+
+    futures = [(image, submit_prepare(image)) for image in images]
+    errors = {}
+    for image, future in futures:
+        try:
+            process_image(image, auto_tag=auto_tag, prepared=prepared_result(future))
+            errors[image.id] = None
+        except Exception as e:
+            traceback.print_exc()
+            Image.objects.filter(pk=image.pk).update(processing_status=Image.STATUS_FAILED)
+            image.processing_status = Image.STATUS_FAILED
+            errors[image.id] = e
+            bump()
+            metrics.incr('image_failed')
+    return errors
@@ -0,0 +1,96 @@
+"""
+SQL 执行计划检查 (benchmarks/bench_query_plans.py 与 tests.py 的 QueryPlanTests 共用)：
+对请求中的 SELECT 逐条 EXPLAIN，出现以下情况即视为退化:
+  full_scan : 对大表全表扫描 (MySQL type=ALL / SQLite SCAN 且未使用索引)
+  filesort  : 排序不能按索引顺序读取 (MySQL Using filesort / SQLite USE TEMP B-TREE FOR ORDER BY)
+  temporary : 需要临时表 (MySQL Using temporary / SQLite USE TEMP B-TREE FOR GROUP BY / DISTINCT)
+"""
+import json
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# 行数少、全表扫描无妨的表
+SMALL_TABLES = {'tb_category', 'tb_tag', 'tb_user', 'django_content_type'}
+
+
+def analyze():
+    """更新统计信息，让优化器按真实的数据分布选择索引"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            tables = ('tb_image', 'tb_image_tag', 'tb_search_token', 'tb_facet_count', 'tb_category', 'tb_tag', 'tb_user')
+            cursor.execute('ANALYZE TABLE ' + ', '.join(tables))
+            cursor.fetchall()
+        else:
+            cursor.execute('ANALYZE')
+
+
+def explain(sql):
+    """执行计划：MySQL 为 JSON，SQLite 为 EXPLAIN QUERY PLAN 的各行"""
+    # 捕获的 SQL 已代入参数，不再传参数，% 不会被当作占位符
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN FORMAT=JSON ' + sql)
+            return json.loads(cursor.fetchone()[0])
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def _mysql_problems(node, found):
+    if isinstance(node, list):
+        for item in node:
+            _mysql_problems(item, found)
+        return
+    if not isinstance(node, dict):
+        return
+    table = node.get('table')
+    if isinstance(table, dict) and table.get('access_type') == 'ALL' and table.get('table_name') not in SMALL_TABLES:
+        found.add(f"full_scan:{table.get('table_name')}")
+    if node.get('using_filesort'):
+        found.add('filesort')
+    if node.get('using_temporary_table'):
+        found.add('temporary')
+    for value in node.values():
+        _mysql_problems(value, found)
+
+
+def _sqlite_problems(lines, found):
+    for line in lines:
+        words = line.split()
+        if words[:1] == ['SCAN'] and 'USING' not in words and words[1] not in ('CONSTANT', 'SUBQUERY'):
+            if words[1] not in SMALL_TABLES:
+                found.add(f'full_scan:{words[1]}')
+        elif 'TEMP B-TREE' in line:
+            found.add('filesort' if 'ORDER BY' in line else 'temporary')
+
+
+def problems(plan):
+    found = set()
+    if isinstance(plan, dict):
+        _mysql_problems(plan, found)
+    else:
+        _sqlite_problems(plan, found)
+    return found
+
+
+def run(client, method, url, data=None):
+    """用测试客户端请求一次接口，返回 (响应, 其中的 SELECT 语句)"""
+    with CaptureQueriesContext(connection) as ctx:
+        response = getattr(client, method)(url, data, format='json')
+    assert response.status_code < 400, (url, response.status_code)
+    statements = [q['sql'] for q in ctx.captured_queries if q['sql'].lstrip().upper().startswith('SELECT')]
+    return response, statements
+
+
+def check(name, client, method, url, data=None, ignored=(), verbose=False):
+    """请求一次接口并逐条 EXPLAIN 其中的 SELECT，返回 (SELECT 条数, 发现的问题)"""
+    _, statements = run(client, method, url, data)
+    found = set()
+    for sql in statements:
+        plan = explain(sql)
+        issues = {p for p in problems(plan) if p.split(':')[0] not in ignored}
+        found |= issues
+        if verbose or issues:
+            print(f"-- {name}: {sql[:300]}")
+            print(json.dumps(plan, ensure_ascii=False, indent=1) if isinstance(plan, dict) else "\n".join(plan))
+    return len(statements), found
@@ -0,0 +1,28 @@
+"""
+orjson 编码的 JSON 渲染器，比 DRF 默认的 json.dumps 快数倍，输出相同
+(紧凑格式、UTF-8 不转义、UTC 时间以 Z 结尾)。
+请求指定了缩进 (如 Accept: application/json; indent=4) 时退回 DRF 的 JSONRenderer；orjson 未安装时同样退回 (不应出现，见 requirements.txt)
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson 不支持的类型 (Decimal、惰性翻译字符串等) 交给 DRF 的编码器
+_default = JSONEncoder().default
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        ret = orjson.dumps(data, default=_default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        # 与 DRF 相同，转义 U+2028 / U+2029，输出可以直接作为 JavaScript 解析
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
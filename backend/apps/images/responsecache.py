@@ -0,0 +1,151 @@
+"""
+图片列表 / 详情接口的响应缓存与条件请求 (ETag / If-None-Match)
+
+缓存键由生成代号、用户、地址与查询参数、渲染格式组成，值为渲染好的响应体及其 ETag (响应体的哈希，强校验)。
+图片、标签、相册的写操作 (接口写请求、后台处理完成等) 调用 bump() 换一个新的生成代号，
+旧代号下的缓存全部失效，不必逐个找出受影响的键，由缓存按超时自行清除。
+命中时直接返回缓存的响应体；If-None-Match 与缓存的 ETag 相同时返回 304，除认证外不访问数据库。
+
+生成代号保存在 Django 缓存 (CACHES['default']) 中，backend 与 worker 的所有进程必须共用同一个缓存。
+以下变化不换代号，缓存的响应最多滞后 IMAGE_RESPONSE_CACHE_TIMEOUT 秒：
+任务开始处理 (pending -> processing)、按需生成派生图 (srcset 中的按需地址仍然有效)、用户改名
+"""
+import hashlib
+import threading
+import uuid
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework.permissions import SAFE_METHODS
+
+GENERATION_KEY = 'images:generation'
+
+_stats = {'hits': 0, 'not_modified': 0, 'misses': 0, 'stores': 0, 'bumps': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    """本进程的命中统计"""
+    with _stats_lock:
+        result = dict(_stats)
+    lookups = result['hits'] + result['not_modified'] + result['misses']
+    result['hit_rate'] = round((lookups - result['misses']) / lookups, 4) if lookups else 0
+    result['generation'] = cache.get(GENERATION_KEY)
+    return result
+
+
+def timeout():
+    return getattr(settings, 'IMAGE_RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def generation():
+    gen = cache.get(GENERATION_KEY)
+    if gen is None:
+        # 首次使用或缓存被清空；并发时以先写入的为准
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+        gen = cache.get(GENERATION_KEY)
+    return gen
+
+
+def bump():
+    """
+    数据变化后调用，使全部缓存的响应失效
+    在当前事务提交后才换代号：读到新代号的请求一定能读到已提交的数据
+    """
+    def _bump():
+        cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+        _count('bumps')
+
+    transaction.on_commit(_bump)
+
+
+def cache_key(request, gen):
+    user_id = request.user.id if request.user.is_authenticated else 0
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    # 响应中有绝对地址 (build_absolute_uri)，协议和域名也是键的一部分
+    raw = f"{request.scheme}://{request.get_host()}{request.path}?{query}|{request.accepted_renderer.format}"
+    return f"images:response:{gen}:{user_id}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+def _etag(content):
+    return '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+
+
+def _not_modified(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    # If-None-Match 使用弱比较
+    tags = parse_etags(header)
+    return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
+
+
+def _finish(response, etag):
+    response['ETag'] = etag
+    # 浏览器可以保存，但每次使用前都要带 If-None-Match 验证
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Accept', 'Authorization'))
+    return response
+
+
+def _from_entry(request, entry):
+    if _not_modified(request, entry['etag']):
+        _count('not_modified')
+        return _finish(HttpResponseNotModified(), entry['etag'])
+    _count('hits')
+    return _finish(HttpResponse(entry['content'], content_type=entry['content_type']), entry['etag'])
+
+
+class CachedResponseMixin:
+    """
+    ViewSet 混入：list / retrieve 使用响应缓存并支持 If-None-Match，
+    invalidating_actions 中的写请求成功后换生成代号
+    """
+    invalidating_actions = ('create', 'update', 'partial_update', 'destroy')
+
+    def _cached(self, handler, request, *args, **kwargs):
+        if timeout() <= 0:
+            return handler(request, *args, **kwargs)
+        # 必须在读取数据之前取代号，见 bump()
+        key = cache_key(request, generation())
+        entry = cache.get(key)
+        if entry is not None:
+            return _from_entry(request, entry)
+        _count('misses')
+        response = handler(request, *args, **kwargs)
+        response.response_cache_key = key
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached(super().retrieve, request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            key = getattr(response, 'response_cache_key', None)
+            if key is None or response.status_code != 200:
+                return response
+            response.render()
+            etag = _etag(response.content)
+            cache.set(key, {'content': response.content, 'content_type': response['Content-Type'], 'etag': etag}, timeout())
+            _count('stores')
+            if _not_modified(request, etag):
+                return _finish(HttpResponseNotModified(), etag)
+            return _finish(response, etag)
+
+        if self.action in self.invalidating_actions and response.status_code < 400:
+            bump()
+        return response
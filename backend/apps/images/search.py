@@ -0,0 +1,218 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from functools import lru_cache
+
+import jieba
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, When
+
+from .models import Image, SearchToken
+
+# 检索时的停用词：这些词对搜索没有帮助，应该过滤掉
+STOP_WORDS = {
+    "找", "一下", "帮我", "帮", "我", "的", "照片", "图片", "图", "有没有",
+    "搜索", "查看", "显示", "里", "关于", "啊", "呀", "呢"
+}
+
+# 各字段命中时的权重：标签最能代表图片内容，其次是相册
+FIELD_WEIGHTS = {
+    'tag': 3,
+    'category': 2,
+    'location': 1,
+    'camera_model': 1,
+}
+
+# 命中完整词 (而非前缀) 时的加成倍数
+EXACT_MATCH_BOOST = 2
+
+MAX_TOKEN_LENGTH = 64
+
+
+def tokenize(text, stop_words=()):
+    """
+    使用 jieba 搜索引擎模式分词，统一小写并去重，保持原有顺序
+    例如："帮我找一下海边的照片" -> ['海边'] (去掉停用词后)
+    """
+    if not text:
+        return []
+
+    tokens = []
+    seen = set()
+    for word in jieba.lcut_for_search(str(text)):
+        word = word.strip().lower()
+        # 过滤空白、标点等没有检索意义的片段
+        if not word or not any(ch.isalnum() for ch in word):
+            continue
+        if word in stop_words:
+            continue
+        word = word[:MAX_TOKEN_LENGTH]
+        if word not in seen:
+            seen.add(word)
+            tokens.append(word)
+    return tokens
+
+
+def _image_postings(image):
+    """计算一张图片的 token -> 权重 (同一 token 出现在多个字段时权重累加)"""
+    postings = {}
+
+    def add(text, field, whole=False):
+        weight = FIELD_WEIGHTS[field]
+        tokens = tokenize(text)
+        # 标签、相册名通常很短，整词本身也收录，保证输入完整名称时一定能命中
+        if whole and text:
+            full = str(text).strip().lower()[:MAX_TOKEN_LENGTH]
+            if full and full not in tokens:
+                tokens.append(full)
+        for token in tokens:
+            postings[token] = postings.get(token, 0) + weight
+
+    for tag in image.tags.all():
+        add(tag.name, 'tag', whole=True)
+    if image.category_id:
+        add(image.category.name, 'category', whole=True)
+    add(image.location, 'location')
+    add(image.camera_model, 'camera_model')
+    return postings
+
+
+def index_image(image):
+    """
+    重建单张图片的倒排索引。
+    在图片创建 / 更新 (标签、相册、EXIF 变化) 后调用。
+    """
+    postings = _image_postings(image)
+    with transaction.atomic():
+        SearchToken.objects.filter(image=image).delete()
+        SearchToken.objects.bulk_create([
+            SearchToken(token=token, image=image, weight=weight)
+            for token, weight in postings.items()
+        ])
+
+
+def index_images(images):
+    """批量重建索引：一条 DELETE + 一条批量 INSERT (图片需已 select_related('category') / prefetch_related('tags'))"""
+    images = list(images)
+    tokens = [
+        SearchToken(token=token, image=image, weight=weight)
+        for image in images
+        for token, weight in _image_postings(image).items()
+    ]
+    with transaction.atomic():
+        SearchToken.objects.filter(image__in=[image.id for image in images]).delete()
+        SearchToken.objects.bulk_create(tokens, batch_size=1000)
+
+
+def reindex_images(image_ids):
+    """标签 / 相册改名或删除后，重建受影响图片的索引"""
+    image_ids = list(image_ids)
+    # 分批处理，热门标签改名时不必一次载入全部图片
+    for start in range(0, len(image_ids), 500):
+        chunk = image_ids[start:start + 500]
+        # 不需要 Image.Meta.ordering 的排序 (按主键取即可，不必 filesort)
+        index_images(Image.objects.filter(id__in=chunk).order_by().select_related('category').prefetch_related('tags'))
+
+
+def search_images(queryset, query, stop_words=()):
+    """
+    在 queryset 范围内按倒排索引检索，返回 (带 search_score 注解的 queryset, 关键词列表)。
+    每个关键词按前缀匹配 token (走 token 索引的范围扫描)，完整命中的 token 得分加倍；
+    开销只与命中的 posting 数量有关，与图片总数无关。
+    """
+    keywords = tokenize(query, stop_words)
+    if not keywords:
+        return queryset.none(), keywords
+
+    match = Q()
+    for k in keywords:
+        match |= Q(search_tokens__token__istartswith=k)
+
+    # 先 filter 再 annotate，Sum 只统计命中的 token，且按图片分组，无需 DISTINCT
+    queryset = queryset.filter(match).annotate(
+        search_score=Sum(Case(
+            When(search_tokens__token__in=keywords, then=F('search_tokens__weight') * EXACT_MATCH_BOOST),
+            default=F('search_tokens__weight'),
+            output_field=IntegerField(),
+        ))
+    )
+    return queryset, keywords
+
+
+# 语义检索时，关键词同时命中的图片额外加分 (CLIP 余弦相似度通常在 0.2~0.35 之间)
+KEYWORD_BONUS = 0.1
+# 低于该相似度的纯语义结果视为不相关，不返回
+MIN_SEMANTIC_SCORE = 0.18
+
+
+@lru_cache(maxsize=1024)
+def _translate(text):
+    # 失败时抛出异常，lru_cache 不缓存异常，下次检索会重新翻译
+    from deep_translator import GoogleTranslator
+    return GoogleTranslator(source='auto', target='en').translate(text) or text
+
+
+# deep_translator 的请求没有超时，放到单独的线程中执行，检索请求最多等待 CLIP_TRANSLATE_TIMEOUT 秒
+_translate_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='translate')
+
+
+def translate_query(text):
+    """
+    CLIP 的文本编码器只理解英文，中文等检索词先翻译成英文 (检索词会发送给 Google 翻译，成功的结果缓存)
+    :return: 英文检索词；关闭 CLIP_TRANSLATE_QUERY、超时或失败时返回 None (原文编码后的相似度没有意义)
+    """
+    if text.isascii():
+        return text
+    if not getattr(settings, 'CLIP_TRANSLATE_QUERY', True):
+        return None
+    future = _translate_pool.submit(_translate, text)
+    try:
+        translated = future.result(timeout=getattr(settings, 'CLIP_TRANSLATE_TIMEOUT', 1.5))
+    except FuturesTimeout:
+        print("检索词翻译超时，只按关键词排序")
+        return None
+    except Exception as e:
+        print(f"检索词翻译失败，只按关键词排序: {e}")
+        return None
+    # 翻译服务原样返回时同样视为失败
+    return translated if translated != text else None
+
+
+def rank_images(base_qs, query, stop_words=STOP_WORDS, limit=10):
+    """
+    MCP 检索：CLIP 语义相似度 + 倒排索引关键词命中 混合排序
+    :return: ([(image, score), ...], keywords)
+    """
+    from .inference import encode_text
+    from .embeddings import get_store
+
+    keyword_qs, keywords = search_images(base_qs, query, stop_words)
+    if not keywords:
+        return [], keywords
+
+    keyword_hits = dict(
+        keyword_qs.order_by('-search_score', '-upload_time').values_list('id', 'search_score')[:limit * 5]
+    )
+
+    english = translate_query(" ".join(keywords))
+    vector = encode_text(english) if english is not None else None
+    store = get_store()
+    if vector is not None and len(store):
+        def visible(candidate_ids):
+            return set(base_qs.filter(id__in=candidate_ids).values_list('id', flat=True))
+
+        scores = {
+            image_id: score for image_id, score in store.search(vector, k=limit, filter_ids=visible)
+            if score >= MIN_SEMANTIC_SCORE
+        }
+        missing = [i for i in keyword_hits if i not in scores]
+        scores.update(store.scores_for(vector, missing))
+        for image_id in keyword_hits:
+            scores[image_id] = scores.get(image_id, 0.0) + KEYWORD_BONUS
+    else:
+        # 模型或向量库不可用、检索词无法翻译时退回纯关键词排序，分数归一化到 [0, 1]
+        top = max(keyword_hits.values(), default=1)
+        scores = {image_id: score / top for image_id, score in keyword_hits.items()}
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    images = Image.objects.select_related('category').prefetch_related('tags').in_bulk([i for i, _ in ranked])
+    return [(images[i], score) for i, score in ranked if i in images], keywords
@@ -1,6 +1,16 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from rest_framework import serializers
 from .models import Image, Tag, Category
-from .utils import handle_heic_image, get_exif_data, make_thumbnail
+from .search import index_image, index_images
+from .jobs import enqueue, enqueue_many
+from .processing import process_batch, process_image
+from .tagging import resolve_category, resolve_tags
+from .derivatives import evict, srcset
+from .duplicates import describe as describe_duplicates
+from .blobs import release, store
+from . import facets
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -28,91 +38,231 @@ class ImageSerializer(serializers.ModelSerializer):
         allow_null=True
     )
     category_name = serializers.CharField(source='category.name', read_only=True)
+    # 上传时是否由后台任务追加 AI 标签
+    auto_tag = serializers.BooleanField(write_only=True, required=False, default=False)
+    # 多尺寸派生图，{格式: "url 300w, url 800w, ..."}，可直接用于 <source srcset>
+    srcset = serializers.SerializerMethodField()
+    # 同一用户已有的近似重复图片 [{id, distance, thumb_url}]，仅上传 / 详情接口返回 (context 中 with_duplicates=True)
+    duplicates = serializers.SerializerMethodField()
 
     class Meta:
         model = Image
         fields = '__all__'
-        read_only_fields = ('user', 'category', 'thumb_url', 'width', 'height', 'camera_model', 'shoot_time', 'location', 'file_size', 'iso', 'f_stop', 'exposure_time')
+        read_only_fields = ('user', 'category', 'thumb_url', 'width', 'height', 'camera_model', 'shoot_time', 'location', 'file_size', 'iso', 'f_stop', 'exposure_time', 'processing_status', 'phash')
 
-    def validate_img_url(self, value):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 列表接口逐张查询代价太高，不返回
+        if not self.context.get('with_duplicates'):
+            self.fields.pop('duplicates')
+
+    def get_srcset(self, obj):
+        return srcset(obj, self.context.get('request'))
+
+    def get_duplicates(self, obj):
+        request = self.context.get('request')
+        # 只告诉图片的上传者，避免泄露其他用户的私有图片
+        if request is None or request.user.id != obj.user_id:
+            return []
+        return describe_duplicates(obj, request)
+
+    def create(self, validated_data):
         """
-        在字段验证阶段拦截图片。
-        如果是 HEIC，这里会把它变成 JPG 对象。
+        只保存原图和用户填写的信息后立即返回；
+        HEIC 转换、EXIF、地理编码、缩略图等耗时步骤交给后台任务 (见 jobs.py / processing.py)
         """
-        # 调用工具函数处理
-        value = handle_heic_image(value)
-        
-        # 将这些额外数据挂载到文件对象上，方便 create() 调用
-        value.seek(0)
-        return value
-    
-    def create(self, validated_data):
-        print(f"DEBUG: 最终准备保存的文件名是: {validated_data['img_url'].name}")
         img_file = validated_data.get('img_url')
-        
+
         tag_names = validated_data.pop('tag_names', [])
         cat_name = validated_data.pop('category_upload', None)
-        
-        # 合并 EXIF 数据到验证数据中
-        if hasattr(img_file, 'seek'): img_file.seek(0)
-        exif_info, width, height = get_exif_data(img_file)
-        
-        if hasattr(img_file, 'seek'): img_file.seek(0)
-        thumb_file = make_thumbnail(img_file)
-        
-        # 4. 将提取的数据补充进 validated_data
-        # 即使 get_exif_data 返回 None，get() 也会处理，不会报错
+        auto_tag = validated_data.pop('auto_tag', False)
+
         validated_data.update({
-            'width': width,
-            'height': height,
             'file_size': int(img_file.size / 1024),
-            'thumb_url': thumb_file,
-            'camera_model': exif_info.get('camera_model'),
-            'shoot_time': exif_info.get('shoot_time'),
-            'location': exif_info.get('location'),
-            'iso': exif_info.get('iso'),
-            'f_stop': exif_info.get('f_stop'),
-            'exposure_time': exif_info.get('exposure_time'),
+            'processing_status': Image.STATUS_PENDING,
         })
         
-        if cat_name:
-            # 存在则获取，不存在则创建
-            category, _ = Category.objects.get_or_create(name=cat_name)
-            validated_data['category'] = category
-        else:
-            validated_data['category'] = None
+        # 相册存在则获取，不存在则创建
+        validated_data['category'] = resolve_category(cat_name)
 
         if hasattr(img_file, 'seek'): img_file.seek(0)
-        image = Image.objects.create(**validated_data)
+        with transaction.atomic():
+            # 原图按内容寻址保存，与已有文件相同时只增加引用计数
+            validated_data['img_url'] = store(img_file)
+            image = Image.objects.create(**validated_data)
+
+        # 处理标签；一次查询已有标签，缺失的批量创建，关联行一次插入
+        tags = resolve_tags(tag_names) if tag_names else []
+        if tags:
+            image.tags.add(*tags)
+        facets.apply((None, facets.snapshot(image, [tag.id for tag in tags])))
 
-        # 处理标签；如果存在则获取，不存在则创建
-        for name in tag_names:
-            tag, _ = Tag.objects.get_or_create(name=name, defaults={'source': 0})
-            image.tags.add(tag)
+        # 写入倒排索引 (标签、相册立即可搜，EXIF 信息在后台处理完成后补充)
+        index_image(image)
+
+        if getattr(settings, 'IMAGE_PROCESSING_ASYNC', True):
+            enqueue(image, auto_tag=auto_tag)
+        else:
+            process_image(image, auto_tag=auto_tag)
         
         return image
 
     def update(self, instance, validated_data):
         tag_names = validated_data.pop('tag_names', None)
         cat_name = validated_data.pop('category_upload', None)
+        validated_data.pop('auto_tag', None)
+        before = facets.snapshot(instance)
         
         # 更新相册
         if cat_name == "":
             instance.category = None
         elif cat_name:
-            category, _ = Category.objects.get_or_create(name=cat_name)
-            instance.category = category
+            instance.category = resolve_category(cat_name, instance.category)
+
+        # 替换原图时按内容寻址保存新文件，旧文件在保存后释放
+        old_name = None
+        if 'img_url' in validated_data:
+            old_name = instance.img_url.name
+            validated_data['img_url'] = store(validated_data['img_url'])
 
         # 标准更新
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
+        # 只保存用户修改的列，不覆盖后台任务在此期间写入的缩略图、EXIF 等 (见 processing.PROCESSED_FIELDS)
+        update_fields = list(validated_data)
+        if cat_name is not None:
+            update_fields.append('category')
         
-        # 更新标签 (覆盖式)
+        # 更新标签 (覆盖式)；set() 只删除 / 插入有变化的关联行
+        tag_ids = None
         if tag_names is not None:
-            instance.tags.clear()
-            for name in tag_names:
-                tag, _ = Tag.objects.get_or_create(name=name)
-                instance.tags.add(tag)
+            tags = resolve_tags(tag_names)
+            instance.tags.set(tags)
+            tag_ids = [tag.id for tag in tags]
                 
-        instance.save()
-        return instance
\ No newline at end of file
+        if update_fields:
+            instance.save(update_fields=update_fields)
+        facets.apply((before, facets.snapshot(instance, tag_ids)))
+        index_image(instance)
+        if old_name:
+            release(old_name)
+
+        # 替换了图片文件 (如裁剪) 时旧的派生图作废，与上传时一样重新走完整的后处理：
+        # 缩略图、EXIF、尺寸、phash、CLIP 向量都按新文件重新计算
+        if 'img_url' in validated_data:
+            evict(instance)
+            if getattr(settings, 'IMAGE_PROCESSING_ASYNC', True):
+                enqueue(instance)
+            else:
+                process_image(instance)
+        return instance
+
+
+class BulkUploadSerializer(serializers.Serializer):
+    """
+    批量上传 (POST /api/images/bulk/)：多个文件共用标签、相册、公开设置
+    每个文件单独校验，不合格的文件不影响其他文件；save() 返回与上传顺序一致的逐文件结果
+    """
+    img_url = serializers.ListField(child=serializers.FileField(), allow_empty=False)
+    tag_names = serializers.ListField(child=serializers.CharField(max_length=30), required=False, default=list)
+    category_upload = serializers.CharField(allow_blank=True, required=False, allow_null=True)
+    is_public = serializers.BooleanField(required=False, default=True)
+    auto_tag = serializers.BooleanField(required=False, default=False)
+
+    def validate_img_url(self, files):
+        limit = getattr(settings, 'IMAGE_BULK_UPLOAD_MAX_FILES', 500)
+        if len(files) > limit:
+            raise serializers.ValidationError(f"单次最多上传 {limit} 个文件")
+        # 与 nginx 的 client_max_body_size 一致，未经 nginx 直接访问时同样生效
+        max_mb = getattr(settings, 'IMAGE_BULK_UPLOAD_MAX_MB', 2048)
+        if sum(f.size for f in files) > max_mb * 1024 * 1024:
+            raise serializers.ValidationError(f"单次上传的文件总大小不能超过 {max_mb}MB，请分批上传")
+        return files
+
+    def create(self, validated_data):
+        files = validated_data['img_url']
+        tag_names = validated_data.get('tag_names') or []
+        cat_name = validated_data.get('category_upload')
+        auto_tag = validated_data.get('auto_tag', False)
+
+        # 与 ImageSerializer 相同的图片校验，逐个文件进行
+        results = [None] * len(files)
+        image_field = serializers.ImageField()
+        pending = []
+        for i, f in enumerate(files):
+            try:
+                image_field.run_validation(f)
+            except serializers.ValidationError as e:
+                results[i] = {'name': f.name, 'ok': False, 'error': " ".join(str(x) for x in e.detail)}
+                continue
+            except DjangoValidationError as e:
+                # 单独使用时，ImageField 抛出的是 Django 的 ValidationError
+                results[i] = {'name': f.name, 'ok': False, 'error': " ".join(e.messages)}
+                continue
+            if hasattr(f, 'seek'): f.seek(0)
+            pending.append((i, f))
+
+        if not pending:
+            return results
+
+        # 相册、标签只解析一次，所有图片共用
+        category = resolve_category(cat_name)
+        tags = resolve_tags(tag_names)
+
+        with transaction.atomic():
+            # 原图按内容寻址保存；同一批中内容相同的文件共用一份
+            floor = Image.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            images = [
+                Image(
+                    user=validated_data['user'],
+                    category=category,
+                    img_url=store(f),
+                    is_public=validated_data.get('is_public', True),
+                    file_size=int(f.size / 1024),
+                    processing_status=Image.STATUS_PENDING,
+                )
+                for _, f in pending
+            ]
+            images = Image.objects.bulk_create(images, batch_size=100)
+
+            if any(image.pk is None for image in images):
+                # MySQL 不支持批量插入后返回主键；按文件名取回本次插入的行，
+                # 内容相同的文件路径也相同，同名的行按主键顺序与插入顺序对应
+                ids = {}
+                rows = (
+                    Image.objects.filter(id__gt=floor, user=validated_data['user'], img_url__in={image.img_url.name for image in images})
+                    .order_by('id').values_list('img_url', 'id')
+                )
+                for name, pk in rows:
+                    ids.setdefault(name, []).append(pk)
+                for image in images:
+                    image.pk = image.id = ids[image.img_url.name].pop(0)
+
+            Through = Image.tags.through
+            Through.objects.bulk_create([Through(image_id=image.id, tag_id=tag.id) for image in images for tag in tags], batch_size=1000)
+            tag_ids = [tag.id for tag in tags]
+            facets.apply(*[(None, facets.snapshot(image, tag_ids)) for image in images])
+
+            # 写入倒排索引 (标签、相册立即可搜，EXIF 信息在后台处理完成后补充)
+            index_images(
+                Image.objects.filter(id__in=[image.id for image in images])
+                .select_related('category').prefetch_related('tags')
+            )
+
+            if getattr(settings, 'IMAGE_PROCESSING_ASYNC', True):
+                enqueue_many(images, auto_tag=auto_tag)
+
+        errors = {}
+        if not getattr(settings, 'IMAGE_PROCESSING_ASYNC', True):
+            # 同步模式：CPU 密集部分在进程池中并行
+            errors = process_batch(images, auto_tag=auto_tag)
+
+        for (i, f), image in zip(pending, images):
+            error = errors.get(image.id)
+            results[i] = {'name': f.name, 'ok': error is None, 'id': image.id, 'processing_status': image.processing_status}
+            if error is not None:
+                results[i]['error'] = f"{type(error).__name__}: {error}"
+            elif image.processing_status == Image.STATUS_DONE:
+                # 同步模式下已算出哈希 (同一批中的其他图片也会被找到)
+                results[i]['duplicates'] = describe_duplicates(image, self.context.get('request'))
+        return results
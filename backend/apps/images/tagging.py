@@ -0,0 +1,48 @@
+"""
+标签 / 相册的集合式写入
+名称列表一次查询解析为对象，缺失的标签一次批量插入；
+图片与标签的关联用 tags.add / tags.set 写入 (Django 按差异只插入 / 删除变化的行，
+没有 m2m_changed 接收者时 add 直接 INSERT ... ON CONFLICT DO NOTHING / INSERT IGNORE，不必先查询)
+"""
+from . import metrics
+from .models import Category, Tag
+
+
+def resolve_tags(names, source=0):
+    """
+    标签名列表 -> Tag 列表 (去重，保持顺序)
+    查询 1 次；有新标签时再加 1 次批量插入 + 1 次查询。
+    并发请求同时创建同名标签时，依靠 name 的唯一约束忽略冲突，再按名称取回对方创建的行
+    """
+    names = list(dict.fromkeys(names))
+    if not names:
+        return []
+
+    with metrics.stage('tags'):
+        return _resolve_tags(names, source)
+
+
+def _resolve_tags(names, source):
+    found = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+    missing = [name for name in names if name not in found]
+    if missing:
+        Tag.objects.bulk_create([Tag(name=name, source=source) for name in missing], ignore_conflicts=True)
+        found.update((tag.name, tag) for tag in Tag.objects.filter(name__in=missing))
+
+    tags = []
+    for name in names:
+        tag = found.get(name)
+        if tag is None:
+            # 排序规则不区分大小写 (如 MySQL 默认) 时，'Cat' 会命中已有的 'cat'，按单个名称查找
+            tag, _ = Tag.objects.get_or_create(name=name, defaults={'source': source})
+        tags.append(tag)
+    return tags
+
+
+def resolve_category(name, current=None):
+    """相册名 -> Category；空值返回 None，名称与 current 相同时不查询"""
+    if not name:
+        return None
+    if current is not None and current.name == name:
+        return current
+    return Category.objects.get_or_create(name=name)[0]
@@ -1,3 +1,1256 @@
-from django.test import TestCase
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipIf
 
-# Create your tests here.
+import numpy as np
+from PIL import Image as PilImage
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.users.models import User
+
+from . import blobs, duplicates, embeddings, facets, jobs, listing, queryplans, responsecache, search
+from .batching import InferenceBatcher
+from .embeddings import EmbeddingStore
+from .geocoding import GeocodeCache
+from .models import Blob, Category, FacetCount, GeocodeEntry, Image, ProcessingJob, Tag
+from .processing import ImageDeleted, _save_processed
+from .search import index_image, rank_images, reindex_images
+from .serializers import ImageSerializer
+from .tagging import resolve_tags
+from .utils import get_decode_budget
+
+# 测试用的逆地理编码 (settings.GEOCODER 指向 stub_geocoder)：记录调用，不访问网络
+geocoder_calls = []
+geocoder_entered = threading.Event()
+geocoder_release = threading.Event()
+
+
+def stub_geocoder(lat, lon):
+    """纬度为负时模拟网络错误；geocoder_release 未 set 时阻塞，用于构造并发查询"""
+    geocoder_calls.append((lat, lon))
+    geocoder_entered.set()
+    geocoder_release.wait(5)
+    if lat < 0:
+        raise OSError("geocoder unavailable")
+    return f"地址 {lat:.3f},{lon:.3f}"
+
+
+class TagWriteQueryTests(TestCase):
+    """标签写入的 SQL 条数与标签数量无关 (benchmarks/bench_tag_writes.py 给出与旧实现的对比)"""
+    TAGS = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='tagger', email='tagger@test.local')
+        cls.names = [f'tag_{i}' for i in range(cls.TAGS)]
+
+    def new_image(self):
+        return Image.objects.create(user=self.user, img_url='uploads/test/tags.jpg')
+
+    def test_create_new_tags(self):
+        image = self.new_image()
+        # 查询标签 + 批量插入标签 + 取回主键 + 插入关联
+        with self.assertNumQueries(4):
+            image.tags.add(*resolve_tags(self.names))
+        self.assertEqual(image.tags.count(), self.TAGS)
+
+    def test_create_existing_tags(self):
+        Tag.objects.bulk_create([Tag(name=name) for name in self.names])
+        image = self.new_image()
+        # 查询标签 + 插入关联
+        with self.assertNumQueries(2):
+            image.tags.add(*resolve_tags(self.names))
+        self.assertEqual(image.tags.count(), self.TAGS)
+
+    def test_update_unchanged(self):
+        image = self.new_image()
+        image.tags.add(*resolve_tags(self.names))
+        # 查询标签 + 查询现有关联
+        with self.assertNumQueries(2):
+            image.tags.set(resolve_tags(self.names))
+
+    def test_update_two_changed(self):
+        image = self.new_image()
+        image.tags.add(*resolve_tags(self.names))
+        names = self.names[:-2] + ['new_a', 'new_b']
+        # 查询 / 插入 / 取回标签 + 查询现有关联 + 删除 + 插入
+        with self.assertNumQueries(6):
+            image.tags.set(resolve_tags(names))
+        self.assertEqual(set(image.tags.values_list('name', flat=True)), set(names))
+
+
+class QueryPlanTests(TransactionTestCase):
+    """
+    各接口 SQL 的执行计划不出现大表全表扫描、filesort、临时表 (benchmarks/bench_query_plans.py 的测试版)
+    MySQL 的 ANALYZE TABLE 会隐式提交事务，因此用 TransactionTestCase
+    """
+    IMAGES = 2000
+
+    def seed(self):
+        """写入 IMAGES 张图片记录 (多个用户、相册、标签，公开 / 私有混合，不需要图片文件) 及其检索索引和分面计数"""
+        rng = random.Random(42)
+        users = [User.objects.create(username=f'plan_{i}', email=f'plan_{i}@test.local') for i in range(10)]
+        albums = [Category.objects.create(name=f'album {i}') for i in range(20)]
+        labels = [Tag.objects.create(name=f'tag_{i}') for i in range(60)]
+        start = datetime(2018, 1, 1, tzinfo=dt_timezone.utc)
+        Image.objects.bulk_create([
+            Image(
+                user=rng.choice(users), category=rng.choice(albums) if rng.random() < 0.7 else None,
+                img_url=f'originals/plan/{i}.jpg', thumb_url=f'thumbs/plan/{i}_thumb.jpg', width=4032, height=3024,
+                camera_model=rng.choice(('iPhone 15 Pro', 'ILCE-7M4', 'X-T5')),
+                shoot_time=start + timedelta(days=rng.randrange(6 * 365)) if rng.random() < 0.9 else None,
+                is_public=rng.random() < 0.6, processing_status=Image.STATUS_DONE,
+            )
+            for i in range(self.IMAGES)
+        ], batch_size=1000)
+        image_ids = list(Image.objects.values_list('id', flat=True))
+        Image.tags.through.objects.bulk_create([
+            Image.tags.through(image_id=image_id, tag_id=tag.id)
+            for image_id in image_ids for tag in rng.sample(labels, 3)
+        ], batch_size=5000)
+        reindex_images(image_ids)
+        call_command('reconcile_facets', stdout=io.StringIO())
+        return users[0], albums[0], labels[0], Image.objects.filter(is_public=True).order_by('id').first()
+
+    @override_settings(IMAGE_RESPONSE_CACHE_TIMEOUT=0)
+    def test_no_plan_regressions(self):
+        user, album, tag, public_image = self.seed()
+        queryplans.analyze()
+        anon = APIClient()
+        owner = APIClient()
+        owner.force_authenticate(user)
+        next_page = owner.get('/api/images/').json()['next']
+        cases = [
+            ('list:anonymous', anon, 'get', '/api/images/', None, ()),
+            ('list:visible', owner, 'get', '/api/images/', None, ()),
+            ('list:next_page', owner, 'get', next_page, None, ()),
+            ('list:only_my', owner, 'get', '/api/images/?only_my=true', None, ()),
+            ('list:category', owner, 'get', f'/api/images/?category={album.id}', None, ()),
+            ('list:shoot_time', owner, 'get', '/api/images/?ordering=-shoot_time', None, ()),
+            ('list:date_range', anon, 'get',
+             '/api/images/?ordering=-shoot_time&start_date=2020-03-01&end_date=2020-03-31', None, ()),
+            ('detail', anon, 'get', f'/api/images/{public_image.id}/', None, ()),
+            ('search', owner, 'get', f'/api/images/?q={tag.name}', None, ('filesort', 'temporary')),
+            ('facets', owner, 'get', '/api/images/facets/', None, ()),
+            ('timeline', owner, 'get', '/api/images/timeline/?granularity=day', None, ()),
+            ('tag_rename', owner, 'patch', f'/api/tags/{tag.id}/', {'name': f'{tag.name}_renamed'}, ()),
+        ]
+        for name, *case in cases:
+            with self.subTest(name):
+                _, found = queryplans.check(name, *case)
+                self.assertFalse(found, f"{name} 的执行计划退化: {', '.join(sorted(found))}")
+
+
+@override_settings(GEOCODER='apps.images.tests.stub_geocoder')
+class GeocodeCacheTests(TestCase):
+    def setUp(self):
+        geocoder_calls.clear()
+        geocoder_release.set()
+        self.cache = GeocodeCache(precision=3)
+
+    def test_memory_hit(self):
+        first = self.cache.lookup(31.2304, 121.4737)
+        self.assertEqual(self.cache.lookup(31.2304, 121.4737), first)
+        self.assertEqual(len(geocoder_calls), 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats['misses'], stats['memory_hits'], stats['db_hits']), (1, 1, 0))
+
+    def test_db_hit(self):
+        address = self.cache.lookup(31.2304, 121.4737)
+        self.assertEqual(GeocodeEntry.objects.get(cell='31.230,121.474').address, address)
+        # 新进程 (LRU 为空) 从数据库读取，不再请求
+        other = GeocodeCache(precision=3)
+        self.assertEqual(other.lookup(31.2304, 121.4737), address)
+        self.assertEqual(len(geocoder_calls), 1)
+        stats = other.stats()
+        self.assertEqual((stats['misses'], stats['memory_hits'], stats['db_hits']), (0, 0, 1))
+
+    def test_cell_rounding(self):
+        self.assertEqual(self.cache.cell(31.23041, 121.47368), '31.230,121.474')
+        self.assertEqual(self.cache.cell(-33.8688, 151.2093), '-33.869,151.209')
+        # 同一网格内的坐标共用一次查询
+        self.cache.lookup(31.23041, 121.47368)
+        self.cache.lookup(31.23039, 121.47371)
+        self.assertEqual(len(geocoder_calls), 1)
+        # 相邻网格单独查询
+        self.cache.lookup(31.2314, 121.4737)
+        self.assertEqual(len(geocoder_calls), 2)
+        self.assertEqual(GeocodeEntry.objects.count(), 2)
+
+    def test_error_not_cached(self):
+        with self.assertRaises(OSError):
+            self.cache.lookup(-33.8688, 151.2093)
+        with self.assertRaises(OSError):
+            self.cache.lookup(-33.8688, 151.2093)
+        self.assertEqual(len(geocoder_calls), 2)
+        self.assertFalse(GeocodeEntry.objects.exists())
+        self.assertEqual(self.cache.stats()['errors'], 2)
+
+    def test_stats(self):
+        self.cache.lookup(31.2304, 121.4737)             # miss
+        self.cache.lookup(31.2304, 121.4737)             # LRU
+        self.cache.lookup(31.2304, 121.4737)             # LRU
+        GeocodeCache(precision=3).lookup(31.2304, 121.4737)  # 另一实例：数据库
+        self.assertEqual(self.cache.stats(), {
+            'memory_hits': 2, 'db_hits': 0, 'misses': 1, 'coalesced': 0, 'errors': 0,
+            'lru_size': 1, 'hit_rate': round(2 / 3, 4),
+        })
+
+    def test_lru_eviction(self):
+        cache = GeocodeCache(precision=3, lru_size=2)
+        for lat in (30.0, 31.0, 32.0):
+            cache.lookup(lat, 120.0)
+        self.assertEqual(cache.stats()['lru_size'], 2)
+        # 被淘汰的网格改从数据库读取
+        cache.lookup(30.0, 120.0)
+        self.assertEqual(cache.stats()['db_hits'], 1)
+        self.assertEqual(len(geocoder_calls), 3)
+
+
+@override_settings(GEOCODER='apps.images.tests.stub_geocoder')
+class GeocodeCoalescingTests(TransactionTestCase):
+    """各线程使用自己的数据库连接，需要真正提交，因此用 TransactionTestCase"""
+
+    def setUp(self):
+        geocoder_calls.clear()
+        geocoder_entered.clear()
+        geocoder_release.clear()
+        self.addCleanup(geocoder_release.set)
+
+    def test_concurrent_misses_coalesced(self):
+        cache = GeocodeCache(precision=3)
+        results = []
+
+        def lookup():
+            try:
+                results.append(cache.lookup(31.2304, 121.4737))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=lookup) for _ in range(4)]
+        threads[0].start()
+        self.assertTrue(geocoder_entered.wait(5))
+        for t in threads[1:]:
+            t.start()
+        # 其余线程都在等待同一个查询后再放行
+        deadline = time.monotonic() + 5
+        while cache.stats()['coalesced'] < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        geocoder_release.set()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(len(geocoder_calls), 1)
+        self.assertEqual(results, ["地址 31.230,121.474"] * 4)
+        stats = cache.stats()
+        self.assertEqual((stats['misses'], stats['coalesced']), (1, 3))
+        self.assertEqual(GeocodeEntry.objects.count(), 1)
+
+
+UPLOAD_BOUNDARY = 'upload-memory-test-boundary'
+
+
+def _peak_rss_mb():
+    """当前进程的峰值 RSS (Linux 的 VmHWM)，读不到时返回 None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """清零 VmHWM，使峰值只统计之后的运行"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+@skipIf(connection.vendor == 'sqlite', "SQLite 不支持多个线程同时写入 (database is locked)，需在 MySQL 上运行")
+class UploadMemoryTests(TransactionTestCase):
+    """
+    N 个并发 40MB 上传 (同步处理模式) 的峰值内存：不超过 IMAGE_DECODE_MEMORY_LIMIT_MB + 每个请求 PER_REQUEST_MB
+    (benchmarks/bench_upload_memory.py 另外给出与旧配置的对比)。
+    请求经由 WSGIHandler，请求体从磁盘文件流式读取；各请求在自己的线程中写数据库，因此用 TransactionTestCase
+    """
+    CONCURRENCY = 4
+    UPLOAD_MB = 40
+    PER_REQUEST_MB = 24
+
+    def make_samples(self, directory):
+        """随机噪声 JPEG (几乎不可压缩，约 UPLOAD_MB) 与需要完整解码的 24MP HEIC (不带内嵌缩略图)"""
+        import pillow_heif
+
+        pillow_heif.register_heif_opener()
+        # quality=100 的噪声图约 2 字节 / 像素
+        pixels = self.UPLOAD_MB * 1024 * 1024 // 2
+        width = int((pixels * 4 / 3) ** 0.5)
+        height = pixels // width
+        jpg = os.path.join(directory, 'noise.jpg')
+        PilImage.frombytes('RGB', (width, height), os.urandom(width * height * 3)).save(jpg, quality=100)
+
+        gradient = PilImage.linear_gradient('L').resize((6000, 4000))
+        heic = os.path.join(directory, 'gradient_24mp.heic')
+        PilImage.merge('RGB', (gradient, gradient.rotate(90), gradient.transpose(PilImage.Transpose.FLIP_LEFT_RIGHT))).save(
+            heic, quality=80, thumbnails=[])
+        return [jpg, heic]
+
+    @staticmethod
+    def write_body(path, sample):
+        """把 multipart 请求体写到磁盘，避免在内存中构造"""
+        with open(path, 'wb') as out, open(sample, 'rb') as src:
+            out.write(
+                f'--{UPLOAD_BOUNDARY}\r\nContent-Disposition: form-data; name="is_public"\r\n\r\nfalse\r\n'
+                f'--{UPLOAD_BOUNDARY}\r\nContent-Disposition: form-data; name="img_url"; '
+                f'filename="{os.path.basename(sample)}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode()
+            )
+            while chunk := src.read(1024 * 1024):
+                out.write(chunk)
+            out.write(f'\r\n--{UPLOAD_BOUNDARY}--\r\n'.encode())
+        return path
+
+    @staticmethod
+    def run_uploads(bodies, token):
+        """并发发送上传请求 (每个请求一个线程)，返回 (各请求的状态行, 峰值 RSS 相对开始前的增量 MB)"""
+        handler = WSGIHandler()
+        statuses = []
+
+        def upload(body):
+            environ = {
+                'REQUEST_METHOD': 'POST', 'PATH_INFO': '/api/images/', 'SERVER_NAME': 'localhost',
+                'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'wsgi.url_scheme': 'http',
+                'CONTENT_TYPE': f'multipart/form-data; boundary={UPLOAD_BOUNDARY}',
+                'CONTENT_LENGTH': str(os.path.getsize(body)),
+                'HTTP_AUTHORIZATION': f'Bearer {token}', 'wsgi.errors': sys.stderr,
+            }
+            with open(body, 'rb') as f:
+                environ['wsgi.input'] = f
+                response = handler(environ, lambda status, headers: statuses.append(status))
+                b''.join(response)
+                response.close()
+
+        _reset_peak_rss()
+        baseline = _peak_rss_mb()
+        threads = [threading.Thread(target=upload, args=(body,)) for body in bodies]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return statuses, _peak_rss_mb() - baseline
+
+    def test_concurrent_uploads_peak_memory(self):
+        if _peak_rss_mb() is None:
+            self.skipTest("无法读取 /proc/self/status 的 VmHWM")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        try:
+            samples = self.make_samples(tmp.name)
+        except Exception as e:
+            self.skipTest(f"无法生成上传样本: {e}")
+        bodies = [
+            self.write_body(os.path.join(tmp.name, f'body_{i}'), samples[i % len(samples)])
+            for i in range(self.CONCURRENCY)
+        ]
+        user = User.objects.create(username='uploader', email='uploader@test.local')
+        token = str(AccessToken.for_user(user))
+
+        # CLIP 推理服务地址不存在且不退回本进程推理：不加载模型，峰值只统计上传与图片处理
+        with override_settings(
+            MEDIA_ROOT=os.path.join(tmp.name, 'media'), IMAGE_PROCESSING_ASYNC=False, ALLOWED_HOSTS=['*'],
+            CLIP_INFERENCE_SOCKET=os.path.join(tmp.name, 'no-clip.sock'), CLIP_INFERENCE_FALLBACK=False,
+        ):
+            statuses, peak = self.run_uploads(bodies, token)
+
+        self.assertEqual([s[:3] for s in statuses], ['201'] * self.CONCURRENCY)
+        limit = settings.IMAGE_DECODE_MEMORY_LIMIT_MB
+        self.assertTrue(limit, "IMAGE_DECODE_MEMORY_LIMIT_MB 为 0 时解码内存不受限制")
+        bound = limit + self.PER_REQUEST_MB * self.CONCURRENCY
+        self.assertLessEqual(
+            peak, bound, f"峰值 {peak:.0f}MB 超过上限 {bound}MB (解码排队 {get_decode_budget().stats()['waits']} 次)")
+
+
+def _vector(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class RankImagesTests(TestCase):
+    """MCP 检索 (search.rank_images)：文本编码器用桩函数，向量库写入临时目录"""
+    QUERY = _vector(1, 0, 0, 0)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@test.local')
+        cls.other = User.objects.create(username='other', email='other@test.local')
+
+        def create(user, is_public, tags=()):
+            image = Image.objects.create(user=user, img_url='uploads/test/rank.jpg', is_public=is_public)
+            image.tags.add(*resolve_tags(tags))
+            index_image(image)
+            return image
+
+        cls.own_private = create(cls.owner, False)
+        cls.public_tagged = create(cls.other, True, ['sunset', '海边'])
+        cls.others_private = create(cls.other, False, ['海边'])
+        cls.unrelated = create(cls.other, True)
+        cls.beach = create(cls.owner, True, ['海边'])
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = EmbeddingStore(tmp.name)
+        store.add(self.own_private.id, _vector(0.9, 0.1, 0, 0))
+        store.add(self.public_tagged.id, _vector(0.5, 0.5, 0.5, 0.5))
+        # 相似度最高，但属于其他用户的私有图片
+        store.add(self.others_private.id, _vector(1, 0, 0, 0))
+        # 低于 MIN_SEMANTIC_SCORE，且没有关键词命中
+        store.add(self.unrelated.id, _vector(0.1, 1, 0, 0))
+        store.add(self.beach.id, _vector(0, 0, 1, 0))
+        patcher = mock.patch.object(embeddings, '_store', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.encoded = []
+
+        def encode_text(text):
+            self.encoded.append(text)
+            return self.QUERY
+
+        patcher = mock.patch('apps.images.inference.encode_text', encode_text)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.visible = Image.objects.filter(is_public=True) | Image.objects.filter(user=self.owner)
+
+    def test_semantic_scores_ordered_and_visible(self):
+        ranked, keywords = rank_images(self.visible, 'sunset')
+        self.assertEqual(keywords, ['sunset'])
+        self.assertEqual(self.encoded, ['sunset'])
+        self.assertEqual([image.id for image, _ in ranked], [self.own_private.id, self.public_tagged.id])
+        scores = dict((image.id, score) for image, score in ranked)
+        # 余弦相似度 (向量按 float16 保存)，关键词命中的图片另加 KEYWORD_BONUS
+        self.assertAlmostEqual(scores[self.own_private.id], float(_vector(0.9, 0.1, 0, 0) @ self.QUERY), places=3)
+        self.assertAlmostEqual(scores[self.public_tagged.id], 0.5 + search.KEYWORD_BONUS, places=3)
+
+    @override_settings(CLIP_TRANSLATE_QUERY=False)
+    def test_untranslated_query_uses_keywords_only(self):
+        ranked, _ = rank_images(self.visible, '海边')
+        self.assertEqual(self.encoded, [])
+        # 只返回关键词命中的可见图片，不按原文的语义相似度筛选
+        self.assertEqual({image.id for image, _ in ranked}, {self.public_tagged.id, self.beach.id})
+        self.assertEqual({score for _, score in ranked}, {1.0})
+
+    def test_translation_failure_uses_keywords_only(self):
+        def fail(text):
+            raise OSError("translator unavailable")
+
+        with mock.patch.object(search, '_translate', fail):
+            ranked, _ = rank_images(self.visible, '海边')
+        self.assertEqual(self.encoded, [])
+        self.assertEqual({image.id for image, _ in ranked}, {self.public_tagged.id, self.beach.id})
+
+    def test_translated_query_encoded_in_english(self):
+        with mock.patch.object(search, '_translate', lambda text: 'beach'):
+            ranked, _ = rank_images(self.visible, '海边')
+        self.assertEqual(self.encoded, ['beach'])
+        self.assertNotIn(self.others_private.id, [image.id for image, _ in ranked])
+
+
+class EmbeddingStoreCompactTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = EmbeddingStore(tmp.name)
+        for image_id in (1, 2, 3):
+            self.store.add(image_id, _vector(image_id, 1, 0, 0))
+        self.store.remove(2)
+
+    def test_compact(self):
+        reader = EmbeddingStore(self.store.directory)
+        self.assertEqual(reader.image_ids(), {1, 3})
+        self.assertEqual(self.store.compact(), 1)
+        # 另一个进程的旧映射在替换后重新映射为新文件
+        self.assertEqual(reader.image_ids(), {1, 3})
+        self.assertEqual({i for i, _ in reader.search(_vector(1, 1, 0, 0), k=5)}, {1, 3})
+
+    def test_reader_waits_for_both_files(self):
+        reader = EmbeddingStore(self.store.directory)
+        replaced = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        replace = os.replace
+
+        def slow_replace(src, dst):
+            # 只替换了向量文件时暂停，ids 文件仍是旧的
+            replace(src, dst)
+            if dst == self.store.vectors_path:
+                replaced.set()
+                release.wait(5)
+
+        results = []
+        with mock.patch('apps.images.embeddings.os.replace', slow_replace):
+            compact = threading.Thread(target=self.store.compact)
+            compact.start()
+            self.assertTrue(replaced.wait(5))
+            search_thread = threading.Thread(target=lambda: results.append(reader.search(_vector(1, 1, 0, 0), k=5)))
+            search_thread.start()
+            search_thread.join(0.3)
+            self.assertTrue(search_thread.is_alive(), "读取方在文件替换到一半时不应重新映射")
+            release.set()
+            compact.join(5)
+            search_thread.join(5)
+        self.assertEqual({i for i, _ in results[0]}, {1, 3})
+
+
+@override_settings(DEBUG=True, METRICS_SERVER_TIMING=False, IMAGE_RESPONSE_CACHE_TIMEOUT=0)
+class ServerTimingTests(TestCase):
+    """Server-Timing 头只返回给管理员 (或 METRICS_SERVER_TIMING=True)，与 DEBUG 无关"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='viewer', email='viewer@test.local')
+        cls.staff = User.objects.create(username='staff', email='staff@test.local', is_staff=True)
+
+    def get(self, user):
+        return self.client.get('/api/images/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    def test_hidden_from_users(self):
+        response = self.get(self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_shown_to_staff(self):
+        self.assertIn('db;desc=', self.get(self.staff)['Server-Timing'])
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_setting_shows_to_all(self):
+        self.assertIn('Server-Timing', self.get(self.user))
+
+
+def _jpeg(size, angle=0):
+    """渐变图：不同方向的渐变 phash 不同"""
+    buffer = io.BytesIO()
+    PilImage.linear_gradient('L').rotate(angle).resize(size).convert('RGB').save(buffer, 'JPEG')
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class ReplaceImageTests(TestCase):
+    """替换原图 (ImageSerializer.update) 后重新走完整的后处理"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='editor', email='editor@test.local')
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(
+            MEDIA_ROOT=tmp.name, IMAGE_PROCESSING_ASYNC=False,
+            CLIP_INFERENCE_SOCKET=os.path.join(tmp.name, 'no-clip.sock'), CLIP_INFERENCE_FALLBACK=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        serializer = ImageSerializer(data={'img_url': _jpeg((800, 600))})
+        serializer.is_valid(raise_exception=True)
+        self.image = serializer.save(user=self.user)
+
+    def replace(self, upload):
+        serializer = ImageSerializer(self.image, data={'img_url': upload}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_reprocessed(self):
+        old_thumb, old_phash = self.image.thumb_url.name, self.image.phash
+        image = self.replace(_jpeg((300, 900), 90))
+        image.refresh_from_db()
+        self.assertEqual(image.processing_status, Image.STATUS_DONE)
+        self.assertEqual((image.width, image.height), (300, 900))
+        self.assertNotEqual(image.thumb_url.name, old_thumb)
+        self.assertNotEqual(image.phash, old_phash)
+
+    @override_settings(IMAGE_PROCESSING_ASYNC=True)
+    def test_enqueued(self):
+        image = self.replace(_jpeg((300, 900), 90))
+        self.assertEqual(image.processing_status, Image.STATUS_PENDING)
+        self.assertTrue(ProcessingJob.objects.filter(image=image, status=ProcessingJob.STATUS_PENDING).exists())
+
+
+class JobQueueTests(TestCase):
+    """后台任务队列 (jobs.py)：处理函数用桩函数替换"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='worker', email='worker@test.local')
+
+    def setUp(self):
+        self.processed = []
+        self.error = None
+        patcher = mock.patch.object(jobs, 'process_image', self.process)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def process(self, image, auto_tag=False, prepared=None):
+        self.processed.append(image.pk)
+        # 执行过程中的超时检查
+        self.stale = jobs.requeue_stale(timeout_seconds=300)
+        if self.error is not None:
+            raise self.error
+
+    def enqueue(self, count):
+        images = [Image.objects.create(user=self.user, img_url='uploads/test/job.jpg') for _ in range(count)]
+        for image in images:
+            jobs.enqueue(image)
+        return images
+
+    def backdate(self, job, seconds):
+        ProcessingJob.objects.filter(pk=job.pk).update(start_time=F('start_time') - timedelta(seconds=seconds))
+        job.refresh_from_db()
+
+    def test_start_time_stamped_when_run(self):
+        self.enqueue(2)
+        first, second = jobs.claim_jobs(2)
+        jobs.run_job(first)
+        # 在本批中等待的时间不计入超时
+        self.backdate(second, 500)
+        self.assertTrue(jobs.run_job(second))
+        self.assertEqual(self.stale, 0)
+
+    def test_requeued_while_waiting_not_run_twice(self):
+        images = self.enqueue(2)
+        first, second = jobs.claim_jobs(2)
+        jobs.run_job(first)
+        self.backdate(second, 700)
+        self.assertEqual(jobs.requeue_stale(timeout_seconds=600), 1)
+        # 被其他线程重新领取并执行
+        again = jobs.claim_job()
+        self.assertEqual(again.pk, second.pk)
+        self.assertTrue(jobs.run_job(again))
+        self.assertFalse(jobs.run_job(second))
+        self.assertEqual(self.processed, [images[0].pk, images[1].pk])
+
+    def test_claim_in_order_once(self):
+        first, second = self.enqueue(2)
+        job = jobs.claim_job()
+        self.assertEqual((job.image_id, job.status, job.attempts), (first.pk, ProcessingJob.STATUS_RUNNING, 1))
+        self.assertEqual(jobs.claim_job().image_id, second.pk)
+        self.assertIsNone(jobs.claim_job())
+
+    @override_settings(IMAGE_JOB_MAX_ATTEMPTS=2)
+    def test_retry_then_fail(self):
+        image, = self.enqueue(1)
+        self.error = OSError('disk full')
+        self.assertFalse(jobs.run_job(jobs.claim_job()))
+        job = ProcessingJob.objects.get(image=image)
+        image.refresh_from_db()
+        self.assertEqual((job.status, job.error), (ProcessingJob.STATUS_PENDING, 'OSError: disk full'))
+        self.assertEqual(image.processing_status, Image.STATUS_PENDING)
+
+        self.assertFalse(jobs.run_job(jobs.claim_job()))
+        job.refresh_from_db()
+        image.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ProcessingJob.STATUS_FAILED, 2))
+        self.assertEqual(image.processing_status, Image.STATUS_FAILED)
+        self.assertIsNone(jobs.claim_job())
+
+    def test_success(self):
+        image, = self.enqueue(1)
+        self.assertTrue(jobs.run_job(jobs.claim_job()))
+        self.assertEqual(ProcessingJob.objects.get(image=image).status, ProcessingJob.STATUS_DONE)
+
+    def test_image_deleted_during_processing(self):
+        image, = self.enqueue(1)
+        job = jobs.claim_job()
+        self.error = ImageDeleted(image.pk)
+        self.assertFalse(jobs.run_job(job))
+        # 不当作失败重试
+        self.assertEqual(ProcessingJob.objects.get(pk=job.pk).status, ProcessingJob.STATUS_RUNNING)
+
+    def test_image_deleted_before_run(self):
+        image, = self.enqueue(1)
+        job = jobs.claim_job()
+        image.delete()
+        self.assertFalse(jobs.run_job(job))
+        self.assertEqual(self.processed, [])
+
+    def test_status_endpoint(self):
+        image, = self.enqueue(1)
+        self.error = OSError('disk full')
+        jobs.run_job(jobs.claim_job())
+        client = APIClient()
+        client.force_authenticate(self.user)
+        data = client.get(f'/api/images/{image.pk}/status/').json()
+        self.assertEqual(data, {
+            'id': image.pk, 'processing_status': Image.STATUS_PENDING, 'attempts': 1,
+            'error': 'OSError: disk full', 'thumb_url': None,
+        })
+
+
+@override_settings(IMAGE_RESPONSE_CACHE_TIMEOUT=0)
+class KeysetPaginationTests(TestCase):
+    """列表接口的游标分页：逐页取完与一次排序的结果一致，shoot_time 为空与相同的图片不重复、不遗漏"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='pager', email='pager@test.local')
+        same = datetime(2021, 5, 1, tzinfo=dt_timezone.utc)
+        times = [None, same, datetime(2020, 1, 1, tzinfo=dt_timezone.utc), None, same, same, None,
+                 datetime(2022, 3, 1, tzinfo=dt_timezone.utc)]
+        cls.images = [
+            Image.objects.create(user=user, img_url=f'uploads/test/page_{i}.jpg', is_public=True, shoot_time=t)
+            for i, t in enumerate(times)
+        ]
+
+    def walk(self, ordering):
+        ids = []
+        url = f'/api/images/?ordering={ordering}&page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            ids += [row['id'] for row in page['results']]
+            url = page['next']
+        return ids
+
+    def expected(self, field, desc):
+        # NULL 视为最小值，相同时按 id 排序
+        def key(image):
+            value = getattr(image, field)
+            return (value is not None, value or 0, image.id)
+        return [image.id for image in sorted(self.images, key=key, reverse=desc)]
+
+    def test_shoot_time_desc(self):
+        self.assertEqual(self.walk('-shoot_time'), self.expected('shoot_time', True))
+
+    def test_shoot_time_asc(self):
+        self.assertEqual(self.walk('shoot_time'), self.expected('shoot_time', False))
+
+    def test_upload_time_desc(self):
+        self.assertEqual(self.walk('-upload_time'), self.expected('upload_time', True))
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/images/?cursor=not-a-cursor').status_code, 404)
+
+
+@override_settings(IMAGE_RESPONSE_CACHE_TIMEOUT=0)
+class SearchIndexTests(TestCase):
+    """倒排索引检索 (search.search_images，列表接口的 ?q=)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='searcher', email='searcher@test.local')
+        other = User.objects.create(username='stranger', email='stranger@test.local')
+        beach = Category.objects.create(name='beach')
+
+        def create(user=cls.owner, tags=(), **fields):
+            image = Image.objects.create(user=user, img_url='uploads/test/search.jpg', **fields)
+            image.tags.add(*resolve_tags(tags))
+            index_image(image)
+            return image
+
+        cls.tagged = create(tags=['beach'])
+        cls.album = create(category=beach)
+        cls.located = create(location='beach road')
+        cls.prefix = create(tags=['beachwear'])
+        cls.hidden = create(user=other, tags=['beach'], is_public=False)
+        cls.unrelated = create(tags=['mountain'])
+
+    def search(self, query, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        response = client.get('/api/images/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_ranked_by_field_weight(self):
+        # 完整命中：标签 3x2 > 相册 2x2 > 前缀命中的标签 3 > 地点 1x2；其他用户的私有图片不可见
+        self.assertEqual(
+            self.search('beach', self.owner),
+            [self.tagged.id, self.album.id, self.prefix.id, self.located.id],
+        )
+
+    def test_prefix_match(self):
+        self.assertEqual(set(self.search('beachw', self.owner)), {self.prefix.id})
+
+    def test_stop_words_only(self):
+        self.assertEqual(self.search('的', self.owner), [])
+
+    def test_scores(self):
+        queryset, keywords = search.search_images(Image.objects.filter(user=self.owner), 'beach')
+        self.assertEqual(keywords, ['beach'])
+        scores = dict(queryset.values_list('id', 'search_score'))
+        self.assertEqual(scores, {self.tagged.id: 6, self.album.id: 4, self.prefix.id: 3, self.located.id: 2})
+
+    def test_tag_rename_reindexes(self):
+        tag = Tag.objects.get(name='mountain')
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        self.assertEqual(client.patch(f'/api/tags/{tag.id}/', {'name': 'volcano'}, format='json').status_code, 200)
+        self.assertEqual(self.search('volcano', self.owner), [self.unrelated.id])
+        self.assertEqual(self.search('mountain', self.owner), [])
+
+
+class InferenceBatcherTests(SimpleTestCase):
+    """/analyze/ 的动态批处理调度器 (batching.InferenceBatcher)"""
+
+    def setUp(self):
+        self.batches = []
+
+    def double(self, items):
+        self.batches.append(list(items))
+        if 'bad' in items:
+            raise ValueError('bad input')
+        if 'short' in items:
+            return items[:-1]
+        return [item * 2 for item in items]
+
+    def test_results_routed_in_batches(self):
+        batcher = InferenceBatcher(self.double, max_batch_size=4, max_wait_ms=500)
+        futures = [batcher.submit(i) for i in range(8)]
+        self.assertEqual([f.result(5) for f in futures], [i * 2 for i in range(8)])
+        self.assertEqual(self.batches, [[0, 1, 2, 3], [4, 5, 6, 7]])
+        stats = batcher.stats()
+        self.assertEqual((stats['batches'], stats['items'], stats['avg_batch_size']), (2, 8, 4))
+        self.assertEqual(stats['batch_size_histogram'], {4: 2})
+
+    def test_partial_batch_after_wait(self):
+        batcher = InferenceBatcher(self.double, max_batch_size=16, max_wait_ms=10)
+        self.assertEqual(batcher.submit(3).result(5), 6)
+        self.assertEqual(self.batches, [[3]])
+
+    def test_error_fails_whole_batch_only(self):
+        batcher = InferenceBatcher(self.double, max_batch_size=2, max_wait_ms=500)
+        first, second = batcher.submit('a'), batcher.submit('bad')
+        for future in (first, second):
+            with self.assertRaises(ValueError):
+                future.result(5)
+        # 调度线程继续处理后续的批
+        self.assertEqual(batcher.submit('c').result(5), 'cc')
+        self.assertEqual(batcher.stats()['errors'], 1)
+
+    def test_result_count_mismatch(self):
+        batcher = InferenceBatcher(self.double, max_batch_size=2, max_wait_ms=500)
+        futures = [batcher.submit('x'), batcher.submit('short')]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(5)
+
+
+
+def _flip(value, *bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+class MultiIndexTests(SimpleTestCase):
+    """多索引哈希的检索结果与逐个比较一致"""
+
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        hashes = [rng.getrandbits(duplicates.HASH_BITS) for _ in range(300)]
+        # 每个随机哈希附近再放几个近似值
+        hashes += [_flip(h, *rng.sample(range(duplicates.HASH_BITS), rng.randint(1, 10))) for h in hashes[:100]]
+        index = duplicates.MultiIndex()
+        for i, h in enumerate(hashes):
+            index.add(h, i)
+        for query in hashes[:150]:
+            for k in (0, 4, 8, 12):
+                expected = sorted((i, duplicates.hamming(query, h)) for i, h in enumerate(hashes)
+                                  if duplicates.hamming(query, h) <= k)
+                self.assertEqual(sorted(index.search(query, k)), expected)
+
+    def test_remove(self):
+        index = duplicates.MultiIndex()
+        index.add(5, 'a')
+        index.add(5, 'b')
+        index.remove(5, 'a')
+        self.assertEqual((index.search(5, 0), index.size), ([('b', 0)], 1))
+
+    def test_db_round_trip(self):
+        for value in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+            stored = duplicates.to_db(value)
+            self.assertTrue(-(1 << 63) <= stored < 1 << 63)
+            self.assertEqual(duplicates.from_db(stored), value)
+
+
+@override_settings(IMAGE_DUPLICATE_DISTANCE=8)
+class DuplicateGroupTests(TestCase):
+    """按用户的近似重复分组 (duplicates.duplicate_groups / find_duplicates)"""
+    BASE = 0x0123456789ABCDEF
+    OTHER = 0xFEDCBA9876543210
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='dups', email='dups@test.local')
+        cls.stranger = User.objects.create(username='dups_other', email='dups_other@test.local')
+
+        def create(value, user=cls.owner, **fields):
+            return Image.objects.create(user=user, img_url='uploads/test/dup.jpg',
+                                        phash=duplicates.to_db(value), **fields)
+
+        cls.original = create(cls.BASE)
+        # 与 original 距离 6，与 chained 距离 6：original 与 chained 距离 12，经由 resized 连成一组
+        cls.resized = create(_flip(cls.BASE, *range(6)))
+        cls.chained = create(_flip(cls.BASE, *range(12)))
+        cls.pair = [create(cls.OTHER), create(_flip(cls.OTHER, 40, 50))]
+        cls.unique = create(_flip(cls.BASE, *range(0, 64, 2)))
+        cls.pending = Image.objects.create(user=cls.owner, img_url='uploads/test/dup.jpg',
+                                           processing_status=Image.STATUS_PENDING)
+        # 其他用户的相同哈希不参与分组
+        create(cls.BASE, user=cls.stranger)
+
+    def setUp(self):
+        patcher = mock.patch.object(duplicates, '_index', duplicates.DuplicateIndex(sync_interval=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_groups(self):
+        self.assertEqual(duplicates.duplicate_groups(self.owner.id), [
+            [self.original.id, self.resized.id, self.chained.id],
+            [p.id for p in self.pair],
+        ])
+
+    def test_find_within_distance(self):
+        found = [(image.id, d) for image, d in duplicates.find_duplicates(self.original)]
+        self.assertEqual(found, [(self.resized.id, 6)])
+
+    def test_deleted_and_processed_later(self):
+        duplicates.duplicate_groups(self.owner.id)
+        # 其他进程删除图片、完成后处理 (写入哈希)：下次同步时看到
+        Image.objects.filter(pk=self.pair[1].pk).delete()
+        Image.objects.filter(pk=self.pending.pk).update(
+            phash=duplicates.to_db(_flip(self.BASE, 63)), processing_status=Image.STATUS_DONE)
+        self.pending.refresh_from_db()
+        found = {image.id for image, _ in duplicates.find_duplicates(self.pending)}
+        self.assertEqual(found, {self.original.id, self.resized.id})
+        self.assertEqual(duplicates.find_duplicates(self.pair[0]), [])
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        data = client.get('/api/images/duplicates/', {'distance': 4}).json()
+        self.assertEqual(data, {'count': 1, 'groups': [[p.id for p in self.pair]]})
+
+
+@override_settings(IMAGE_PROCESSING_ASYNC=True)
+class BlobRefCountTests(TestCase):
+    """内容寻址的原图存储：相同内容共用一个文件，替换 / 删除图片时按引用计数释放"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='blobs', email='blobs@test.local')
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(MEDIA_ROOT=tmp.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        patcher = mock.patch.object(embeddings, '_store', EmbeddingStore(os.path.join(tmp.name, 'embeddings')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, upload):
+        serializer = ImageSerializer(data={'img_url': upload})
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(user=self.user)
+
+    def refs(self, image):
+        blob = Blob.objects.filter(name=image.img_url.name).first()
+        return blob.ref_count if blob else 0
+
+    def exists(self, name):
+        return blobs.storage().exists(name)
+
+    def test_same_content_shared(self):
+        first, second = self.upload(_jpeg((64, 48))), self.upload(_jpeg((64, 48)))
+        self.assertEqual(first.img_url.name, second.img_url.name)
+        self.assertTrue(first.img_url.name.startswith(blobs.PREFIX))
+        self.assertEqual((self.refs(first), Blob.objects.count()), (2, 1))
+
+    def test_replace(self):
+        first, second = self.upload(_jpeg((64, 48))), self.upload(_jpeg((64, 48)))
+        old = first.img_url.name
+        serializer = ImageSerializer(first, data={'img_url': _jpeg((64, 48), 90)}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertNotEqual(first.img_url.name, old)
+        self.assertEqual((self.refs(first), self.refs(second)), (1, 1))
+        self.assertTrue(self.exists(old))
+
+    def test_delete(self):
+        first, second = self.upload(_jpeg((64, 48))), self.upload(_jpeg((64, 48)))
+        name = first.img_url.name
+        self.assertEqual(self.client.delete(f'/api/images/{first.id}/').status_code, 204)
+        self.assertEqual(self.refs(second), 1)
+        self.assertTrue(self.exists(name))
+        # 最后一个引用删除时文件与记录一并删除
+        self.assertEqual(self.client.delete(f'/api/images/{second.id}/').status_code, 204)
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(self.exists(name))
+
+    def test_legacy_path_deleted(self):
+        image = self.upload(_jpeg((64, 48)))
+        legacy = blobs.storage().save('uploads/2020/01/legacy.jpg', _jpeg((64, 48)))
+        Image.objects.filter(pk=image.pk).update(img_url=legacy)
+        blobs.release(image.img_url.name)
+        self.assertEqual(self.client.delete(f'/api/images/{image.id}/').status_code, 204)
+        self.assertFalse(self.exists(legacy))
+
+
+@override_settings(
+    IMAGE_RESPONSE_CACHE_TIMEOUT=300,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'response-cache-tests'}},
+)
+class ResponseCacheTests(TestCase):
+    """列表 / 详情的响应缓存：生成代号换代后失效，If-None-Match 命中时返回 304"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='cached', email='cached@test.local')
+        cls.image = Image.objects.create(user=cls.owner, img_url='uploads/test/cache.jpg', location='old')
+        cls.private = Image.objects.create(user=cls.owner, img_url='uploads/test/cache.jpg', is_public=False)
+
+    def setUp(self):
+        cache.clear()
+        self.owner_client = APIClient()
+        self.owner_client.force_authenticate(self.owner)
+
+    def test_not_modified_without_queries(self):
+        first = self.client.get('/api/images/')
+        etag = first['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/images/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get('/api/images/', HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_cached_until_bump(self):
+        url = f'/api/images/{self.image.id}/'
+        etag = self.client.get(url)['ETag']
+        # 不经过接口的修改不换代号，继续返回缓存的响应
+        Image.objects.filter(pk=self.image.pk).update(location='direct')
+        self.assertEqual(self.client.get(url).json()['location'], 'old')
+
+        # 接口写请求成功后换代号，之前的修改随之可见
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.owner_client.patch(url, {'tag_names': ['new']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['location'], 'direct')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_bump_after_commit(self):
+        before = responsecache.generation()
+        with self.captureOnCommitCallbacks() as callbacks:
+            responsecache.bump()
+            self.assertEqual(responsecache.generation(), before)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(responsecache.generation(), before)
+
+    def test_keyed_by_user(self):
+        anonymous = [row['id'] for row in self.client.get('/api/images/').json()['results']]
+        own = [row['id'] for row in self.owner_client.get('/api/images/').json()['results']]
+        self.assertEqual(anonymous, [self.image.id])
+        self.assertEqual(own, [self.private.id, self.image.id])
+
+
+@override_settings(IMAGE_PROCESSING_ASYNC=True, IMAGE_RESPONSE_CACHE_TIMEOUT=0)
+class FacetCountTests(TestCase):
+    """分面计数的增量更新与 reconcile_facets 从头重算的结果一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='facets', email='facets@test.local')
+        cls.other = User.objects.create(username='facets_other', email='facets_other@test.local')
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(MEDIA_ROOT=tmp.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        patcher = mock.patch.object(embeddings, '_store', EmbeddingStore(os.path.join(tmp.name, 'embeddings')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def upload(self, user, angle=0, **data):
+        serializer = ImageSerializer(data={'img_url': _jpeg((64, 48), angle), **data})
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(user=user)
+
+    def processed(self, image, camera_model, shoot_time):
+        """后台处理写入 EXIF (processing._save_processed)"""
+        image.camera_model, image.shoot_time = camera_model, shoot_time
+        _save_processed(image)
+
+    def counts(self):
+        return dict(
+            ((facet, key, user_id, is_public), count) for facet, key, user_id, is_public, count
+            in FacetCount.objects.filter(count__gt=0).values_list('facet', 'key', 'user_id', 'is_public', 'count')
+        )
+
+    def test_matches_reconcile(self):
+        owner = self.client_for(self.owner)
+        first = self.upload(self.owner, tag_names=['sea', 'sky'], category_upload='trip')
+        second = self.upload(self.owner, 90, tag_names=['sea'], is_public=False)
+        third = self.upload(self.other, 180, tag_names=['sky'], category_upload='trip')
+        self.processed(first, 'X-T5', datetime(2023, 6, 1, 12, tzinfo=dt_timezone.utc))
+        self.processed(second, 'X-T5', datetime(2024, 1, 2, 12, tzinfo=dt_timezone.utc))
+
+        response = owner.patch(f'/api/images/{first.id}/', {'tag_names': ['sea', 'sun'], 'is_public': False}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(owner.patch(f'/api/images/{second.id}/', {'category_upload': 'home'}, format='json').status_code, 200)
+        self.assertEqual(self.client_for(self.other).delete(f'/api/images/{third.id}/').status_code, 204)
+        self.assertEqual(owner.delete(f"/api/tags/{Tag.objects.get(name='sun').id}/").status_code, 204)
+
+        incremental = self.counts()
+        out = io.StringIO()
+        call_command('reconcile_facets', stdout=out)
+        self.assertIn('修正 0 行计数', out.getvalue())
+        self.assertEqual(self.counts(), incremental)
+
+        facet_counts = owner.get('/api/images/facets/').json()
+        self.assertEqual(facet_counts['total'], 2)
+        self.assertEqual(facet_counts['cameras'], [{'name': 'X-T5', 'count': 2}])
+        self.assertEqual(facet_counts['years'], [{'year': 2024, 'count': 1}, {'year': 2023, 'count': 1}])
+        self.assertEqual([(t['name'], t['count']) for t in facet_counts['tags']], [('sea', 2)])
+        # 其他用户只看到公开图片：first 已改为私有，third 已删除
+        self.assertEqual(self.client.get('/api/images/facets/').json()['total'], 0)
+
+    def test_reconcile_fixes_drift(self):
+        image = self.upload(self.owner, tag_names=['sea'])
+        expected = self.counts()
+        # 不经过 facets.apply 的修改 (如管理后台) 产生偏差
+        Image.objects.filter(pk=image.pk).update(camera_model='ILCE-7M4')
+        call_command('reconcile_facets', stdout=io.StringIO())
+        expected[(facets.CAMERA, 'ILCE-7M4', self.owner.id, True)] = 1
+        expected[(facets.CAMERA, 'ILCE-7M4', facets.PUBLIC, True)] = 1
+        self.assertEqual(self.counts(), expected)
+
+
+@override_settings(IMAGE_RESPONSE_CACHE_TIMEOUT=0, TIME_ZONE='UTC')
+class ShootTimeRangeTests(TestCase):
+    """列表接口的拍摄时间范围 (两端都包含) 与时间线接口"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='timeline', email='timeline@test.local')
+
+        def create(*args):
+            image = Image.objects.create(user=user, img_url='uploads/test/time.jpg',
+                                         shoot_time=datetime(*args, tzinfo=dt_timezone.utc) if args else None)
+            facets.apply((None, facets.snapshot(image, [])))
+            return image
+
+        cls.before = create(2024, 2, 29, 23, 59)
+        cls.start = create(2024, 3, 1)
+        cls.last = create(2024, 3, 31, 23, 30)
+        cls.after = create(2024, 4, 1)
+        cls.older = create(2023, 7, 15)
+        cls.undated = create()
+
+    def ids(self, **params):
+        response = self.client.get('/api/images/', {'ordering': 'shoot_time', **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_date_range_inclusive(self):
+        self.assertEqual(self.ids(start_date='2024-03-01', end_date='2024-03-31'), [self.start.id, self.last.id])
+
+    def test_datetime_end(self):
+        self.assertEqual(self.ids(start_date='2024-03-01', end_date='2024-03-31T12:00:00Z'), [self.start.id])
+
+    def test_open_ended(self):
+        self.assertEqual(self.ids(start_date='2024-04-01'), [self.after.id])
+        self.assertEqual(self.ids(end_date='2023-12-31'), [self.older.id])
+
+    def test_invalid_date(self):
+        self.assertEqual(self.client.get('/api/images/', {'end_date': '2024-13-01'}).status_code, 400)
+
+    def test_timeline(self):
+        data = self.client.get('/api/images/timeline/', {'granularity': 'month'}).json()
+        self.assertEqual(data, {
+            'granularity': 'month', 'total': 6, 'undated': 1,
+            'buckets': [
+                {'period': '2024-04', 'count': 1}, {'period': '2024-03', 'count': 2},
+                {'period': '2024-02', 'count': 1}, {'period': '2023-07', 'count': 1},
+            ],
+        })
+
+    def test_timeline_range(self):
+        data = self.client.get('/api/images/timeline/', {
+            'granularity': 'day', 'start_date': '2024-03-01', 'end_date': '2024-03-31'}).json()
+        self.assertEqual(data['buckets'], [{'period': '2024-03-31', 'count': 1}, {'period': '2024-03-01', 'count': 1}])
+        self.assertNotIn('undated', data)
+        self.assertEqual(self.client.get('/api/images/timeline/', {'granularity': 'week'}).status_code, 400)
+
+
+@override_settings(IMAGE_RESPONSE_CACHE_TIMEOUT=0)
+class ListRepresentationTests(TestCase):
+    """列表接口的精简表示 (listing.represent)：各字段与详情接口 (ImageSerializer) 同名同格式，查询次数固定"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='lister', email='lister@test.local')
+        album = Category.objects.create(name='trip')
+        cls.full = Image.objects.create(
+            user=cls.owner, category=album, img_url='originals/ab/cd/photo name.jpg', thumb_url='thumbs/2024/05/t.jpg',
+            width=4032, height=3024, camera_model='X-T5', location='上海市 黄浦区',
+            shoot_time=datetime(2024, 5, 1, 8, 30, 15, 123456, tzinfo=dt_timezone.utc),
+        )
+        cls.full.tags.add(*resolve_tags(['sea', 'sky']))
+        cls.bare = Image.objects.create(user=cls.owner, img_url='uploads/test/bare.heic',
+                                        processing_status=Image.STATUS_PENDING, is_public=False)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_matches_serializer(self):
+        rows = {row['id']: row for row in self.client.get('/api/images/').json()['results']}
+        self.assertEqual(set(rows), {self.full.id, self.bare.id})
+        for image in (self.full, self.bare):
+            detail = self.client.get(f'/api/images/{image.id}/').json()
+            row = rows[image.id]
+            self.assertEqual(set(row), {name for name, _ in listing.FIELDS} | {'tags'})
+            # 没有相册时 ImageSerializer 省略 category_name，列表固定返回 null
+            self.assertEqual(row, {key: detail.get(key) for key in row})
+
+    def test_query_count_independent_of_tags(self):
+        for i in range(5):
+            image = Image.objects.create(user=self.owner, img_url=f'uploads/test/more_{i}.jpg')
+            image.tags.add(*resolve_tags([f'tag_{i}', f'tag_{i + 1}']))
+        # 列表 + 本页全部标签
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/images/')
+        self.assertEqual(len(response.json()['results']), 7)
@@ -0,0 +1,35 @@
+"""
+边接收边计算 SHA-256 的上传处理器 (settings.FILE_UPLOAD_HANDLERS)
+结果记在上传文件对象的 sha256 属性上，保存到内容寻址存储时 (blobs.store) 不必再读一遍文件
+"""
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class _HashingMixin:
+    def new_file(self, *args, **kwargs):
+        # MemoryFileUploadHandler 接管文件时会抛出 StopFutureHandlers，需在调用父类之前初始化
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        data = super().receive_data_chunk(raw_data, start)
+        # 返回 None 表示这块数据由本处理器接收；否则交给下一个处理器，由它计算
+        if data is None:
+            self.sha256.update(raw_data)
+        return data
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(_HashingMixin, MemoryFileUploadHandler):
+    """小文件 (不超过 FILE_UPLOAD_MAX_MEMORY_SIZE) 保存在内存中"""
+
+
+class HashingTemporaryFileUploadHandler(_HashingMixin, TemporaryFileUploadHandler):
+    """大文件流式写入临时文件"""
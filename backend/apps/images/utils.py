@@ -1,13 +1,18 @@
 from PIL import Image as PilImage
 from PIL import ImageOps
 from PIL.ExifTags import TAGS, GPSTAGS
+from contextlib import contextmanager
 from datetime import datetime
 import io
 import os
+import threading
+import time
 import pillow_heif
+from django.conf import settings
 from django.core.files.base import ContentFile
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from geopy.geocoders import Nominatim
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from .geocoding import reverse_geocode
+from . import metrics
 
 pillow_heif.register_heif_opener()
 
@@ -22,6 +27,7 @@ def handle_heic_image(image_file):
     """
     检查是否为 HEIC 文件，如果是，则转换为 JPG 并保留 EXIF。
     如果不是，原样返回。
+    转换结果写入临时文件 (见 UploadImage.to_jpeg)，不在内存中保留 JPEG 副本
     """
     # 1. 检查扩展名
     if not image_file.name.lower().endswith(('.heic', '.heif')):
@@ -29,48 +35,10 @@ def handle_heic_image(image_file):
         return image_file
 
     try:
-        # 2. 打开 HEIC 图片
-        print("正在打开图片...")
-        image_file.seek(0)
-        heif_file = pillow_heif.read_heif(image_file)
-
-        img = PilImage.frombytes(
-            heif_file.mode, 
-            heif_file.size, 
-            heif_file.data, 
-            "raw", 
-            heif_file.mode, 
-            heif_file.stride,
-        )
-        
-        # 3. 转换为 RGB (HEIC 可能是 RGBA)
-        print(f"原始格式: {img.format}, 模式: {img.mode}")
-        img = img.convert('RGB')
-        
-        # 4. 提取 EXIF 数据 (关键步骤，否则转换后 EXIF 丢失)
-        exif_data = heif_file.info.get('exif')
-
-        # 5. 保存为 JPEG 到内存中
-        output_io = io.BytesIO()
-        print("正在进行编码转换...")
-        img.save(output_io, format='JPEG', quality=95, exif=exif_data if exif_data else b"")
-        file_size = output_io.tell()
-        output_io.seek(0)
-        
-        # 6. 生成新的文件名 (xxx.heic -> xxx.jpg)
-        new_name = image_file.name.rsplit('.', 1)[0] + '.jpg'
-        print(f"转换成功！新文件名: {new_name}")
-        
-        # 7. 返回 Django 可识别的文件对象
-        return InMemoryUploadedFile(
-            file=output_io,
-            field_name='img_url',
-            name=new_name,
-            content_type='image/jpeg',
-            size=file_size,
-            charset=None
-        )
-
+        ctx = UploadImage(image_file)
+        jpeg = ctx.to_jpeg()
+        metrics.record(ctx.timings)
+        return jpeg
     except Exception as e:
         print(f"转换错误：{str(e)}") 
         import traceback
@@ -78,173 +46,331 @@ def handle_heic_image(image_file):
         return image_file # 如果失败，返回原文件尝试处理
     
 def get_address_from_gps(lat, lon):
+    """逆地理编码 (带缓存，见 geocoding.reverse_geocode)"""
+    return reverse_geocode(lat, lon)
+
+def _parse_exif(info):
+    """
+    从 PIL Exif 对象中解析拍摄时间、相机型号、ISO、光圈、快门、GPS 地址
+    拍摄参数位于 Exif 子 IFD (0x8769)，相机型号位于 IFD0，两处合并后统一处理
+    """
+    exif_data = {}
+    if not info:
+        return exif_data
+
+    tags = dict(info.items())
     try:
-        geolocator = Nominatim(user_agent="image_manager_app", timeout=5)
-        location = geolocator.reverse(f"{lat}, {lon}", language='zh-cn')
-        
-        if not location:
-            return f"{lat:.4f}, {lon:.4f}"
+        tags.update(info.get_ifd(0x8769))
+    except Exception:
+        pass
 
-        addr = location.raw['address']
+    # 1. 处理常规 Tag (时间、相机型号)
+    for tag, value in tags.items():
+        decoded = TAGS.get(tag, tag)
         
-        # 1. 提取省份/直辖市
-        state = addr.get('state') or ''
+        if decoded == "DateTimeOriginal":
+            try:
+                date_str = str(value).strip().replace('\x00', '')
+                exif_data['shoot_time'] = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
+            except (ValueError, TypeError):
+                exif_data['shoot_time'] = None
         
-        # 2. 提取城市 (地级单位)
-        # 优先找 state_district，找不到找 city
-        city = addr.get('state_district') or addr.get('city') or ''
+        elif decoded == "Model":
+            exif_data['camera_model'] = str(value).strip().replace('\x00', '')
         
-        # 3. 提取区县 (县级单位)
-        # 增加 suburb (社区/郊区) 和 city_district (城市区)
-        district = (
-            addr.get('county') or 
-            addr.get('district') or 
-            addr.get('city_district') or 
-            addr.get('suburb') or 
-            ''
-        )
+        elif decoded == "ISOSpeedRatings":
+            exif_data['iso'] = value[0] if isinstance(value, tuple) else value
         
-        # 4. 提取具体兴趣点 (POI)
-        poi = (
-            addr.get('building') or 
-            addr.get('amenity') or 
-            addr.get('tourism') or 
-            addr.get('leisure') or 
-            addr.get('historic') or 
-            addr.get('shop') or 
-            addr.get('office') or 
-            addr.get('road') or 
-            addr.get('village') or 
-            ''
-        )
-        
-        # 如果是直辖市 (state 和 city 相同)，去掉 state 避免重复 (如: 北京市北京市)
-        if state and city and (state in city or city in state):
-            state = ""
-        
-        # 如果 district 和 city 相同，去掉 district
-        if district and city and (district in city):
-            district = ""
+        elif decoded == "FNumber":
+            # 有些相机返回的是分数，有些是浮点
+            exif_data['f_stop'] = float(value) if value else None
+            
+        elif decoded == "ExposureTime":
+             # 转换为字符串存储快门速度 (如 "1/100")
+            exif_data['exposure_time'] = str(value)
 
-        # 过滤掉空字符串，用 "·" 或 " " 连接更符合地图展示习惯
-        parts = [p for p in [state, city, district, poi] if p]
-        full_addr = "-".join(parts)
+    # 2. 专门处理 GPS 数据
+    gps_info = info.get_ifd(0x8825)
+    
+    if gps_info:
+        gps_data = {}
+        for t, value in gps_info.items():
+            sub_decoded = GPSTAGS.get(t, t)
+            gps_data[sub_decoded] = value
+    
+        # 解析经纬度
+        if 'GPSLatitude' in gps_data and 'GPSLongitude' in gps_data:
+            try:
+                lat = _convert_to_degrees(gps_data['GPSLatitude'])
+                lon = _convert_to_degrees(gps_data['GPSLongitude'])
+                
+                # 修正南北纬/东西经
+                if gps_data.get('GPSLatitudeRef') == 'S': lat = -lat
+                if gps_data.get('GPSLongitudeRef') == 'W': lon = -lon
 
-        return full_addr if full_addr.strip() else location.address
+                # 只记录坐标，逆地理编码 (可能访问网络 / 数据库) 由 geocode_exif 完成
+                exif_data['gps'] = (float(lat), float(lon))
 
-    except Exception as e:
-        print(f"地理位置解析失败: {e}")
-        return f"{lat:.4f}, {lon:.4f}"
+            except Exception as e:
+                print(f"GPS parsing error: {e}")
 
-def get_exif_data(image_file):
+    return exif_data
+
+def geocode_exif(exif_data):
+    """根据 _parse_exif 得到的 GPS 坐标补充 location (就地修改并返回)"""
+    gps = exif_data.get('gps')
+    if gps and 'location' not in exif_data:
+        try:
+            exif_data['location'] = get_address_from_gps(*gps)
+        except Exception as e:
+            print(f"GPS parsing error: {e}")
+    return exif_data
+
+
+class MemoryBudget:
     """
-    提取图片的宽、高以及EXIF信息（拍摄时间、相机型号、GPS经纬度）
+    进程内的解码内存预算
+    完整解码大图前按估算的字节数申请额度，已占用的额度超过上限时排队等待，
+    这样并发上传再多，同时展开的像素缓冲区也不会超过上限；
+    单张超过上限的图片按上限计算 (即空闲时独占执行)。limit 为 0 表示不限制
     """
-    image_file.seek(0)
 
-    try:
-        img = PilImage.open(image_file) 
-        img.verify() 
-        image_file.seek(0)
-        img = PilImage.open(image_file)
-    except Exception:
-        return {}, 0, 0
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self._used = 0
+        self._cond = threading.Condition()
+        self._stats = {'reservations': 0, 'waits': 0, 'peak_bytes': 0}
 
-    exif_data = {}
-    
-    # 获取 EXIF 对象
-    info = img.getexif()
-    
-    if info:
-        # 1. 处理常规 Tag (时间、相机型号)
-        for tag, value in info.items():
-            decoded = TAGS.get(tag, tag)
-            
-            if decoded == "DateTimeOriginal":
-                try:
-                    date_str = str(value).strip().replace('\x00', '')
-                    exif_data['shoot_time'] = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-                except (ValueError, TypeError):
-                    exif_data['shoot_time'] = None
-            
-            elif decoded == "Model":
-                exif_data['camera_model'] = str(value).strip()
-            
-            elif decoded == "ISOSpeedRatings":
-                exif_data['iso'] = value
-            
-            elif decoded == "FNumber":
-                # 有些相机返回的是分数，有些是浮点
-                exif_data['f_stop'] = float(value) if value else None
-                
-            elif decoded == "ExposureTime":
-                 # 转换为字符串存储快门速度 (如 "1/100")
-                exif_data['exposure_time'] = str(value)
+    @contextmanager
+    def reserve(self, nbytes):
+        if not self.limit:
+            yield
+            return
 
-        # 2. 专门处理 GPS 数据
-        gps_info = info.get_ifd(0x8825)
-        
-        if gps_info:
-            gps_data = {}
-            for t, value in gps_info.items():
-                sub_decoded = GPSTAGS.get(t, t)
-                gps_data[sub_decoded] = value
-        
-            # 解析经纬度
-            if 'GPSLatitude' in gps_data and 'GPSLongitude' in gps_data:
-                try:
-                    lat = _convert_to_degrees(gps_data['GPSLatitude'])
-                    lon = _convert_to_degrees(gps_data['GPSLongitude'])
-                    
-                    # 修正南北纬/东西经
-                    if gps_data.get('GPSLatitudeRef') == 'S': lat = -lat
-                    if gps_data.get('GPSLongitudeRef') == 'W': lon = -lon
+        nbytes = min(int(nbytes), self.limit)
+        with self._cond:
+            self._stats['reservations'] += 1
+            if self._used + nbytes > self.limit:
+                self._stats['waits'] += 1
+            self._cond.wait_for(lambda: self._used + nbytes <= self.limit)
+            self._used += nbytes
+            self._stats['peak_bytes'] = max(self._stats['peak_bytes'], self._used)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._used -= nbytes
+                self._cond.notify_all()
 
-                    # 调用之前的逆地理编码函数
-                    exif_data['location'] = get_address_from_gps(lat, lon)
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, used_bytes=self._used, limit_bytes=self.limit)
 
-                except Exception as e:
-                    print(f"GPS parsing error: {e}")
 
-    return exif_data, img.width, img.height
+_decode_budget = None
+_decode_budget_lock = threading.Lock()
 
-def make_thumbnail(image_file, size=(300, 300)):
+
+def get_decode_budget():
+    global _decode_budget
+    if _decode_budget is None:
+        with _decode_budget_lock:
+            if _decode_budget is None:
+                limit_mb = getattr(settings, 'IMAGE_DECODE_MEMORY_LIMIT_MB', 512)
+                _decode_budget = MemoryBudget(limit_mb * 1024 * 1024)
+    return _decode_budget
+
+
+@contextmanager
+def timed(timings, name):
+    """把 with 块的耗时 (毫秒) 累加到 timings[name]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + (time.perf_counter() - start) * 1000
+
+
+class UploadImage:
     """
-    生成缩略图
-    :param image_file: 原始图片文件对象
-    :param size: 缩略图最大尺寸 (宽, 高)
-    :return: Django ContentFile 对象
+    一次上传的图片处理上下文
+    文件头和 EXIF 只解析一次；像素最多解码一次，并立即缩小到 working_size，
+    缩略图、CLIP 预处理等后续步骤共用同一张缩小后的图片。
+    JPEG 通过 draft 在 DCT 域按 1/2、1/4、1/8 缩小解码；HEIC 优先使用内嵌的缩略图，
+    都不会在内存中展开原尺寸像素 (HEIC 转 JPEG 的情况除外，此时受 get_decode_budget() 限制)。
+    用法:
+        ctx = UploadImage(f)
+        jpeg = ctx.to_jpeg()          # 仅 HEIC 需要，必须在 working_image 之前调用 (返回磁盘临时文件)
+        exif = ctx.exif_data()
+        thumb = ctx.thumbnail()
+        tags = classify_image(ctx.working_image())
     """
-    image_file.seek(0)
-    
-    try: 
-        img = PilImage.open(image_file)
+    # 工作图尺寸：足够生成 300px 缩略图和 224px 的 CLIP 输入
+    WORKING_SIZE = 1024
+    # 先按整数倍粗缩小到不小于目标尺寸 REDUCING_GAP 倍，再用 LANCZOS 精确缩放
+    REDUCING_GAP = 2.0
 
-        # 解决手机竖屏拍照在缩略图中变成横屏的问题
-        img = ImageOps.exif_transpose(img)
+    def __init__(self, image_file, working_size=None):
+        self.file = image_file
+        self.name = getattr(image_file, 'name', None) or 'image.jpg'
+        self.working_size = working_size or self.WORKING_SIZE
+        self.timings = {}
+
+        with self.stage('open'):
+            image_file.seek(0)
+            # 只读取文件头，不解码像素
+            self.image = PilImage.open(image_file)
+            self.format = self.image.format
+            self.width, self.height = self.image.size
+            self._exif = self.image.getexif()
+
+        self._exif_data = None
+        self._working = None
+
+    def stage(self, name):
+        """记录某个步骤的耗时 (毫秒)，同名步骤累加"""
+        return timed(self.timings, name)
+
+    @property
+    def is_heic(self):
+        return self.format in ('HEIF', 'HEIC', 'AVIF') or self.name.lower().endswith(('.heic', '.heif'))
+
+    def exif_data(self, geocode=True):
+        """
+        EXIF 信息字典；geocode=False 时只给出 GPS 坐标 ('gps')，不做逆地理编码
+        (进程池中的子进程只做 CPU 密集的部分，见 processing.prepare)
+        """
+        if self._exif_data is None:
+            with self.stage('exif'):
+                self._exif_data = _parse_exif(self._exif)
+        if geocode:
+            with self.stage('geocode'):
+                geocode_exif(self._exif_data)
+        return self._exif_data
+
+    def _decode_cost(self, size):
+        """估算解码 size 大小的图片需要的内存 (字节)；HEIC 解码时 libheif 与 Pillow 各持有一份像素"""
+        return size[0] * size[1] * (8 if self.is_heic else 4)
+
+    def to_jpeg(self, quality=95):
+        """
+        HEIC 转 JPEG (保留 EXIF)，直接编码到磁盘临时文件，返回 Django 文件对象
+        (TemporaryUploadedFile，保存到 FileSystemStorage 时是移动文件而不是复制)。
+        这一步需要完整解码，受 get_decode_budget() 限制；编码完成后立即缩小为工作图，
+        原尺寸像素不会保留到后续步骤。working_size 需在调用前确定
+        """
+        if self._working is not None:
+            raise RuntimeError("to_jpeg() 必须在 working_image() 之前调用")
+
+        new_name = self.name.rsplit('.', 1)[0] + '.jpg'
+        output = TemporaryUploadedFile(new_name, 'image/jpeg', 0, None)
+        output.size = self.save_jpeg(output.file, quality)
+        output.file.seek(0)
+        return output
+
+    def save_jpeg(self, fp, quality=95):
+        """to_jpeg 的实际编码：把 JPEG 写入已打开的文件 fp，返回写入的字节数"""
+        if self._working is not None:
+            raise RuntimeError("save_jpeg() 必须在 working_image() 之前调用")
+
+        with self.stage('heic_to_jpeg'), get_decode_budget().reserve(self._decode_cost(self.image.size)):
+            img = self.image
+            exif_bytes = img.info.get('exif') or (self._exif.tobytes() if self._exif else b"")
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+
+            start = fp.tell()
+            img.save(fp, format='JPEG', quality=quality, exif=exif_bytes)
+            size = fp.tell() - start
+
+            self.image = img
+            self._working = self._shrink(img, (self.working_size, self.working_size))
+
+        return size
+
+    def _draft(self, img, size):
+        """
+        让解码器直接输出缩小的图片
+        JPEG: DCT 缩放，解码结果不小于目标尺寸的 REDUCING_GAP 倍
+        HEIC: 选用不小于目标尺寸的内嵌缩略图 (手机照片通常自带)，没有则完整解码
+        """
+        w, h = img.size
+        scale = min(size[0] / w, size[1] / h, 1)
+        target = (max(1, round(w * scale)), max(1, round(h * scale)))
+        if not self.is_heic:
+            target = tuple(int(x * self.REDUCING_GAP) for x in target)
+        img.draft('RGB', target)
 
-        if img.width > 4096 or img.height > 4096:
-            img.thumbnail((4096, 4096), PilImage.Resampling.LANCZOS)
+    def working_image(self):
+        """解码并缩小后的 RGB 图片 (已按 EXIF 方向校正)，只计算一次"""
+        if self._working is None:
+            with self.stage('decode'):
+                img = self.image
+                size = (self.working_size, self.working_size)
+                # 其他格式 (PNG 等) 不支持 draft，不做任何事
+                self._draft(img, size)
+                # draft 之后 img.size 就是实际要解码的尺寸
+                with get_decode_budget().reserve(self._decode_cost(img.size)):
+                    self._working = self._shrink(img, size)
+        return self._working
 
+    def _shrink(self, img, size):
+        # thumbnail 会就地缩放，之后不再需要原尺寸像素
+        img.thumbnail(size, PilImage.Resampling.LANCZOS, reducing_gap=self.REDUCING_GAP)
+        # 解决手机竖屏拍照在缩略图中变成横屏的问题
+        img = ImageOps.exif_transpose(img)
         # 如果图片是 RGBA (如 PNG)，转换为 RGB，否则保存为 JPEG 会报错
-        if img.mode in ('RGBA', 'P'):
+        if img.mode != 'RGB':
             img = img.convert('RGB')
+        return img
 
-        # 保持比例缩放
-        img.thumbnail(size)
+    def thumbnail(self, size=(300, 300), quality=85):
+        """生成缩略图，返回 Django ContentFile 对象"""
+        working = self.working_image()
+        with self.stage('thumbnail'):
+            img = working.copy()
+            # 保持比例缩放
+            img.thumbnail(size)
 
-        # 将图片保存到内存中
-        thumb_io = io.BytesIO()
-        img.save(thumb_io, 'JPEG', quality=85)
+            # 将图片保存到内存中
+            thumb_io = io.BytesIO()
+            img.save(thumb_io, 'JPEG', quality=quality)
 
         # 生成文件名 (例如: original_thumb.jpg)
-        name = image_file.name
-        if not name:
-            name = 'image.jpg'
-        base_name, _ = os.path.splitext(name)
-        thumb_name = f"{base_name}_thumb.jpg"
+        base_name, _ = os.path.splitext(os.path.basename(self.name))
+        return ContentFile(thumb_io.getvalue(), name=f"{base_name}_thumb.jpg")
+
+    def close(self):
+        self.image.close()
+
+
+def get_exif_data(image_file):
+    """
+    提取图片的宽、高以及EXIF信息（拍摄时间、相机型号、GPS经纬度）
+    """
+    try:
+        ctx = UploadImage(image_file)
+    except Exception:
+        return {}, 0, 0
+
+    exif_data = ctx.exif_data()
+    metrics.record(ctx.timings)
+    image_file.seek(0)
+    return exif_data, ctx.width, ctx.height
 
-        return ContentFile(thumb_io.getvalue(), name=thumb_name)
+def make_thumbnail(image_file, size=(300, 300)):
+    """
+    生成缩略图
+    :param image_file: 原始图片文件对象
+    :param size: 缩略图最大尺寸 (宽, 高)
+    :return: Django ContentFile 对象
+    """
+    try: 
+        # 只需要 size 大小的工作图，JPEG 可以用更大的 DCT 缩放比例解码
+        ctx = UploadImage(image_file, working_size=max(size))
+        thumb = ctx.thumbnail(size)
+        metrics.record(ctx.timings)
+        return thumb
     except Exception as e:
         print(f"缩略图生成失败: {e}")
-        return None
\ No newline at end of file
+        return None
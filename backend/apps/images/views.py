@@ -2,35 +2,104 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.views import APIView
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.exceptions import ValidationError
+from datetime import datetime, time, timedelta
+from django.db import transaction
 from django.db.models import Q
-from .models import Image, Tag, Category
-from .serializers import ImageSerializer, TagSerializer, CategorySerializer
+from django.http import Http404, HttpResponseRedirect
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Image, Tag, Category, ProcessingJob
+from .serializers import BulkUploadSerializer, ImageSerializer, TagSerializer, CategorySerializer
+from .pagination import KeysetPagination
+from .search import STOP_WORDS, search_images, reindex_images, rank_images
+from .embeddings import remove_image
+from . import inference
+from .geocoding import get_geocode_cache
+from .derivatives import FORMATS, check_signature, evict, get_derivative, ladder_formats, widths_for
+from .blobs import release
+from . import responsecache
+from .responsecache import CachedResponseMixin
+from . import facets
+from . import listing
+from .renderers import FastJSONRenderer
+from .duplicates import HASH_BITS, describe as describe_duplicates, duplicate_groups, get_index
 from .utils import get_exif_data, make_thumbnail
-from .ai_utils import classify_image
 from PIL import Image as PilImage 
-import jieba
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
-class TagViewSet(viewsets.ModelViewSet):
+    # 相册改名 / 删除后，同步更新相关图片的检索索引
+    def perform_update(self, serializer):
+        category = serializer.save()
+        reindex_images(category.image_set.order_by().values_list('id', flat=True))
+
+    def perform_destroy(self, instance):
+        image_ids = list(instance.image_set.order_by().values_list('id', flat=True))
+        category_id = instance.id
+        instance.delete()
+        facets.forget(facets.CATEGORY, category_id)
+        reindex_images(image_ids)
+
+class TagViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
-class ImageViewSet(viewsets.ModelViewSet):
+    # 标签改名 / 删除后，同步更新相关图片的检索索引
+    def perform_update(self, serializer):
+        tag = serializer.save()
+        reindex_images(tag.image_set.order_by().values_list('id', flat=True))
+
+    def perform_destroy(self, instance):
+        image_ids = list(instance.image_set.order_by().values_list('id', flat=True))
+        tag_id = instance.id
+        instance.delete()
+        facets.forget(facets.TAG, tag_id)
+        reindex_images(image_ids)
+
+def _date_param(request, name):
+    """查询参数中的日期 (date) 或时间 (datetime)，未提供时为 None，格式错误返回 400"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value) or parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: "格式应为 YYYY-MM-DD 或 ISO 8601 时间"})
+    return parsed
+
+
+def _as_datetime(value):
+    """日期取当天 0 点；没有时区的按 TIME_ZONE 处理"""
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time.min)
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+class ImageViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     serializer_class = ImageSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    # 列表 / 详情使用响应缓存 (见 responsecache.py)，这些写操作成功后使缓存失效
+    invalidating_actions = CachedResponseMixin.invalidating_actions + ('bulk_upload',)
+    # 游标分页，排序由 ?ordering= 决定 (见 KeysetPagination.ordering_fields)
+    pagination_class = KeysetPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
 
     def get_queryset(self):
         """
         实现多维检索逻辑
-        支持参数: ?q=关键词 & category=id & start_date=...
+        支持参数: ?q=关键词 & category=id & start_date=... & end_date=...
+        start_date / end_date 为拍摄时间范围，两端都包含，格式 YYYY-MM-DD 或 ISO 8601 时间
         支持 ?only_my=true 参数
         """
-        queryset = Image.objects.all().select_related('user', 'category').prefetch_related('tags')
+        queryset = Image.objects.all().select_related('user', 'category').prefetch_related('tags', 'derivatives')
         
         # 基础过滤：只能看公开的，或者是自己上传的
         user = self.request.user
@@ -48,30 +117,197 @@ class ImageViewSet(viewsets.ModelViewSet):
         # 搜索逻辑
         search_query = self.request.query_params.get('q', None)
         category_id = self.request.query_params.get('category', None)
-        start_date = self.request.query_params.get('start_date', None)
-        end_date = self.request.query_params.get('end_date', None)
+        start_date = _date_param(self.request, 'start_date')
+        end_date = _date_param(self.request, 'end_date')
 
         if category_id:
             queryset = queryset.filter(category_id=category_id)
         
         if start_date:
-            queryset = queryset.filter(shoot_time__gte=start_date)
+            queryset = queryset.filter(shoot_time__gte=_as_datetime(start_date))
+
+        if end_date:
+            if isinstance(end_date, datetime):
+                queryset = queryset.filter(shoot_time__lte=_as_datetime(end_date))
+            else:
+                # 只给日期时包含当天整天
+                queryset = queryset.filter(shoot_time__lt=_as_datetime(end_date + timedelta(days=1)))
 
         if search_query:
-            # SELECT * WHERE tag IN (...)
-            # 这里扩展为：匹配标签名 OR 匹配描述 OR 匹配地点
-            queryset = queryset.filter(
-                Q(tags__name__icontains=search_query) |
-                Q(location__icontains=search_query) |
-                Q(category__name__icontains=search_query) |
-                Q(camera_model__icontains=search_query)
-            ).distinct()
+            # 走倒排索引：匹配标签名 OR 相册 OR 地点 OR 相机型号，按相关度打分
+            queryset, _ = search_images(queryset, search_query)
+            return queryset.order_by('-search_score', '-upload_time')
 
         return queryset.order_by('-upload_time')
 
+    def list(self, request, *args, **kwargs):
+        """
+        瀑布流列表使用精简表示 (见 listing.py)，完整字段见详情接口
+        URL: GET /api/images/?cursor=...
+        """
+        return self._cached(self._list, request)
+
+    def _list(self, request):
+        queryset = listing.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(listing.represent(list(queryset), request))
+        return self.get_paginated_response(listing.represent(page, request))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # 上传 / 详情接口附带近似重复的已有图片
+        context['with_duplicates'] = self.action in ('create', 'retrieve')
+        return context
+
+    def _duplicate_distance(self):
+        """?distance= 汉明距离阈值，默认 IMAGE_DUPLICATE_DISTANCE"""
+        value = self.request.query_params.get('distance')
+        if value is None:
+            return None
+        try:
+            return min(max(int(value), 0), HASH_BITS // 4)
+        except ValueError:
+            return None
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        image_id = instance.id
+        before = facets.snapshot(instance)
+        evict(instance)
+        with transaction.atomic():
+            instance.delete()
+            facets.apply((before, None))
+        # 原图引用计数减一 (没有其他图片共用时删除文件)
+        release(instance.img_url.name)
+        # 同步从语义向量库、重复检测索引中移除
+        remove_image(image_id)
+        get_index().remove(image_id)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_upload(self, request):
+        """
+        批量上传：一次请求上传多个文件，共用标签 / 相册 / 公开设置
+        URL: POST /api/images/bulk/ (multipart，文件字段 img_url 可重复，其余字段同单张上传)
+        返回每个文件的结果；全部成功 201，部分失败 207，全部失败 400
+        """
+        serializer = BulkUploadSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save(user=request.user)
+
+        succeeded = sum(1 for r in results if r['ok'])
+        if succeeded == len(results):
+            code = status.HTTP_201_CREATED
+        elif succeeded:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response({"created": succeeded, "failed": len(results) - succeeded, "results": results}, status=code)
+
+    @action(detail=False, methods=['get'], url_path='facets')
+    def facet_counts(self, request):
+        """
+        当前用户可见图片的分面计数：总数、各相册 / 标签 / 相机型号 / 拍摄年份的图片数
+        URL: GET /api/images/facets/?only_my=true
+        """
+        return self._cached(self._facets, request)
+
+    def _facets(self, request):
+        only_my = request.query_params.get('only_my') == 'true'
+        return Response(facets.facet_counts(request.user, only_my=only_my))
+
+    @action(detail=False, methods=['get'], url_path='timeline')
+    def timeline(self, request):
+        """
+        当前用户可见图片的拍摄时间线：按年 / 月 / 日的图片数，新的在前，用于时间轴导航
+        URL: GET /api/images/timeline/?granularity=month&only_my=true&start_date=2024-01-01&end_date=2024-12-31
+        跳转到某一段时用列表接口的 ?start_date= & end_date= & ordering=-shoot_time
+        """
+        return self._cached(self._timeline, request)
+
+    def _timeline(self, request):
+        granularity = request.query_params.get('granularity', 'month')
+        if granularity not in facets.TIMELINE:
+            raise ValidationError({'granularity': f"可选值: {', '.join(facets.TIMELINE)}"})
+        # 时间线按日期分桶，带时间的参数只取日期部分
+        start, end = (_date_param(request, name) for name in ('start_date', 'end_date'))
+        return Response(facets.timeline(
+            request.user,
+            granularity,
+            only_my=request.query_params.get('only_my') == 'true',
+            start=start.date() if isinstance(start, datetime) else start,
+            end=end.date() if isinstance(end, datetime) else end,
+        ))
+
+    @action(detail=False, methods=['get'], url_path='duplicates',
+            permission_classes=[permissions.IsAuthenticated])
+    def duplicates(self, request):
+        """
+        当前用户的近似重复图片分组 (如同一张照片的 HEIC 与 JPEG、缩放后的副本)
+        URL: GET /api/images/duplicates/?distance=8
+        """
+        groups = duplicate_groups(request.user.id, self._duplicate_distance())
+        return Response({"count": len(groups), "groups": groups})
+
+    @action(detail=True, methods=['get'], url_path='duplicates',
+            permission_classes=[permissions.IsAuthenticated])
+    def image_duplicates(self, request, pk=None):
+        """
+        与某张图片近似重复的已有图片 (仅限自己的图片)
+        URL: GET /api/images/{id}/duplicates/?distance=8
+        """
+        image = self.get_object()
+        if image.user_id != request.user.id:
+            raise Http404
+        return Response({
+            "id": image.id,
+            "duplicates": describe_duplicates(image, request, self._duplicate_distance()),
+        })
+
+    @action(detail=True, methods=['get'], url_path='status')
+    def processing_status(self, request, pk=None):
+        """
+        查询上传后处理进度，前端可轮询直到 done / failed
+        URL: GET /api/images/{id}/status/
+        """
+        image = self.get_object()
+        job = ProcessingJob.objects.filter(image=image).order_by('-id').first()
+        data = {
+            "id": image.id,
+            "processing_status": image.processing_status,
+            "attempts": job.attempts if job else 0,
+            "error": job.error if job else "",
+            "thumb_url": request.build_absolute_uri(image.thumb_url.url) if image.thumb_url else None,
+        }
+        # 异步处理完成后才有哈希，此时把近似重复的已有图片告诉上传者
+        if image.processing_status == Image.STATUS_DONE and image.user_id == request.user.id:
+            data["duplicates"] = describe_duplicates(image, request)
+        return Response(data)
+
+    @action(detail=True, methods=['get'], url_path=r'derivatives/(?P<width>\d+)\.(?P<fmt>[a-z]+)',
+            permission_classes=[permissions.AllowAny], authentication_classes=[])
+    def derivative(self, request, pk=None, width=None, fmt=None):
+        """
+        按需生成派生图并重定向到 media 文件，之后由 Nginx 直接提供
+        URL: GET /api/images/{id}/derivatives/{width}.{fmt}?sig=...
+        签名由序列化器的 srcset 给出，只有能看到该图片的用户才能拿到
+        """
+        width = int(width)
+        if fmt not in FORMATS or not check_signature(pk, width, fmt, request.query_params.get('sig')):
+            raise Http404
+        image = Image.objects.filter(pk=pk, processing_status=Image.STATUS_DONE).first()
+        if image is None or width not in widths_for(image) or fmt not in ladder_formats():
+            raise Http404
+
+        try:
+            derivative = get_derivative(image, width, fmt)
+        except (OSError, ValueError) as e:
+            print(f"派生图生成失败: {e}")
+            raise Http404
+        return HttpResponseRedirect(derivative.file.url)
+
     @action(detail=False, methods=['post'], url_path='analyze')
     def analyze(self, request):
         """
@@ -84,11 +320,38 @@ class ImageViewSet(viewsets.ModelViewSet):
         
         if hasattr(img_file, 'seek'):
             img_file.seek(0)
-        # 调用本地 AI
-        tags = classify_image(img_file)
+        # 调用 AI (推理服务或本进程，并发请求都会被合并成一个批次推理)
+        tags = inference.classify_image(img_file)
         
         return Response({"suggested_tags": tags})
 
+    @action(detail=False, methods=['get'], url_path='analyze/stats',
+            permission_classes=[permissions.IsAdminUser])
+    def analyze_stats(self, request):
+        """
+        批处理调度器的队列深度、批大小等统计 (配置了推理服务时返回守护进程的统计)
+        URL: GET /api/images/analyze/stats/
+        """
+        return Response(inference.stats())
+
+    @action(detail=False, methods=['get'], url_path='geocode/stats',
+            permission_classes=[permissions.IsAdminUser])
+    def geocode_stats(self, request):
+        """
+        逆地理编码缓存命中率
+        URL: GET /api/images/geocode/stats/
+        """
+        return Response(get_geocode_cache().stats())
+
+    @action(detail=False, methods=['get'], url_path='cache/stats',
+            permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        """
+        列表 / 详情响应缓存的命中率 (本进程)
+        URL: GET /api/images/cache/stats/
+        """
+        return Response(responsecache.stats())
+
     def perform_update(self, serializer):        
         serializer.save()
 
@@ -105,21 +368,11 @@ class MCPView(APIView):
         if not query:
             return Response({"status": "error", "msg": "Query is empty"})
 
-        # 中文分词
-        # 定义“停用词”：这些词对搜索没有帮助，应该过滤掉
-        STOP_WORDS = {
-            "找", "一下", "帮我", "的", "照片", "图片", "图", "有没有", 
-            "搜索", "查看", "显示", "里", "关于", "啊", "呀", "呢"
-        }
-
-        # 使用 jieba 搜索引擎模式分词
-        # 例如："帮我找一下海边的照片" -> ['帮我', '找', '一下', '海边', '的', '照片']
-        seg_list = jieba.lcut_for_search(query)
-        
-        # 过滤掉停用词，只保留关键词
-        keywords = [word for word in seg_list if word not in STOP_WORDS and len(word.strip()) > 0]
-        
-        print(f"原始查询: {query}, 提取关键词: {keywords}") # 用于调试
+        # 使用 jieba 搜索引擎模式分词，并过滤掉停用词，只保留关键词
+        # 例如："帮我找一下海边的照片" -> ['海边']
+        # 只查当前用户可见的图片 (公开 OR 自己的)
+        base_qs = Image.objects.filter(Q(is_public=True) | Q(user=request.user))
+        ranked, keywords = rank_images(base_qs, query, STOP_WORDS, limit=10)
 
         # 如果分词后没东西了（用户只输入了“照片”），则不返回结果，防止返回全库
         if not keywords:
@@ -129,24 +382,9 @@ class MCPView(APIView):
                 "msg": "未提取到有效关键词"
             })
 
-        # 构建查询
-        q_obj = Q()
-        for k in keywords:
-            # 只要匹配到一个关键词即可 (OR 逻辑)
-            # 匹配 标签、分类、描述、地点、相机型号
-            q_obj |= Q(tags__name__icontains=k)
-            q_obj |= Q(category__name__icontains=k)
-            q_obj |= Q(location__icontains=k)
-            q_obj |= Q(camera_model__icontains=k)
-
-        # 只查当前用户可见的图片 (公开 OR 自己的)
-        base_qs = Image.objects.filter(Q(is_public=True) | Q(user=request.user))
-        
-        # 应用搜索条件
-        images = base_qs.filter(q_obj).distinct().order_by('-upload_time')[:10]
-
+        # 按 CLIP 语义相似度 (+ 关键词命中加分) 排序
         results = []
-        for img in images:
+        for img, score in ranked:
             tag_names = ",".join([t.name for t in img.tags.all()])
             desc = f"拍摄于:{img.shoot_time}, 标签:{tag_names}"
             
@@ -154,7 +392,7 @@ class MCPView(APIView):
                 "id": img.id,
                 "url": request.build_absolute_uri(img.img_url.url),
                 "description": desc,
-                "score": 1.0
+                "score": round(score, 4)
             })
 
         return Response({
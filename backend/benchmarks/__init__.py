@@ -0,0 +1,6 @@
+"""
+性能基准脚本，在 backend 目录下运行，例如:
+    python -m benchmarks.bench_classify path/to/images
+--json 写出的结果带有提交号，可以在不同提交之间对比；
+样本图片和数据库中的图片记录由 corpus.py 生成，同一 --seed 的内容相同
+"""
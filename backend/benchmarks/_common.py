@@ -0,0 +1,85 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+def setup_django(settings_module='config.settings', sqlite=False):
+    """
+    脚本方式运行时初始化 Django (backend 目录需在 sys.path 中)
+    :param sqlite: 改用 SQLite 数据库 (建临时测试库时在内存中)，结果不受本机 MySQL 配置影响
+    """
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    if sqlite:
+        from django.conf import settings
+        settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}
+
+    import django
+    django.setup()
+
+
+def measure(func, repeat=10, warmup=1):
+    """多次运行 func，返回耗时统计 (毫秒)"""
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    return {
+        'repeat': repeat,
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'min_ms': round(samples[0], 3),
+    }
+
+
+def _commit():
+    """当前 git 提交 (工作区有改动时加 -dirty)，不在 git 仓库中时为 None"""
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return sha + ('-dirty' if dirty else '')
+
+
+def report(name, results, output=None):
+    """打印结果；指定 output 时同时写出 JSON (附带提交、Python 版本和时间)，便于不同提交之间对比"""
+    payload = {
+        'benchmark': name,
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': results,
+    }
+    for case, stats in results.items():
+        print(f"{name:<20} {case:<32} " + "  ".join(f"{k}={v}" for k, v in stats.items()))
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+    return payload
+
+
+def image_paths(paths, exts=('.jpg', '.jpeg', '.png', '.heic', '.heif', '.webp')):
+    """展开目录，返回其中的图片文件路径"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                found.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(exts))
+        elif path.lower().endswith(exts):
+            found.append(path)
+    return found
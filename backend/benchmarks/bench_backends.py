@@ -0,0 +1,114 @@
+"""
+CLIP 推理后端的精度 / 延迟对比 (ai_utils.load_clip):
+  torch       fp32 (基准)
+  torch-int8  torch 动态量化
+  onnx        onnxruntime
+  onnx-int8   onnxruntime + int8 动态量化
+
+在一组固定的本地图片上，分别用各后端给出标签和图像向量，与 fp32 的结果比较:
+  tags_match    标签列表与 fp32 完全一致的图片比例
+  top1_match    第一个标签一致的比例
+  cosine_mean / cosine_min  图像向量与 fp32 向量的余弦相似度 (决定已有向量库能否继续使用)
+以及单张 (batch=1) 和批量 (--batch) 的每张耗时。对比时强制使用 CPU。
+
+    python -m benchmarks.bench_backends path/to/images --repeat 5 --json out.json
+    python -m benchmarks.bench_backends path/to/images --backends torch torch-int8
+"""
+import argparse
+import gc
+import time
+
+from ._common import image_paths, measure, report, setup_django
+
+
+def run_backend(ai, backend, images, batch, repeat):
+    import numpy as np
+    import torch
+
+    start = time.perf_counter()
+    # 基准始终是 fp32，且在 CPU 上运行，才能与量化 / ONNX 后端公平比较
+    model, processor, _ = ai.load_clip(backend, device='cpu')
+    load_ms = (time.perf_counter() - start) * 1000
+
+    with torch.no_grad():
+        inputs = processor(text=ai.english_labels, return_tensors="pt", padding=True)
+        labels = ai._as_features(model.get_text_features(**inputs))
+        labels = labels / labels.norm(dim=-1, keepdim=True)
+
+        def infer(pixel_values):
+            features = ai._as_features(model.get_image_features(pixel_values=pixel_values))
+            features = features / features.norm(dim=-1, keepdim=True)
+            probs = (model.logit_scale.exp() * features @ labels.t()).softmax(dim=1)
+            return features, [ai._tags_from_probs(row) or ["其他"] for row in probs]
+
+        # 预处理不计入推理耗时，各后端相同
+        pixels = [processor(images=img, return_tensors="pt")['pixel_values'] for img in images]
+        batches = [torch.cat(pixels[i:i + batch]) for i in range(0, len(pixels), batch)]
+
+        features, tags = [], []
+        for pixel_values in batches:
+            f, t = infer(pixel_values)
+            features.append(f.float().numpy())
+            tags.extend(t)
+
+        single = measure(lambda: [infer(p) for p in pixels], repeat=repeat)
+        batched = measure(lambda: [infer(b) for b in batches], repeat=repeat)
+
+    del model
+    gc.collect()
+    return {
+        'load_ms': round(load_ms, 1),
+        'per_image_ms': round(single['median_ms'] / len(images), 3),
+        f'per_image_ms_batch{batch}': round(batched['median_ms'] / len(images), 3),
+    }, np.concatenate(features), tags
+
+
+def main():
+    from apps.images.ai_utils import BACKENDS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help="图片文件或目录")
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    import numpy as np
+    import torch
+    from PIL import Image as PilImage
+    from apps.images import ai_utils as ai
+
+    images = [PilImage.open(p).convert('RGB') for p in image_paths(args.paths)]
+    if not images:
+        parser.error("没有找到图片")
+
+    backends = ['torch'] + [b for b in args.backends if b != 'torch']
+
+    results = {}
+    reference = None
+    for backend in backends:
+        stats, features, tags = run_backend(ai, backend, images, args.batch, args.repeat)
+        if reference is None:
+            reference = (features, tags)
+        ref_features, ref_tags = reference
+
+        cosine = (features * ref_features).sum(axis=1)
+        stats.update({
+            'images': len(images),
+            'tags_match': round(sum(a == b for a, b in zip(tags, ref_tags)) / len(images), 4),
+            'top1_match': round(sum(a[:1] == b[:1] for a, b in zip(tags, ref_tags)) / len(images), 4),
+            'cosine_mean': round(float(np.mean(cosine)), 5),
+            'cosine_min': round(float(np.min(cosine)), 5),
+        })
+        base = results.get('torch')
+        if base:
+            stats['speedup'] = round(base['per_image_ms'] / stats['per_image_ms'], 2)
+        results[backend] = stats
+
+    report('clip_backends', results, args.output)
+
+
+if __name__ == '__main__':
+    setup_django()
+    main()
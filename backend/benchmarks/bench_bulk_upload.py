@@ -0,0 +1,113 @@
+"""
+批量上传的 CPU 密集部分 (processing.prepare：HEIC 转换、EXIF、缩略图、工作图) 吞吐量随进程数的变化:
+  serial  : 在当前进程内逐张处理 (IMAGE_PROCESS_POOL_SIZE=0 时的行为)
+  pool:N  : parallel.py 的 spawn 进程池，N 个子进程
+
+报告每秒处理的图片数和相对 serial 的加速比；加速比上限为 CPU 核数。
+不指定图片时自动生成 --count 张 12MP 的 JPEG / HEIC 样本 (各占一半):
+    python -m benchmarks.bench_bulk_upload --count 200 --processes 1 2 4 8 --json out.json
+    python -m benchmarks.bench_bulk_upload path/to/album
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ._common import image_paths, report, setup_django
+
+
+def make_samples(directory, count, size=(4000, 3000)):
+    import pillow_heif
+    from PIL import Image as PilImage
+
+    pillow_heif.register_heif_opener()
+    gradient = PilImage.linear_gradient('L').resize(size)
+    img = PilImage.merge('RGB', (gradient, gradient.rotate(90), gradient.transpose(PilImage.Transpose.FLIP_LEFT_RIGHT)))
+    exif = PilImage.Exif()
+    exif[0x0110] = 'Benchmark Camera'
+
+    # 同一份内容写成不同文件名即可，prepare 每次都会重新解码
+    sources = {}
+    for ext, kwargs in (('jpg', {'quality': 92}), ('heic', {'quality': 80})):
+        path = os.path.join(directory, f'source.{ext}')
+        img.save(path, exif=exif.tobytes(), **kwargs)
+        sources[ext] = path
+
+    paths = []
+    for i in range(count):
+        ext = 'jpg' if i % 2 == 0 else 'heic'
+        path = os.path.join(directory, f'photo_{i:04d}.{ext}')
+        os.link(sources[ext], path)
+        paths.append(path)
+    return paths
+
+
+def _cleanup(results):
+    for prepared in results:
+        if prepared['jpeg_path']:
+            os.remove(prepared['jpeg_path'])
+
+
+def run_serial(paths):
+    from apps.images.parallel import _prepare_path
+
+    start = time.perf_counter()
+    results = [_prepare_path(p) for p in paths]
+    elapsed = time.perf_counter() - start
+    _cleanup(results)
+    return elapsed
+
+
+def run_pool(paths, processes):
+    from apps.images.parallel import _init_worker, _prepare_path
+
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker) as pool:
+        # 先让所有子进程完成启动 (django.setup)，启动开销不计入
+        for f in [pool.submit(os.getpid) for _ in range(processes * 2)]:
+            f.result()
+
+        start = time.perf_counter()
+        results = list(pool.map(_prepare_path, paths))
+        elapsed = time.perf_counter() - start
+    _cleanup(results)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', help="图片文件或目录 (不指定时自动生成)")
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    setup_django()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = image_paths(args.paths) if args.paths else make_samples(tmp, args.count)
+        if not paths:
+            parser.error("没有找到图片")
+
+        serial = run_serial(paths)
+        results = {'serial': {
+            'images': len(paths),
+            'seconds': round(serial, 2),
+            'images_per_s': round(len(paths) / serial, 1),
+            'cpu_count': os.cpu_count(),
+        }}
+        for n in sorted(set(args.processes)):
+            elapsed = run_pool(paths, n)
+            results[f'pool:{n}'] = {
+                'images': len(paths),
+                'seconds': round(elapsed, 2),
+                'images_per_s': round(len(paths) / elapsed, 1),
+                'speedup': round(serial / elapsed, 2),
+            }
+
+    report('bulk_upload_prepare', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
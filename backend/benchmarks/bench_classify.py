@@ -0,0 +1,57 @@
+"""
+classify_image 新旧实现对比:
+  full   : 旧实现，每次把 17 个候选标签和图片一起送进 CLIPModel 完整前向
+  cached : 当前的 ai_utils.classify_image (文本向量缓存，只跑 get_image_features + 一次矩阵乘法)
+
+    python -m benchmarks.bench_classify path/to/images --repeat 20 --json out.json
+"""
+import argparse
+
+from ._common import image_paths, measure, report, setup_django
+
+
+def classify_full(ai, img):
+    """旧版 classify_image 的推理部分 (保留用于对比)"""
+    import torch
+
+    model, processor, device = ai.get_clip()
+    inputs = processor(text=ai.english_labels, images=img, return_tensors="pt", padding=True)
+    inputs = {k: v.to(device) for k, v in inputs.items()}
+    with torch.no_grad():
+        outputs = model(**inputs)
+    return ai._tags_from_probs(outputs.logits_per_image.softmax(dim=1)[0]) or ["其他"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='+', help="图片文件或目录")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    setup_django()
+    from PIL import Image as PilImage
+    from apps.images import ai_utils as ai
+
+    images = [PilImage.open(p).convert('RGB') for p in image_paths(args.paths)]
+    if not images:
+        parser.error("没有找到图片")
+
+    # 两种实现给出的标签应当一致
+    mismatched = sum(classify_full(ai, img) != ai.classify_image(img) for img in images)
+
+    results = {
+        'full': measure(lambda: [classify_full(ai, img) for img in images], repeat=args.repeat),
+        'cached': measure(lambda: [ai.classify_image(img) for img in images], repeat=args.repeat),
+    }
+    for stats in results.values():
+        stats['images'] = len(images)
+        stats['per_image_ms'] = round(stats['mean_ms'] / len(images), 3)
+    results['cached']['speedup'] = round(results['full']['mean_ms'] / results['cached']['mean_ms'], 2)
+    results['cached']['tag_mismatches'] = mismatched
+
+    report('classify_image', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
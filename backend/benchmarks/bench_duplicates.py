@@ -0,0 +1,103 @@
+"""
+近似重复查询 "汉明距离 <= k" 的耗时:
+  linear : 与该用户全部哈希逐个比较
+  index  : duplicates.MultiIndex (4 段 16 位的多索引哈希)
+
+随机生成 --images 个 64 位哈希 (另外混入 --dups 组、每组 3 个相差 1~4 位的近似重复)，
+对 --queries 个哈希在不同 k 下查询，报告每次查询的耗时、需要核对完整距离的候选比例，并核对两者结果一致:
+    python -m benchmarks.bench_duplicates --images 100000 --k 4 8 12 --json out.json
+"""
+import argparse
+import random
+import sys
+import time
+
+from ._common import report
+
+
+def make_hashes(count, dups, rng):
+    hashes = [rng.getrandbits(64) for _ in range(count)]
+    for _ in range(dups):
+        base = rng.getrandbits(64)
+        hashes.append(base)
+        for _ in range(2):
+            value = base
+            for bit in rng.sample(range(64), rng.randint(1, 4)):
+                value ^= 1 << bit
+            hashes.append(value)
+    return hashes
+
+
+def linear(hashes, value, k):
+    return sorted(((i, (h ^ value).bit_count()) for i, h in enumerate(hashes) if (h ^ value).bit_count() <= k), key=lambda x: x[1])
+
+
+def candidates(index, value, k):
+    """与 MultiIndex.search 相同的探查，只统计候选哈希数"""
+    from apps.images.duplicates import _flip_masks
+
+    masks = _flip_masks(index.BLOCK_BITS, min(k // index.BLOCKS, index.BLOCK_BITS))
+    found = set()
+    for table, block in zip(index.tables, index._blocks(value)):
+        for mask in masks:
+            found.update(table.get(block ^ mask, ()))
+    return len(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=100000, help="单个用户的图片数")
+    parser.add_argument('--dups', type=int, default=1000, help="近似重复组数")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, nargs='+', default=[4, 8, 12])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    # 只用到纯 Python 部分，不需要 django.setup()
+    from apps.images.duplicates import MultiIndex
+
+    rng = random.Random(args.seed)
+    hashes = make_hashes(args.images, args.dups, rng)
+
+    start = time.perf_counter()
+    index = MultiIndex()
+    for i, h in enumerate(hashes):
+        index.add(h, i)
+    build = time.perf_counter() - start
+
+    # 一半查询取自近似重复组，保证有命中
+    queries = [rng.choice(hashes[args.images:]) if i % 2 else rng.choice(hashes[:args.images]) for i in range(args.queries)]
+
+    results = {}
+    mismatched = []
+    for k in args.k:
+        start = time.perf_counter()
+        expected = [linear(hashes, q, k) for q in queries]
+        linear_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = [index.search(q, k) for q in queries]
+        index_s = time.perf_counter() - start
+
+        if any(sorted(a) != sorted(b) for a, b in zip(expected, found)):
+            mismatched.append(k)
+        checked = sum(candidates(index, q, k) for q in queries) / len(queries)
+        results[f'k={k}'] = {
+            'hashes': len(hashes),
+            'linear_ms': round(linear_s * 1000 / len(queries), 3),
+            'index_ms': round(index_s * 1000 / len(queries), 3),
+            'speedup': round(linear_s / index_s, 1),
+            'candidates_pct': round(checked * 100 / len(hashes), 2),
+            'matches_per_query': round(sum(map(len, found)) / len(queries), 2),
+            'build_s': round(build, 2),
+        }
+
+    report('duplicates', results, args.output)
+    if mismatched:
+        print(f"索引与线性扫描结果不一致: k={mismatched}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
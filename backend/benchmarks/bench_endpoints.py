@@ -0,0 +1,98 @@
+"""
+浏览相关接口在不同数据量下的耗时与 SQL 条数 (SQLite 内存库，不受本机 MySQL 配置影响):
+  list:anonymous  未登录的首页 (只看公开图片)
+  list:visible    登录用户的首页 (公开 OR 自己的)
+  list:next_page  按游标翻到第 2 页
+  search          ?q= 关键词检索 (倒排索引)
+  detail          单张详情
+  mcp             /api/mcp/search/ (没有 CLIP 模型时退回纯关键词排序；未安装 torch 且未配置推理守护进程时跳过)
+
+每个 --rows 清空后由 corpus.seed_database 重新生成图片记录，不使用响应缓存:
+    python -m benchmarks.bench_endpoints --rows 1000 10000 100000 --repeat 20 --json out.json
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from ._common import measure, report, setup_django
+from .corpus import seed_database
+
+
+def run(client, url, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    # 视图中的调试输出不计入结果
+    with contextlib.redirect_stdout(io.StringIO()):
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+        queries = len(ctx.captured_queries)
+        stats = measure(lambda: client.get(url), repeat=repeat)
+    stats['queries'] = queries
+    return stats
+
+
+def bench_rows(rows, repeat):
+    from rest_framework.test import APIClient
+
+    start = time.perf_counter()
+    samples = seed_database(rows)
+    results = {f'{rows}:seed': {'seconds': round(time.perf_counter() - start, 1)}}
+
+    anon = APIClient()
+    owner = APIClient()
+    owner.force_authenticate(samples['user'])
+    tag = samples['tag'].name
+    next_page = owner.get('/api/images/').json()['next']
+
+    cases = (
+        ('list:anonymous', anon, '/api/images/'),
+        ('list:visible', owner, '/api/images/'),
+        ('list:next_page', owner, next_page),
+        ('search', owner, f'/api/images/?q={tag}'),
+        ('detail', anon, f"/api/images/{samples['public_image'].id}/"),
+        ('mcp', owner, f'/api/mcp/search/?q={tag}'),
+    )
+    for name, client, url in cases:
+        try:
+            results[f'{rows}:{name}'] = run(client, url, repeat)
+        except ImportError as e:
+            results[f'{rows}:{name}'] = {'skipped': str(e)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    setup_django(sqlite=True)
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connection
+
+    settings.ALLOWED_HOSTS = ['*']
+    settings.IMAGE_RESPONSE_CACHE_TIMEOUT = 0
+    # 检索词是英文，不需要翻译
+    settings.CLIP_TRANSLATE_QUERY = False
+
+    results = {}
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        for rows in args.rows:
+            # 内存库在连接关闭前一直存在，各数据量之间清空重建
+            call_command('flush', interactive=False, verbosity=0)
+            results.update(bench_rows(rows, args.repeat))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report('endpoints', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
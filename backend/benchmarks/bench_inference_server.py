@@ -0,0 +1,126 @@
+"""
+推理守护进程与进程内推理的内存 / 延迟对比，模拟 N 个 gunicorn 工作进程同时调用 classify_image:
+  server : 各工作进程经 Unix socket + 共享内存调用 clip_server，整机一份模型
+  local  : 各工作进程自己加载模型 (旧行为，需要 torch)
+
+报告所有进程 RSS 之和随工作进程数的变化，以及单次调用延迟。
+--dummy 使用不依赖 torch 的替身模型，只能验证协议开销和客户端内存，不能用于 local 对比。
+    python -m benchmarks.bench_inference_server --workers 1 2 4 8 --requests 20 --json out.json
+    python -m benchmarks.bench_inference_server --dummy
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from ._common import report
+
+
+def _rss_mb(pid='self', field='VmRSS'):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def client(requests):
+    """子进程入口：模拟一个工作进程，连续调用 classify_image"""
+    from PIL import Image as PilImage
+    from ._common import setup_django
+
+    setup_django()
+    from apps.images import inference
+
+    img = PilImage.linear_gradient('L').resize((1600, 1200)).convert('RGB')
+    latencies = []
+    for i in range(requests):
+        frame = img.rotate(i)
+        start = time.perf_counter()
+        tags = inference.classify_image(frame)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    print(json.dumps({
+        'rss_mb': _rss_mb(field='VmHWM'),
+        'latencies': latencies[1:] or latencies,  # 第一次调用包含连接 / 模型加载
+        'tagged': bool(tags),
+    }))
+
+
+def run_clients(count, requests, env, backend_dir):
+    procs = [
+        subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.bench_inference_server', '--client', str(requests)],
+            cwd=backend_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        for _ in range(count)
+    ]
+    return [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in procs]
+
+
+def summarize(runs, extra_rss=0.0):
+    latencies = sorted(x for r in runs for x in r['latencies'])
+    return {
+        'workers': len(runs),
+        'total_rss_mb': round(sum(r['rss_mb'] for r in runs) + extra_rss, 1),
+        'worker_rss_mb': round(statistics.fmean(r['rss_mb'] for r in runs), 1),
+        'median_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+        'all_tagged': all(r['tagged'] for r in runs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--requests', type=int, default=20, help="每个工作进程的调用次数")
+    parser.add_argument('--dummy', action='store_true')
+    parser.add_argument('--json', dest='output')
+    parser.add_argument('--client', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client:
+        client(args.client)
+        return
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sock = os.path.join(tmp, 'clip.sock')
+        command = [sys.executable, 'manage.py', 'clip_server', '--socket', sock]
+        if args.dummy:
+            command.append('--dummy')
+        server = subprocess.Popen(command, cwd=backend_dir, stdout=subprocess.DEVNULL)
+        try:
+            # 等待模型加载完成、socket 出现
+            for _ in range(600):
+                if os.path.exists(sock) or server.poll() is not None:
+                    break
+                time.sleep(0.1)
+            if not os.path.exists(sock):
+                sys.exit("clip_server 启动失败")
+
+            env = dict(os.environ, CLIP_INFERENCE_SOCKET=sock)
+            for count in args.workers:
+                runs = run_clients(count, args.requests, env, backend_dir)
+                server_rss = _rss_mb(server.pid)
+                results[f'server:{count}'] = dict(summarize(runs, server_rss), server_rss_mb=round(server_rss, 1))
+        finally:
+            server.terminate()
+            server.wait()
+
+    if not args.dummy:
+        env = dict(os.environ, CLIP_INFERENCE_SOCKET='')
+        for count in args.workers:
+            results[f'local:{count}'] = summarize(run_clients(count, args.requests, env, backend_dir))
+
+    report('inference_server', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+反复加载图片列表 / 详情 (瀑布流刷新) 的耗时与 SQL 条数:
+  uncached     : 不使用响应缓存 (IMAGE_RESPONSE_CACHE_TIMEOUT=0)，每次都查询并序列化
+  hit          : 命中响应缓存，直接返回缓存的响应体
+  not_modified : 带 If-None-Match，返回 304
+
+在临时测试库中生成 --images 张图片 (只写数据库，不需要图片文件)，以图片所有者身份请求:
+    python -m benchmarks.bench_list_cache --images 500 --repeat 50 --json out.json
+"""
+import argparse
+
+from ._common import measure, report, setup_django
+
+
+def make_images(count):
+    from apps.images.models import Category, Image, Tag
+    from apps.users.models import User
+
+    user = User.objects.create(username='bench_cache', email='cache@bench.local')
+    category = Category.objects.create(name='bench_cache')
+    tags = [Tag.objects.create(name=f'bench_cache_{i}') for i in range(5)]
+    images = Image.objects.bulk_create([
+        Image(
+            user=user, category=category, img_url=f'originals/bench/{i}.jpg', thumb_url=f'thumbs/bench/{i}_thumb.jpg',
+            width=4000, height=3000, file_size=2048, camera_model='Benchmark Camera', processing_status=Image.STATUS_DONE,
+        )
+        for i in range(count)
+    ])
+    Through = Image.tags.through
+    Through.objects.bulk_create([Through(image_id=image.id, tag_id=tag.id) for image in images for tag in tags[:3]])
+    return user, images[0].id
+
+
+def run(client, url, repeat, headers=None):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    headers = headers or {}
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(url, **headers)
+    assert response.status_code in (200, 304), response.status_code
+    # 每个请求开始时会清空查询日志，先取条数
+    queries = len(ctx.captured_queries)
+    stats = measure(lambda: client.get(url, **headers), repeat=repeat)
+    stats['queries'] = queries
+    stats['status'] = response.status_code
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.db import connection
+    from rest_framework.test import APIClient
+
+    from apps.images import responsecache
+
+    # ALLOWED_HOSTS 可能不含测试客户端使用的 testserver
+    settings.ALLOWED_HOSTS = ['*']
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        user, image_id = make_images(args.images)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        results = {}
+        for name, url in (('list', '/api/images/'), ('detail', f'/api/images/{image_id}/')):
+            settings.IMAGE_RESPONSE_CACHE_TIMEOUT = 0
+            results[f'{name}:uncached'] = run(client, url, args.repeat)
+
+            settings.IMAGE_RESPONSE_CACHE_TIMEOUT = 300
+            responsecache.bump()
+            etag = client.get(url)['ETag']
+            results[f'{name}:hit'] = run(client, url, args.repeat)
+            results[f'{name}:not_modified'] = run(client, url, args.repeat, {'HTTP_IF_NONE_MATCH': etag})
+
+            base = results[f'{name}:uncached']['median_ms']
+            for case in ('hit', 'not_modified'):
+                results[f'{name}:{case}']['speedup'] = round(base / results[f'{name}:{case}']['median_ms'], 1)
+        results['stats'] = {k: v for k, v in responsecache.stats().items() if k != 'generation'}
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report('list_cache', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+列表接口每 1000 行的序列化耗时，改造前后对比 (SQLite 内存库):
+  before : 模型实例 (select_related + prefetch 标签 / 派生图) -> ImageSerializer -> DRF JSONRenderer
+  after  : .values() 行 + 一次查询聚合标签 (listing.py) -> FastJSONRenderer (orjson)
+每种方式分别计 total (查询 + 序列化 + 渲染)、serialize (数据已取出，只转换为字典) 和 render (只编码 JSON)，
+另给出输出大小。未安装 orjson 时 after 的渲染退回 DRF JSONRenderer:
+    python -m benchmarks.bench_list_serialization --rows 1000 --repeat 20 --json out.json
+"""
+import argparse
+
+from ._common import measure, report, setup_django
+from .corpus import seed_database
+
+
+def _request():
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    return Request(APIRequestFactory().get('/api/images/'))
+
+
+def before(rows, request):
+    from rest_framework.renderers import JSONRenderer
+
+    from apps.images.models import Image
+    from apps.images.serializers import ImageSerializer
+
+    def fetch():
+        queryset = Image.objects.select_related('user', 'category').prefetch_related('tags', 'derivatives')
+        return list(queryset.order_by('-upload_time', '-id')[:rows])
+
+    def serialize(images):
+        return ImageSerializer(images, many=True, context={'request': request}).data
+
+    return fetch, serialize, JSONRenderer()
+
+
+def after(rows, request):
+    from apps.images import listing
+    from apps.images.models import Image
+    from apps.images.renderers import FastJSONRenderer
+
+    def fetch():
+        return list(listing.values(Image.objects.order_by('-upload_time', '-id'))[:rows])
+
+    def serialize(values):
+        return listing.represent(values, request)
+
+    return fetch, serialize, FastJSONRenderer()
+
+
+def bench(name, factory, rows, repeat):
+    request = _request()
+    fetch, serialize, renderer = factory(rows, request)
+    fetched = fetch()
+    data = serialize(fetched)
+    # 1000 行之外的数据量按比例换算，便于不同 --rows 之间比较
+    scale = 1000 / rows
+    results = {}
+    for stage, func in (
+        ('total', lambda: renderer.render(serialize(fetch()))),
+        ('serialize', lambda: serialize(fetched)),
+        ('render', lambda: renderer.render(data)),
+    ):
+        stats = measure(func, repeat=repeat)
+        results[f'{name}:{stage}'] = {'per_1000_ms': round(stats['median_ms'] * scale, 3), **stats}
+    results[f'{name}:total']['bytes'] = len(renderer.render(data))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    setup_django(sqlite=True)
+    from django.conf import settings
+    from django.db import connection
+
+    settings.ALLOWED_HOSTS = ['*']
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        seed_database(args.rows)
+        results = {}
+        results.update(bench('before', before, args.rows, args.repeat))
+        results.update(bench('after', after, args.rows, args.repeat))
+        results['speedup'] = {
+            stage: round(results[f'before:{stage}']['median_ms'] / results[f'after:{stage}']['median_ms'], 1)
+            for stage in ('total', 'serialize', 'render')
+        }
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report('list_serialization', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+上传处理各函数的单次耗时，每个 (函数, 样本) 一项:
+  handle_heic_image : HEIC 转 JPEG (只对 HEIC 样本)
+  get_exif_data     : 宽高 + EXIF 解析 (逆地理编码使用离线替身，不访问网络)
+  make_thumbnail    : 300px 缩略图
+  classify_image    : CLIP 自动标签 (未安装 torch 时跳过)
+
+样本默认取 corpus 生成的 12MP JPEG / PNG / HEIC 和 48MP 全景图，不存在时先生成到 --corpus 目录:
+    python -m benchmarks.bench_micro --corpus /tmp/corpus --repeat 5 --json out.json
+    python -m benchmarks.bench_micro path/to/photos
+"""
+import argparse
+import os
+import tempfile
+
+from ._common import image_paths, measure, report, setup_django
+from .corpus import generate
+
+
+def offline_geocoder(lat, lon):
+    """替代 Nominatim，只测本地的缓存与解析开销"""
+    return "基准测试地址"
+
+
+def _open(path):
+    from django.core.files import File
+    return File(open(path, 'rb'), name=os.path.basename(path))
+
+
+def _call(func, path):
+    f = _open(path)
+    try:
+        result = func(f)
+        # handle_heic_image 返回的临时 JPEG 文件
+        if result is not f and hasattr(result, 'close'):
+            result.close()
+    finally:
+        f.close()
+
+
+def functions():
+    from apps.images.utils import get_exif_data, handle_heic_image, make_thumbnail
+
+    funcs = {
+        'handle_heic_image': (handle_heic_image, ('.heic', '.heif')),
+        'get_exif_data': (get_exif_data, None),
+        'make_thumbnail': (make_thumbnail, None),
+    }
+    try:
+        from apps.images.ai_utils import classify_image
+    except ImportError as e:
+        print(f"跳过 classify_image: {e}")
+    else:
+        funcs['classify_image'] = (classify_image, None)
+    return funcs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', help="图片文件或目录，不指定时使用 --corpus")
+    parser.add_argument('--corpus', help="corpus 目录，不存在时生成 (默认生成到临时目录)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    paths = image_paths(args.paths)
+    if not paths:
+        directory = args.corpus or tempfile.mkdtemp(prefix='corpus_')
+        if not os.path.exists(os.path.join(directory, 'manifest.json')):
+            print(f"生成样本到 {directory} ...")
+            generate(directory, count=3, panoramas=2)
+        paths = image_paths([directory])
+
+    # get_exif_data 的逆地理编码会查询 / 写入缓存表，在 SQLite 内存库中运行
+    setup_django(sqlite=True)
+    from django.conf import settings
+    from django.db import connection
+
+    settings.GEOCODER = 'benchmarks.bench_micro.offline_geocoder'
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        results = {}
+        for name, (func, exts) in functions().items():
+            for path in paths:
+                if exts and not path.lower().endswith(exts):
+                    continue
+                stats = measure(lambda: _call(func, path), repeat=args.repeat)
+                stats['mb'] = round(os.path.getsize(path) / 1024 / 1024, 2)
+                results[f'{name}:{os.path.basename(path)}'] = stats
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report('micro', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+各接口 SQL 的执行计划回归检查:
+在临时测试库中生成 --images 张图片 (corpus.seed_database，只写数据库)，
+以不同身份请求列表、翻页、筛选、检索、分面等接口，对其中的 SELECT 逐条 EXPLAIN，
+出现全表扫描、filesort、临时表 (判断规则见 apps/images/queryplans.py) 即视为退化，以状态码 1 退出。
+检索按相关度排序，本身需要分组和排序，只检查全表扫描。
+
+apps/images/tests.py 的 QueryPlanTests 以较少的图片运行同样的检查 (python manage.py test)。
+使用 settings 中的数据库 (MySQL 与 SQLite 均可)，建表时会执行迁移:
+    python -m benchmarks.bench_query_plans --images 20000 --verbose --json out.json
+"""
+import argparse
+import sys
+
+from ._common import report, setup_django
+from .corpus import seed_database
+
+
+def cases(samples):
+    """
+    要检查的接口请求：[(名称, 客户端, 方法, 地址, 请求体, 不检查的项目)]
+    :param samples: seed_database() 的返回值
+    """
+    from rest_framework.test import APIClient
+
+    user, album, tag, public_image = (samples[k] for k in ('user', 'category', 'tag', 'public_image'))
+    anon = APIClient()
+    owner = APIClient()
+    owner.force_authenticate(user)
+    first_page = owner.get('/api/images/').json()
+
+    return [
+        ('list:anonymous', anon, 'get', '/api/images/', None, ()),
+        ('list:visible', owner, 'get', '/api/images/', None, ()),
+        ('list:next_page', owner, 'get', first_page['next'], None, ()),
+        ('list:only_my', owner, 'get', '/api/images/?only_my=true', None, ()),
+        ('list:category', owner, 'get', f'/api/images/?category={album.id}', None, ()),
+        ('list:shoot_time', owner, 'get', '/api/images/?ordering=-shoot_time', None, ()),
+        ('list:date_range', anon, 'get',
+         '/api/images/?ordering=-shoot_time&start_date=2020-03-01&end_date=2020-03-31', None, ()),
+        ('detail', anon, 'get', f'/api/images/{public_image.id}/', None, ()),
+        ('search', owner, 'get', f'/api/images/?q={tag.name}', None, ('filesort', 'temporary')),
+        ('facets', owner, 'get', '/api/images/facets/', None, ()),
+        ('timeline', owner, 'get', '/api/images/timeline/?granularity=day', None, ()),
+        ('tag_rename', owner, 'patch', f'/api/tags/{tag.id}/', {'name': f'{tag.name}_renamed'}, ()),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=20000)
+    parser.add_argument('--verbose', action='store_true', help="打印每条 SQL 的执行计划")
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.db import connection
+    from apps.images.queryplans import analyze, check
+
+    settings.ALLOWED_HOSTS = ['*']
+    # 只检查查询本身，不走响应缓存
+    settings.IMAGE_RESPONSE_CACHE_TIMEOUT = 0
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        samples = seed_database(args.images)
+        analyze()
+
+        results = {}
+        failed = False
+        for name, *case in cases(samples):
+            selects, found = check(name, *case, verbose=args.verbose)
+            failed |= bool(found)
+            results[name] = {
+                'selects': selects,
+                'status': 'ok' if not found else 'REGRESSED',
+                'problems': ",".join(sorted(found)) or '-',
+            }
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report('query_plans', results, args.output)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+进程启动开销对比 (migrate / collectstatic / gunicorn 工作进程都会经历同样的导入):
+  views      : django.setup() + 导入 URL 配置与 apps.images.views (当前实现，不导入 torch)
+  eager_clip : 在此基础上立即导入 ai_utils 并加载 CLIP，相当于旧实现在导入 views 时的开销
+
+每个场景在全新的子进程中运行 --repeat 次，报告耗时、峰值 RSS 和是否导入了 torch。
+    python -m benchmarks.bench_startup --repeat 5 --json out.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from ._common import report
+
+CASES = {
+    'views': "import apps.images.views, config.urls",
+    'eager_clip': "import apps.images.views, config.urls; from apps.images import ai_utils; ai_utils.get_clip()",
+}
+
+
+def child(case):
+    """子进程入口：执行场景代码，输出一行 JSON"""
+    start = time.perf_counter()
+    from ._common import setup_django
+
+    setup_django()
+    error = None
+    try:
+        exec(CASES[case], {})
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    elapsed = (time.perf_counter() - start) * 1000
+
+    import resource
+    print(json.dumps({
+        'ms': elapsed,
+        # Linux 上 ru_maxrss 单位为 KB
+        'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'torch_imported': 'torch' in sys.modules,
+        'error': error,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='output')
+    parser.add_argument('--child', choices=CASES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for case in CASES:
+        runs = []
+        for _ in range(args.repeat):
+            # 子进程由这个很小的父进程启动，ru_maxrss 不会继承到大的峰值
+            out = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_startup', '--child', case],
+                cwd=backend_dir, capture_output=True, text=True, check=True,
+            )
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+        samples = sorted(r['ms'] for r in runs)
+        results[case] = {
+            'repeat': args.repeat,
+            'median_ms': round(samples[len(samples) // 2], 1),
+            'min_ms': round(samples[0], 1),
+            'peak_rss_mb': round(max(r['rss_mb'] for r in runs), 1),
+            'torch_imported': runs[-1]['torch_imported'],
+        }
+        if runs[-1]['error']:
+            results[case]['error'] = runs[-1]['error']
+
+    report('startup', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
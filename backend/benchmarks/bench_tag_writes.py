@@ -0,0 +1,119 @@
+"""
+标签写入的 SQL 条数 (ImageSerializer.create / update 中的标签部分):
+  legacy    : 旧实现，逐个 Tag.objects.get_or_create + image.tags.add，更新时先 tags.clear()
+  set_based : tagging.resolve_tags 一次解析 + tags.add / tags.set 按差异写关联表
+
+在临时测试库中运行，不计 BEGIN / COMMIT / SAVEPOINT。set_based 的条数与 PINNED 比较，
+超出时以状态码 1 退出 (同样的条数由 apps/images/tests.py 的 TagWriteQueryTests 固定):
+    python -m benchmarks.bench_tag_writes --tags 10 --json out.json
+"""
+import argparse
+import sys
+
+from ._common import report, setup_django
+
+# 与标签数量无关的 SQL 条数上限
+PINNED = {
+    'create_existing_tags': 2,   # 查询标签 + 插入关联
+    'create_new_tags': 4,        # 查询标签 + 批量插入标签 + 取回主键 + 插入关联
+    'update_unchanged': 2,       # 查询标签 + 查询现有关联
+    'update_two_changed': 6,     # 查询 / 插入 / 取回标签 + 查询现有关联 + 删除 + 插入
+}
+
+_TRANSACTION = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+
+def legacy_add(image, names):
+    from apps.images.models import Tag
+    for name in names:
+        tag, _ = Tag.objects.get_or_create(name=name, defaults={'source': 0})
+        image.tags.add(tag)
+
+
+def legacy_set(image, names):
+    from apps.images.models import Tag
+    image.tags.clear()
+    for name in names:
+        tag, _ = Tag.objects.get_or_create(name=name)
+        image.tags.add(tag)
+
+
+def set_based_add(image, names):
+    from apps.images.tagging import resolve_tags
+    image.tags.add(*resolve_tags(names))
+
+
+def set_based_set(image, names):
+    from apps.images.tagging import resolve_tags
+    image.tags.set(resolve_tags(names))
+
+
+def count_queries(func, *args):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as ctx:
+        func(*args)
+    return sum(1 for q in ctx.captured_queries if not q['sql'].upper().startswith(_TRANSACTION))
+
+
+def run(impl, tag_count, prefix):
+    from apps.images.models import Image
+    from apps.users.models import User
+
+    add, set_ = (legacy_add, legacy_set) if impl == 'legacy' else (set_based_add, set_based_set)
+    user = User.objects.create(username=f'bench_{prefix}', email=f'{prefix}@bench.local')
+    names = [f'{prefix}_{i}' for i in range(tag_count)]
+
+    def new_image():
+        return Image.objects.create(user=user, img_url=f'uploads/bench/{prefix}.jpg')
+
+    counts = {'create_new_tags': count_queries(add, new_image(), names)}
+    image = new_image()
+    counts['create_existing_tags'] = count_queries(add, image, names)
+    counts['update_unchanged'] = count_queries(set_, image, names)
+    counts['update_two_changed'] = count_queries(set_, image, names[:-2] + [f'{prefix}_new_a', f'{prefix}_new_b'])
+
+    expected = set(names[:-2] + [f'{prefix}_new_a', f'{prefix}_new_b'])
+    assert set(image.tags.values_list('name', flat=True)) == expected, "标签写入结果不一致"
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tags', type=int, default=10, help="每张图片的标签数")
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+
+    # 在临时测试库中运行，不写入实际数据库
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        legacy = run('legacy', args.tags, 'legacy')
+        set_based = run('set_based', args.tags, 'set')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    results = {}
+    failed = []
+    for case, pinned in PINNED.items():
+        results[case] = {
+            'tags': args.tags,
+            'legacy_queries': legacy[case],
+            'set_based_queries': set_based[case],
+            'pinned': pinned,
+        }
+        if set_based[case] > pinned:
+            failed.append(case)
+
+    report('tag_writes', results, args.output)
+    if failed:
+        print(f"超出固定的 SQL 条数: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
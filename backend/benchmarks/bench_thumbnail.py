@@ -0,0 +1,153 @@
+"""
+缩略图生成的耗时与峰值内存对比:
+  legacy : 旧 make_thumbnail，完整解码原图 -> exif_transpose -> LANCZOS 缩到 4096 -> 缩到 300
+  draft  : utils.make_thumbnail，JPEG 按 DCT 缩放解码、HEIC 使用内嵌缩略图，再 reducing_gap 缩放
+
+每个 (样本, 实现) 在独立子进程中运行，峰值 RSS 取 VmHWM 相对导入完成后的增量，
+避免前一次运行的内存占用影响下一次。
+不指定图片时自动生成 48MP (8000x6000) 的 JPEG 和 HEIC (带 512px 内嵌缩略图) 样本:
+    python -m benchmarks.bench_thumbnail --repeat 5 --json out.json
+    python -m benchmarks.bench_thumbnail path/to/photos
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from ._common import image_paths, measure, report
+
+
+def make_samples(directory, size=(8000, 6000)):
+    """生成带 EXIF 方向信息的 48MP 渐变图"""
+    import pillow_heif
+    from PIL import Image as PilImage
+
+    pillow_heif.register_heif_opener()
+    gradient = PilImage.linear_gradient('L').resize(size)
+    img = PilImage.merge('RGB', (gradient, gradient.rotate(90, expand=False), gradient.transpose(PilImage.Transpose.FLIP_LEFT_RIGHT)))
+    exif = PilImage.Exif()
+    exif[0x0110] = 'Benchmark Camera'
+    exif[0x0112] = 6
+
+    paths = []
+    # 手机拍摄的 HEIC 通常自带内嵌缩略图
+    for ext, kwargs in (('jpg', {'quality': 92}), ('heic', {'quality': 80, 'thumbnails': [512]})):
+        path = os.path.join(directory, f'sample_48mp.{ext}')
+        img.save(path, exif=exif.tobytes(), **kwargs)
+        paths.append(path)
+    return paths
+
+
+def legacy_thumbnail(f, size=(300, 300)):
+    """旧实现 (保留用于对比)"""
+    from PIL import Image as PilImage, ImageOps
+
+    img = ImageOps.exif_transpose(PilImage.open(f))
+    if img.width > 4096 or img.height > 4096:
+        img.thumbnail((4096, 4096), PilImage.Resampling.LANCZOS)
+    if img.mode in ('RGBA', 'P'):
+        img = img.convert('RGB')
+    img.thumbnail(size)
+    thumb_io = io.BytesIO()
+    img.save(thumb_io, 'JPEG', quality=85)
+    return img.size
+
+
+def draft_thumbnail(f, size=(300, 300)):
+    from PIL import Image as PilImage
+    from apps.images.utils import make_thumbnail
+
+    thumb = make_thumbnail(f, size)
+    return PilImage.open(thumb).size
+
+
+IMPLEMENTATIONS = {'legacy': legacy_thumbnail, 'draft': draft_thumbnail}
+
+
+def _reset_peak_rss():
+    """Linux 下清零 VmHWM，使峰值只统计之后的运行；失败时退化为相减基线"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    # ru_maxrss 会跨 fork/exec 继承父进程的峰值，优先读取 /proc 的 VmHWM
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Linux 上 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(impl, path, repeat):
+    """子进程入口：输出一行 JSON"""
+    from ._common import setup_django
+
+    setup_django()
+    import apps.images.utils  # noqa: F401  导入开销计入基线
+
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    name = os.path.basename(path)
+    _reset_peak_rss()
+    baseline = _peak_rss_mb()
+
+    def run():
+        f = io.BytesIO(data)
+        f.name = name
+        return IMPLEMENTATIONS[impl](f)
+
+    thumb_size = run()
+    peak = _peak_rss_mb() - baseline
+    stats = measure(run, repeat=repeat, warmup=0)
+    stats['peak_rss_mb'] = round(peak, 1)
+    stats['thumb_size'] = 'x'.join(map(str, thumb_size))
+    print(json.dumps(stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='*', help="图片文件或目录，缺省时生成 48MP 样本")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='output')
+    parser.add_argument('--child', nargs=2, metavar=('IMPL', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], args.child[1], args.repeat)
+        return
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = image_paths(args.paths) if args.paths else make_samples(tmp)
+        for path in paths:
+            name = os.path.basename(path)
+            for impl in IMPLEMENTATIONS:
+                out = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_thumbnail', '--repeat', str(args.repeat), '--child', impl, path],
+                    cwd=backend_dir, capture_output=True, text=True, check=True,
+                )
+                results[f'{name}:{impl}'] = json.loads(out.stdout.strip().splitlines()[-1])
+
+            legacy, draft = results[f'{name}:legacy'], results[f'{name}:draft']
+            draft['speedup'] = round(legacy['mean_ms'] / draft['mean_ms'], 2)
+            if draft['peak_rss_mb'] > 0:
+                draft['rss_ratio'] = round(legacy['peak_rss_mb'] / draft['peak_rss_mb'], 2)
+
+    report('thumbnail', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+上传后处理各阶段耗时对比:
+  legacy : 旧流程，HEIC 转换、EXIF (open + verify + open)、缩略图、CLIP 预处理各自重新打开 / 解码
+  shared : utils.UploadImage，文件头与 EXIF 只解析一次，像素只解码一次并共享给缩略图和 CLIP
+
+不指定图片时自动生成 24MP (6000x4000) 的 JPEG 和 HEIC 样本:
+    python -m benchmarks.bench_upload --repeat 5 --json out.json
+    python -m benchmarks.bench_upload path/to/photos
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+from ._common import image_paths, measure, report, setup_django
+
+
+def make_samples(directory, size=(6000, 4000)):
+    """生成带 EXIF 的 24MP 渐变图 (纯色图压缩后太小，不具代表性)"""
+    import pillow_heif
+    from PIL import Image as PilImage
+
+    pillow_heif.register_heif_opener()
+    gradient = PilImage.linear_gradient('L').resize(size)
+    img = PilImage.merge('RGB', (gradient, gradient.rotate(90, expand=False), gradient.transpose(PilImage.Transpose.FLIP_LEFT_RIGHT)))
+    exif = PilImage.Exif()
+    exif[0x0110] = 'Benchmark Camera'
+    exif[0x0112] = 6  # 竖拍，需要旋转
+
+    paths = []
+    for ext, kwargs in (('jpg', {'quality': 92}), ('heic', {'quality': 80})):
+        path = os.path.join(directory, f'sample_24mp.{ext}')
+        img.save(path, exif=exif.tobytes(), **kwargs)
+        paths.append(path)
+    return paths
+
+
+class _Upload(io.BytesIO):
+    """模拟上传文件对象 (带 name)"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def legacy_heic_to_jpeg(f):
+    """旧的 handle_heic_image：frombytes 复制一份像素，再编码到内存中的 BytesIO"""
+    import pillow_heif
+    from PIL import Image as PilImage
+
+    if not f.name.lower().endswith(('.heic', '.heif')):
+        return f
+    f.seek(0)
+    heif_file = pillow_heif.read_heif(f)
+    img = PilImage.frombytes(heif_file.mode, heif_file.size, heif_file.data, "raw", heif_file.mode, heif_file.stride)
+    img = img.convert('RGB')
+    exif_data = heif_file.info.get('exif')
+    output = _Upload(b'', f.name.rsplit('.', 1)[0] + '.jpg')
+    img.save(output, format='JPEG', quality=95, exif=exif_data if exif_data else b"")
+    output.seek(0)
+    return output
+
+
+def legacy_pipeline(data, name, timings):
+    """旧流程 (保留用于对比)：每个阶段各自打开文件"""
+    from PIL import Image as PilImage, ImageOps
+
+    f = _Upload(data, name)
+
+    start = time.perf_counter()
+    f = legacy_heic_to_jpeg(f)
+    timings['heic_to_jpeg'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    f.seek(0)
+    img = PilImage.open(f)
+    img.verify()
+    f.seek(0)
+    img = PilImage.open(f)
+    img.getexif()
+    timings['exif'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    f.seek(0)
+    img = ImageOps.exif_transpose(PilImage.open(f))
+    if img.width > 4096 or img.height > 4096:
+        img.thumbnail((4096, 4096), PilImage.Resampling.LANCZOS)
+    img = img.convert('RGB')
+    img.thumbnail((300, 300))
+    img.save(io.BytesIO(), 'JPEG', quality=85)
+    timings['thumbnail'] = (time.perf_counter() - start) * 1000
+
+    # classify_image 再次打开原图，CLIP 预处理前需要完整解码
+    start = time.perf_counter()
+    f.seek(0)
+    PilImage.open(f).convert('RGB').resize((224, 224))
+    timings['clip_input'] = (time.perf_counter() - start) * 1000
+
+
+def shared_pipeline(data, name, timings):
+    from apps.images.utils import UploadImage
+
+    ctx = UploadImage(_Upload(data, name))
+    if ctx.is_heic:
+        ctx.to_jpeg()
+    ctx.exif_data()
+    ctx.thumbnail()
+
+    start = time.perf_counter()
+    ctx.working_image().resize((224, 224))
+    ctx.timings['clip_input'] = (time.perf_counter() - start) * 1000
+    timings.update(ctx.timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='*', help="图片文件或目录，缺省时生成 24MP 样本")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='output')
+    args = parser.parse_args()
+
+    setup_django()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = image_paths(args.paths) if args.paths else make_samples(tmp)
+        samples = [(os.path.basename(p), open(p, 'rb').read()) for p in paths]
+
+    results = {}
+    for name, data in samples:
+        for label, pipeline in (('legacy', legacy_pipeline), ('shared', shared_pipeline)):
+            stages = {}
+
+            def run():
+                timings = {}
+                pipeline(data, name, timings)
+                for stage, ms in timings.items():
+                    stages.setdefault(stage, []).append(ms)
+
+            run()  # 预热，不计入统计
+            stages.clear()
+            stats = measure(run, repeat=args.repeat, warmup=0)
+            for stage, values in stages.items():
+                stats[f'{stage}_ms'] = round(sum(values) / len(values), 3)
+            results[f'{name}:{label}'] = stats
+
+        legacy, shared = results[f'{name}:legacy'], results[f'{name}:shared']
+        shared['speedup'] = round(legacy['mean_ms'] / shared['mean_ms'], 2)
+
+    report('upload_pipeline', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+N 个并发大文件上传时工作进程的峰值内存:
+  inmemory : 旧配置，FILE_UPLOAD_MAX_MEMORY_SIZE=50MB (上传整个放在内存)，解码不限额
+  spooled  : 当前配置，上传写入临时文件，HEIC 转换直接编码到临时文件，完整解码受 IMAGE_DECODE_MEMORY_LIMIT_MB 限制
+
+请求经由 Django 的 WSGIHandler，请求体从磁盘文件流式读取 (与 gunicorn 一致)，
+同步处理模式 (IMAGE_PROCESSING_ASYNC=False)，即上传、HEIC 转换、缩略图都在请求线程内完成；不加载 CLIP 模型。
+每种配置在独立子进程中运行，峰值 RSS 取 VmHWM 相对基线的增量；
+spooled 的峰值超过 IMAGE_DECODE_MEMORY_LIMIT_MB + 每个请求 --per-request-mb 时以非 0 状态退出。
+使用当前配置的数据库 (需已迁移)，media 写入临时目录，结束后删除测试用户及其图片。
+apps/images/tests.py 的 UploadMemoryTests 在测试库中对当前配置做同样的检查 (python manage.py test，需 MySQL)。
+    python -m benchmarks.bench_upload_memory --concurrency 8 --json out.json
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .bench_thumbnail import _peak_rss_mb, _reset_peak_rss
+from ._common import report, setup_django
+
+BOUNDARY = 'bench-upload-memory-boundary'
+
+MODES = {
+    'inmemory': {'FILE_UPLOAD_MAX_MEMORY_SIZE': 52428800, 'IMAGE_DECODE_MEMORY_LIMIT_MB': 0},
+    'spooled': {},
+}
+
+# CLIP 推理服务地址不存在且不退回本进程推理：不加载模型 (数百 MB)，峰值只统计上传与图片处理
+NO_CLIP = {'CLIP_INFERENCE_SOCKET': os.path.join(tempfile.gettempdir(), 'no-clip-server.sock'),
+           'CLIP_INFERENCE_FALLBACK': False}
+
+
+def make_samples(directory, upload_mb=40):
+    """
+    jpg : 随机噪声 JPEG (几乎不可压缩)，文件约 upload_mb
+    heic: 24MP 渐变 HEIC，不带内嵌缩略图，需要完整解码
+    """
+    import pillow_heif
+    from PIL import Image as PilImage
+
+    pillow_heif.register_heif_opener()
+    # quality=100 的噪声图约 2 字节 / 像素
+    pixels = upload_mb * 1024 * 1024 // 2
+    width = int((pixels * 4 / 3) ** 0.5)
+    height = pixels // width
+    noise = PilImage.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    jpg = os.path.join(directory, 'noise.jpg')
+    noise.save(jpg, quality=100)
+
+    gradient = PilImage.linear_gradient('L').resize((6000, 4000))
+    img = PilImage.merge('RGB', (gradient, gradient.rotate(90), gradient.transpose(PilImage.Transpose.FLIP_LEFT_RIGHT)))
+    heic = os.path.join(directory, 'gradient_24mp.heic')
+    img.save(heic, quality=80, thumbnails=[])
+    return [jpg, heic]
+
+
+def write_body(path, sample):
+    """把 multipart 请求体写到磁盘，避免在内存中构造"""
+    name = os.path.basename(sample)
+    with open(path, 'wb') as out, open(sample, 'rb') as src:
+        out.write(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="is_public"\r\n\r\nfalse\r\n'
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="img_url"; filename="{name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+        )
+        while chunk := src.read(1024 * 1024):
+            out.write(chunk)
+        out.write(f'\r\n--{BOUNDARY}--\r\n'.encode())
+    return path
+
+
+def run_uploads(bodies, token):
+    """
+    经 WSGIHandler 并发发送 bodies 中的上传请求 (每个请求一个线程)
+    :return: (各请求的状态行, 耗时 ms, 峰值 RSS 相对开始前的增量 MB)
+    """
+    from django.core.handlers.wsgi import WSGIHandler
+
+    handler = WSGIHandler()
+    statuses = []
+
+    def upload(body):
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '/api/images/',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': 'localhost',
+            'wsgi.url_scheme': 'http',
+            'CONTENT_TYPE': f'multipart/form-data; boundary={BOUNDARY}',
+            'CONTENT_LENGTH': str(os.path.getsize(body)),
+            'HTTP_AUTHORIZATION': f'Bearer {token}',
+            'wsgi.errors': sys.stderr,
+        }
+        with open(body, 'rb') as f:
+            environ['wsgi.input'] = f
+            response = handler(environ, lambda status, headers: statuses.append(status))
+            b''.join(response)
+            response.close()
+
+    _reset_peak_rss()
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=upload, args=(body,)) for body in bodies]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = (time.perf_counter() - start) * 1000
+    return statuses, elapsed, _peak_rss_mb() - baseline
+
+
+def child(mode, bodies):
+    overrides = MODES[mode]
+    for key, value in overrides.items():
+        os.environ[key] = str(value)
+    setup_django()
+
+    from django.conf import settings
+    from django.test.utils import override_settings
+    from rest_framework_simplejwt.tokens import AccessToken
+    from apps.images.blobs import release
+    from apps.images.models import Image
+    from apps.images.utils import get_decode_budget
+    from apps.users.models import User
+
+    user, _ = User.objects.get_or_create(username='bench_upload_memory', defaults={'email': 'bench@example.com'})
+    token = str(AccessToken.for_user(user))
+
+    with tempfile.TemporaryDirectory() as media, override_settings(
+        MEDIA_ROOT=media, IMAGE_PROCESSING_ASYNC=False, ALLOWED_HOSTS=['*'], **NO_CLIP, **overrides
+    ):
+        try:
+            statuses, elapsed, peak = run_uploads(bodies, token)
+        finally:
+            # 删除用户时图片级联删除，不经过 release()；先释放原图引用，否则 Blob 记录留在库中，
+            # 下次运行 (media 为新的临时目录) 会误以为原图已存在
+            for name in Image.objects.filter(user=user).values_list('img_url', flat=True):
+                release(name)
+            user.delete()
+
+    print(json.dumps({
+        'uploads': len(bodies),
+        'ok': sum(1 for s in statuses if s.startswith('201')),
+        'wall_ms': round(elapsed, 1),
+        'peak_rss_mb': round(peak, 1),
+        'decode_limit_mb': getattr(settings, 'IMAGE_DECODE_MEMORY_LIMIT_MB', 0),
+        'decode_waits': get_decode_budget().stats()['waits'],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, default=8, help="并发上传数，JPEG 与 HEIC 各一半")
+    parser.add_argument('--upload-mb', type=int, default=40)
+    parser.add_argument('--per-request-mb', type=int, default=24, help="每个请求除完整解码外允许的内存 (工作图、编码缓冲等)")
+    parser.add_argument('--json', dest='output')
+    parser.add_argument('--child', nargs='+', metavar='ARG', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], args.child[1:])
+        return
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        samples = make_samples(tmp, args.upload_mb)
+        bodies = [
+            write_body(os.path.join(tmp, f'body_{i}'), samples[i % len(samples)])
+            for i in range(args.concurrency)
+        ]
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_upload_memory', '--child', mode, *bodies],
+                cwd=backend_dir, capture_output=True, text=True,
+            )
+            if out.returncode:
+                sys.stderr.write(out.stderr)
+                sys.exit(out.returncode)
+            results[mode] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    spooled = results['spooled']
+    bound = spooled['decode_limit_mb'] + args.per_request_mb * args.concurrency
+    spooled['bound_mb'] = bound
+    report('upload_memory', results, args.output)
+
+    if spooled['ok'] != spooled['uploads'] or (spooled['decode_limit_mb'] and spooled['peak_rss_mb'] > bound):
+        print(f"失败：峰值 {spooled['peak_rss_mb']}MB 超过上限 {bound}MB，或有上传失败")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+合成的基准语料，同一 --seed 生成的内容相同，不同提交之间的结果可以直接对比:
+  文件 : JPEG / PNG / HEIC 照片 (12MP)，带相机厂商与型号、拍摄时间、ISO / 光圈 / 快门、方向和 GPS 等 EXIF，
+         另有 48MP (12000x4000) 的全景图；像素为渐变叠加噪声，压缩后的大小与真实照片相近。
+         同时写出 manifest.json，记录每个文件的格式、尺寸和写入的 EXIF。
+         HEIC 编码较慢 (12MP 约半分钟)，生成一次后用各基准的 --corpus 参数复用
+  数据库: seed_database() 写入图片记录 (多个用户、相册、标签，公开 / 私有混合，不需要图片文件)，
+         供 bench_endpoints / bench_query_plans 使用
+
+    python -m benchmarks.corpus path/to/corpus --count 12 --panoramas 2
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+FORMATS = ('jpg', 'png', 'heic')
+PHOTO_SIZE = (4032, 3024)
+PANORAMA_SIZE = (12000, 4000)
+
+CAMERAS = (
+    ('Apple', 'iPhone 15 Pro'), ('Apple', 'iPhone 13'), ('HUAWEI', 'ALN-AL00'), ('Xiaomi', '23127PN0CC'),
+    ('Canon', 'Canon EOS R6'), ('SONY', 'ILCE-7M4'), ('NIKON CORPORATION', 'NIKON Z 6_2'), ('FUJIFILM', 'X-T5'),
+)
+PLACES = (
+    (39.9042, 116.4074), (31.2304, 121.4737), (30.2741, 120.1551), (22.5431, 114.0579),
+    (35.6762, 139.6503), (48.8566, 2.3522), (-33.8688, 151.2093), (40.7128, -74.0060),
+)
+LOCATIONS = ('北京市 东城区', '上海市 黄浦区', '浙江省 杭州市', '广东省 深圳市', '東京都 渋谷区', 'Paris', 'Sydney', 'New York')
+# 方向: 1 正常，3 旋转 180°，6 / 8 竖拍
+ORIENTATIONS = (1, 1, 6, 8, 3)
+TAG_WORDS = (
+    'beach', 'sunset', 'mountain', 'city', 'cat', 'dog', 'food', 'flower', 'snow', 'night',
+    'portrait', 'street', 'forest', 'lake', 'bridge', 'car', 'sky', 'temple', 'museum', 'party',
+)
+START = datetime(2018, 1, 1, tzinfo=timezone.utc)
+SPAN_SECONDS = 6 * 365 * 24 * 3600
+
+
+def _pixels(rng, size):
+    """渐变叠加低频噪声；噪声在 1/8 分辨率生成后放大，12MP 的 JPEG 约 1.5 MB、HEIC 约 2 MB"""
+    import numpy as np
+    from PIL import Image as PilImage
+
+    gradient = PilImage.linear_gradient('L').resize(size)
+    channels = [gradient, gradient.rotate(90).resize(size), gradient.transpose(PilImage.Transpose.FLIP_LEFT_RIGHT)]
+    rng.shuffle(channels)
+    base = PilImage.merge('RGB', channels)
+
+    noise_rng = np.random.default_rng(rng.randrange(2 ** 32))
+    small = noise_rng.integers(0, 256, size=(size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    noise = PilImage.fromarray(small, 'RGB').resize(size, PilImage.Resampling.BILINEAR)
+    return PilImage.blend(base, noise, 0.15)
+
+
+def _dms(value):
+    from PIL.TiffImagePlugin import IFDRational
+
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600, 2)
+    return IFDRational(degrees, 1), IFDRational(minutes, 1), IFDRational(int(seconds * 100), 100)
+
+
+def make_exif(rng, gps=True):
+    """随机但可复现的 EXIF，返回 (PIL Exif, 写入内容的说明)"""
+    from PIL import Image as PilImage
+    from PIL.TiffImagePlugin import IFDRational
+
+    make, model = rng.choice(CAMERAS)
+    shot = START + timedelta(seconds=rng.randrange(SPAN_SECONDS))
+    iso = rng.choice((50, 100, 200, 400, 800, 1600, 3200))
+    f_stop = rng.choice((1.8, 2.8, 4.0, 5.6, 8.0))
+    shutter = rng.choice((30, 60, 125, 250, 500, 1000, 4000))
+    orientation = rng.choice(ORIENTATIONS)
+
+    exif = PilImage.Exif()
+    exif[0x010F] = make
+    exif[0x0110] = model
+    exif[0x0112] = orientation
+    exif[0x0131] = 'imgmanager benchmark corpus'
+    sub = exif.get_ifd(0x8769)
+    sub[0x9003] = shot.strftime('%Y:%m:%d %H:%M:%S')
+    sub[0x8827] = iso
+    sub[0x829D] = IFDRational(int(f_stop * 10), 10)
+    sub[0x829A] = IFDRational(1, shutter)
+
+    meta = {
+        'camera_model': model, 'shoot_time': shot.strftime('%Y-%m-%d %H:%M:%S'), 'iso': iso,
+        'f_stop': f_stop, 'exposure_time': f'1/{shutter}', 'orientation': orientation, 'gps': None,
+    }
+    if gps:
+        lat, lon = rng.choice(PLACES)
+        lat += rng.uniform(-0.05, 0.05)
+        lon += rng.uniform(-0.05, 0.05)
+        gps_ifd = exif.get_ifd(0x8825)
+        gps_ifd[1] = 'N' if lat >= 0 else 'S'
+        gps_ifd[2] = _dms(lat)
+        gps_ifd[3] = 'E' if lon >= 0 else 'W'
+        gps_ifd[4] = _dms(lon)
+        meta['gps'] = [round(lat, 4), round(lon, 4)]
+    return exif, meta
+
+
+def save(img, path, fmt, exif):
+    import pillow_heif
+
+    pillow_heif.register_heif_opener()
+    if fmt == 'jpg':
+        img.save(path, 'JPEG', quality=92, exif=exif.tobytes())
+    elif fmt == 'png':
+        img.save(path, 'PNG', exif=exif.tobytes())
+    else:
+        # 手机拍摄的 HEIC 通常自带内嵌缩略图
+        img.save(path, 'HEIF', quality=80, exif=exif.tobytes(), thumbnails=[512])
+
+
+def generate(directory, count=12, panoramas=2, formats=FORMATS, seed=0, photo_size=PHOTO_SIZE):
+    """
+    在 directory 中生成 count 张照片 (各格式轮流) 和 panoramas 张全景图 (JPEG / HEIC 轮流)
+    :return: manifest (文件说明列表)，同时写入 directory/manifest.json
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    jobs = [(f'{i:04d}_12mp', formats[i % len(formats)], photo_size) for i in range(count)]
+    jobs += [(f'{i:04d}_pano_48mp', ('jpg', 'heic')[i % 2], PANORAMA_SIZE) for i in range(panoramas)]
+
+    manifest = []
+    for stem, fmt, size in jobs:
+        exif, meta = make_exif(rng, gps=rng.random() < 0.8)
+        name = f'{stem}.{fmt}'
+        path = os.path.join(directory, name)
+        save(_pixels(rng, size), path, fmt, exif)
+        manifest.append(dict(meta, name=name, format=fmt, width=size[0], height=size[1], bytes=os.path.getsize(path)))
+
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def seed_database(count, users=20, categories=50, tags=300, tags_per_image=3, seed=42):
+    """
+    写入 count 张图片记录及其标签关联、检索索引和分面计数 (需已初始化 Django，通常在临时测试库中调用)
+    :return: {'user', 'category', 'tag', 'public_image'}：各接口基准使用的样本对象
+    """
+    from django.core.management import call_command
+
+    from apps.images.models import Category, Image, Tag
+    from apps.images.search import reindex_images
+    from apps.users.models import User
+
+    rng = random.Random(seed)
+    User.objects.bulk_create([User(username=f'corpus_{i}', email=f'corpus_{i}@bench.local') for i in range(users)])
+    Category.objects.bulk_create([Category(name=f'album {i}') for i in range(categories)])
+    Tag.objects.bulk_create([
+        Tag(name=TAG_WORDS[i % len(TAG_WORDS)] + (f'_{i // len(TAG_WORDS)}' if i >= len(TAG_WORDS) else ''))
+        for i in range(tags)
+    ])
+    # bulk_create 在 MySQL 上不返回主键，重新查询
+    owners = list(User.objects.filter(username__startswith='corpus_').order_by('id'))
+    albums = list(Category.objects.filter(name__startswith='album ').order_by('id'))
+    labels = list(Tag.objects.order_by('id'))
+
+    floor = Image.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    Image.objects.bulk_create([
+        Image(
+            user=rng.choice(owners),
+            category=rng.choice(albums) if rng.random() < 0.7 else None,
+            img_url=f'originals/corpus/{i}.jpg', thumb_url=f'thumbs/corpus/{i}_thumb.jpg',
+            width=4032, height=3024, file_size=3072, camera_model=rng.choice(CAMERAS)[1],
+            shoot_time=START + timedelta(seconds=rng.randrange(SPAN_SECONDS)) if rng.random() < 0.9 else None,
+            location=rng.choice(LOCATIONS) if rng.random() < 0.5 else None,
+            is_public=rng.random() < 0.6, processing_status=Image.STATUS_DONE,
+        )
+        for i in range(count)
+    ], batch_size=2000)
+
+    image_ids = list(Image.objects.filter(id__gt=floor).order_by('id').values_list('id', flat=True))
+    Through = Image.tags.through
+    Through.objects.bulk_create([
+        Through(image_id=image_id, tag_id=tag.id)
+        for image_id in image_ids for tag in rng.sample(labels, tags_per_image)
+    ], batch_size=5000)
+    reindex_images(image_ids)
+    with open(os.devnull, 'w') as devnull:
+        call_command('reconcile_facets', stdout=devnull)
+
+    return {
+        'user': owners[0],
+        'category': albums[0],
+        'tag': labels[0],
+        'public_image': Image.objects.filter(id__gt=floor, is_public=True).order_by('id').first(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('--count', type=int, default=12, help="12MP 照片数 (JPEG / PNG / HEIC 轮流)")
+    parser.add_argument('--panoramas', type=int, default=2, help="48MP 全景图数 (JPEG / HEIC 轮流)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = generate(args.directory, args.count, args.panoramas, seed=args.seed)
+    total = sum(item['bytes'] for item in manifest)
+    print(f"已生成 {len(manifest)} 个文件，共 {total / 1024 / 1024:.1f} MB: {args.directory}")
+
+
+if __name__ == '__main__':
+    main()
@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 放在最前面，请求耗时包含其余中间件 (见 apps/images/metrics.py)
+    'apps.images.metrics.ServerTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -145,8 +147,113 @@ REST_FRAMEWORK = {
 # 自定义用户模型指向
 AUTH_USER_MODEL = 'users.User'
 
-DATA_UPLOAD_MAX_MEMORY_SIZE = 52428800 
-FILE_UPLOAD_MAX_MEMORY_SIZE = 52428800
+# CLIP 语义检索
+# 图像向量库目录 (float16 矩阵 + id 文件，mmap 读取)
+CLIP_EMBEDDING_DIR = os.environ.get('CLIP_EMBEDDING_DIR', os.path.join(BASE_DIR, 'data', 'embeddings'))
+# CLIP 文本编码器只理解英文，中文检索词先用 Google 翻译为英文再编码 (检索词会发送给第三方，需要访问外网)；
+# 设为 False 或翻译失败时，非英文检索词只按关键词排序
+CLIP_TRANSLATE_QUERY = os.environ.get('CLIP_TRANSLATE_QUERY', 'True') == 'True'
+# 翻译最多等待的秒数，超时只按关键词排序
+CLIP_TRANSLATE_TIMEOUT = float(os.environ.get('CLIP_TRANSLATE_TIMEOUT', 1.5))
+# 模型在第一次推理时才加载；为 True 时 gunicorn 工作进程和 process_images 启动后在后台线程预先加载
+CLIP_PRELOAD = os.environ.get('CLIP_PRELOAD', 'False') == 'True'
+# 模型加载失败 (如镜像站超时) 后的重试间隔 (秒)，每次失败翻倍，最长 CLIP_LOAD_RETRY_MAX_SECONDS
+CLIP_LOAD_RETRY_SECONDS = int(os.environ.get('CLIP_LOAD_RETRY_SECONDS', 30))
+CLIP_LOAD_RETRY_MAX_SECONDS = int(os.environ.get('CLIP_LOAD_RETRY_MAX_SECONDS', 600))
+# 推理后端 (均由同一个离线模型目录构建，切换后无需重建向量库):
+#   torch       fp32，有 GPU 时使用 GPU (默认)
+#   torch-int8  torch 动态量化 (Linear 层 int8)，仅 CPU
+#   onnx        导出为 ONNX 后用 onnxruntime 运行，仅 CPU (需要 pip install onnxruntime onnx)
+#   onnx-int8   在 onnx 基础上对权重做 int8 动态量化
+# 后三者与 fp32 的标签一致性尚未在离线模型上测得，切换前先用 benchmarks/bench_backends.py 在本地图片上对比
+CLIP_BACKEND = os.environ.get('CLIP_BACKEND', 'torch')
+# 导出的 ONNX 模型缓存目录 (首次使用 onnx 后端时自动导出)
+CLIP_ONNX_DIR = os.environ.get('CLIP_ONNX_DIR', os.path.join(BASE_DIR, 'data', 'onnx'))
+# 推理守护进程 (`python manage.py clip_server`) 的 Unix socket；为空时在当前进程内加载模型推理
+CLIP_INFERENCE_SOCKET = os.environ.get('CLIP_INFERENCE_SOCKET', '')
+CLIP_INFERENCE_TIMEOUT = float(os.environ.get('CLIP_INFERENCE_TIMEOUT', 10))
+# 守护进程不可用时是否退回本进程推理 (每个进程会各自加载一份模型)；False 时直接返回空结果
+CLIP_INFERENCE_FALLBACK = os.environ.get('CLIP_INFERENCE_FALLBACK', 'False') == 'True'
+# /analyze/ 动态批处理 (守护进程同样使用这两项)：最多等待多少毫秒凑批、单批最多多少张
+CLIP_BATCH_MAX_WAIT_MS = int(os.environ.get('CLIP_BATCH_MAX_WAIT_MS', 10))
+CLIP_BATCH_MAX_SIZE = int(os.environ.get('CLIP_BATCH_MAX_SIZE', 16))
+
+# 上传后处理 (HEIC 转换、EXIF、地理编码、缩略图、AI 标签)
+# True: 上传接口立即返回，由 `python manage.py process_images` 后台处理；False: 在请求内同步处理
+IMAGE_PROCESSING_ASYNC = os.environ.get('IMAGE_PROCESSING_ASYNC', 'True') == 'True'
+IMAGE_WORKER_THREADS = int(os.environ.get('IMAGE_WORKER_THREADS', 2))
+IMAGE_JOB_MAX_ATTEMPTS = 3
+# HEIC 转换、EXIF、缩略图等 CPU 密集步骤的进程池大小 (process_images 与同步模式的批量上传使用)，0 表示不使用进程池
+IMAGE_PROCESS_POOL_SIZE = int(os.environ.get('IMAGE_PROCESS_POOL_SIZE', os.cpu_count() or 1))
+# 批量上传 (POST /api/images/bulk/) 单次最多的文件数；Django 默认只允许 100 个文件
+IMAGE_BULK_UPLOAD_MAX_FILES = int(os.environ.get('IMAGE_BULK_UPLOAD_MAX_FILES', 500))
+DATA_UPLOAD_MAX_NUMBER_FILES = IMAGE_BULK_UPLOAD_MAX_FILES
+# 批量上传单次请求的文件总大小 (MB)，须与 frontend/nginx.conf 中 /api/images/bulk/ 的 client_max_body_size 一致
+# 默认 2048MB / 500 个文件，平均每个文件约 4MB (手机照片 HEIC 2-3MB、JPEG 3-5MB)；文件更大时请分批上传
+IMAGE_BULK_UPLOAD_MAX_MB = int(os.environ.get('IMAGE_BULK_UPLOAD_MAX_MB', 2048))
+# running 状态超过该秒数的任务视为工作进程已崩溃，重新入队
+IMAGE_JOB_TIMEOUT = 600
+
+# 派生图 (多尺寸 WebP / AVIF)，首次请求时生成，可用 `python manage.py derivatives warm` 预先生成
+IMAGE_DERIVATIVE_WIDTHS = [int(w) for w in os.environ.get('IMAGE_DERIVATIVE_WIDTHS', '300,800,1600,2560').split(',')]
+# 可选 webp、avif (AVIF 需要 Pillow 支持，不支持时自动跳过)
+IMAGE_DERIVATIVE_FORMATS = os.environ.get('IMAGE_DERIVATIVE_FORMATS', 'webp').split(',')
+IMAGE_DERIVATIVE_QUALITY = {'webp': 80, 'avif': 60}
+
+# 近似重复检测：两张图片 64 位感知哈希的汉明距离不超过该值时视为重复 (接口可用 ?distance= 覆盖)
+IMAGE_DUPLICATE_DISTANCE = int(os.environ.get('IMAGE_DUPLICATE_DISTANCE', 8))
+
+# 缓存 (图片列表 / 详情的响应缓存及其生成代号，见 apps/images/responsecache.py)
+# backend 与 worker 必须共用同一个缓存：默认使用 data 目录下的文件缓存 (docker-compose 中两者挂载同一个卷)，
+# 设置 REDIS_URL 时改用 Redis (需 pip install redis)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', os.path.join(BASE_DIR, 'data', 'cache')),
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+# 响应缓存的超时 (秒)，0 表示不缓存
+IMAGE_RESPONSE_CACHE_TIMEOUT = int(os.environ.get('IMAGE_RESPONSE_CACHE_TIMEOUT', 300))
+
+# 耗时 / 计数统计 (apps/images/metrics.py)：Prometheus 采集 GET /api/metrics/
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+# Server-Timing 响应头 (各步骤耗时、SQL 条数) 默认只返回给管理员 (is_staff)；设为 True 时对所有请求返回
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', 'False') == 'True'
+# 采集时需带 Authorization: Bearer <token>；为空时只允许本机访问
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# process_images 提供 /metrics 的端口，0 表示不提供
+METRICS_WORKER_PORT = int(os.environ.get('METRICS_WORKER_PORT', 0))
+
+# 逆地理编码
+# 缓存网格精度 (小数位数，3 位约 110 米)，同一网格内的照片共用一次查询结果
+GEOCODE_CACHE_PRECISION = int(os.environ.get('GEOCODE_CACHE_PRECISION', 3))
+GEOCODE_LRU_SIZE = 1024
+# 实际执行查询的函数，签名为 (lat, lon) -> 地址；测试时可替换为本地桩函数
+GEOCODER = 'apps.images.geocoding.nominatim_reverse'
+
+# 上传文件超过该大小 (默认 2.5MB) 时流式写入临时文件，而不是整个放在工作进程内存里；
+# 单个文件的大小上限由 Nginx 的 client_max_body_size (50M) 控制
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.environ.get('FILE_UPLOAD_MAX_MEMORY_SIZE', 2621440))
+# 请求体中非文件字段的上限 (文件不计入)
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440
+# 临时文件目录，默认为系统临时目录
+FILE_UPLOAD_TEMP_DIR = os.environ.get('FILE_UPLOAD_TEMP_DIR') or None
+# 接收上传的同时计算 SHA-256，原图按内容寻址保存 (见 apps/images/blobs.py)
+FILE_UPLOAD_HANDLERS = [
+    'apps.images.uploadhandlers.HashingMemoryFileUploadHandler',
+    'apps.images.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+# 每个进程同时用于完整解码图片 (如 HEIC 转 JPEG) 的内存上限 (MB)，超出时排队，0 表示不限制
+IMAGE_DECODE_MEMORY_LIMIT_MB = int(os.environ.get('IMAGE_DECODE_MEMORY_LIMIT_MB', 512))
 
 SIMPLE_JWT = {
     # Access Token
@@ -23,6 +23,7 @@ from apps.users.views import RegisterView, UserInfoView # 记得在 views.py 加
 from rest_framework.routers import DefaultRouter
 from apps.images.views import ImageViewSet, TagViewSet, CategoryViewSet
 from apps.images.views import MCPView
+from apps.images.metrics import metrics_view
 
 router = DefaultRouter()
 router.register(r'images', ImageViewSet, basename='image')
@@ -37,4 +38,5 @@ urlpatterns = [
     path('api/auth/me/', UserInfoView.as_view()), # 获取当前用户信息
     path('api/', include(router.urls)),
     path('api/mcp/search/',MCPView.as_view()),
+    path('api/metrics/', metrics_view),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -13,6 +13,6 @@ python manage.py makemigrations
 python manage.py migrate
 python manage.py collectstatic --noinput
 
-# 启动 Gunicorn 服务 (端口 8000)
+# 启动 Gunicorn 服务 (端口 8000)，多线程以便 /analyze/ 的并发请求能合并批处理
 echo "Starting Server..."
-exec gunicorn config.wsgi:application --bind 0.0.0.0:8000
\ No newline at end of file
+exec gunicorn config.wsgi:application --bind 0.0.0.0:8000 --threads 4
\ No newline at end of file
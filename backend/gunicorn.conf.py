@@ -0,0 +1,14 @@
+# gunicorn 启动时自动读取当前目录下的本文件
+
+def post_worker_init(worker):
+    """
+    CLIP_PRELOAD=True 时，每个工作进程 fork 之后在后台线程加载 CLIP，
+    不能放在 --preload 的主进程里 (CUDA 上下文无法跨 fork 使用)
+    """
+    import threading
+    from django.conf import settings
+
+    # 使用推理守护进程时，本进程不需要加载模型
+    if getattr(settings, 'CLIP_PRELOAD', False) and not getattr(settings, 'CLIP_INFERENCE_SOCKET', ''):
+        from apps.images.ai_utils import warmup
+        threading.Thread(target=warmup, name='clip-warmup', daemon=True).start()
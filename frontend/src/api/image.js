@@ -8,6 +8,11 @@ export function getImageDetail(id) {
   return request.get(`/images/${id}/`)
 }
 
+// 查询上传后处理进度 (pending / processing / done / failed)
+export function getImageStatus(id) {
+  return request.get(`/images/${id}/status/`)
+}
+
 export function getCategories() {
   return request.get('/categories/')
 }